@@ -1,19 +1,19 @@
 # TX.py
 
-from pyLoRa.lora_module import LoRa
-from pyLoRa.configure import run_checks, check_spi, check_gpio
+from radio import open_radio
 import time
 
 def configure_lora():
     """
     Run preflight checks and configure LoRa module.
     """
+    from pyLoRa.configure import run_checks
     run_checks()
     return True
 
 def main():
     configure_lora()
-    lora = LoRa()
+    lora = open_radio()
     lora.reset()
     lora.set_frequency(433)
     lora.set_tx_power(14)
@@ -1,12 +1,12 @@
 # TX.py
 
-from pyLoRa.lora_module import LoRa
-from pyLoRa.configure import run_checks, check_spi, check_gpio
+from radio import open_radio
 
 def configure_lora():
     """
     Run preflight checks and configure LoRa module.
     """
+    from pyLoRa.configure import run_checks
     if not run_checks():
         print("[❌] System check failed. Please resolve issues and try again.")
         return False
@@ -14,7 +14,7 @@ def configure_lora():
     return True
 
 def main():
-    lora = LoRa()
+    lora = open_radio()
     lora.reset()
     lora.set_frequency(433)
     lora.set_tx_power(14)
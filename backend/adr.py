@@ -0,0 +1,364 @@
+# adr.py
+
+import itertools
+import math
+import struct
+import threading
+import time
+
+import metrics
+from frame_codec import Frame, FrameCodec, FrameError, FLAG_ADR
+from logs import get_logger
+from outbox import PRIORITY_EMERGENCY
+from radio import SNR_LIMIT, airtime
+
+log = get_logger("adr")
+
+# ADR payload: target length, target (BROADCAST = every node), then
+# spreading factor, bandwidth index and TX power in dBm
+ADR_TARGET = struct.Struct("!B")
+ADR_SETTINGS = struct.Struct("!BBb")
+BROADCAST = "*"
+# SX127x bandwidth steps, indexed as in RegModemConfig1
+BANDWIDTHS = (7800, 10400, 15600, 20800, 31250, 41700, 62500, 125000, 250000, 500000)
+REFERENCE_BANDWIDTH = 125000
+REFERENCE_PAYLOAD = 64  # bytes, for comparing data rates by airtime
+
+CHANGES = {kind: metrics.counter("hde_adr_changes_total", "Data-rate and power commands sent", {"kind": kind})
+           for kind in ("rate", "power")}
+
+
+def encode_adr(node: str, seq: int, target: str, sf: int, bandwidth: int, tx_power: int) -> bytes:
+    """
+    Rate command for `target`: every node on BROADCAST switches to sf and
+    bandwidth; a named node sets its TX power (sf 0 = keep the data rate).
+    """
+    target = target.encode("utf-8")[:255]
+    payload = b"".join((ADR_TARGET.pack(len(target)), target,
+                        ADR_SETTINGS.pack(sf, BANDWIDTHS.index(bandwidth) if sf else 0, tx_power)))
+    frame = Frame(node, seq, 0, 0, int(time.time()), payload, flags=FLAG_ADR)
+    return FrameCodec.encode_binary(frame)
+
+
+def decode_adr(frame: Frame) -> tuple:
+    """
+    Returns (target, sf, bandwidth, tx_power) of an ADR frame.
+    """
+    payload = frame.payload
+    (target_len,) = ADR_TARGET.unpack_from(payload, 0)
+    target = str(payload[1:1 + target_len], "utf-8")
+    sf, bw_index, tx_power = ADR_SETTINGS.unpack_from(payload, 1 + target_len)
+    return target, sf, BANDWIDTHS[bw_index], tx_power
+
+
+def newer(seq: int, last: int) -> bool:
+    """
+    True if 16-bit sequence number seq comes after last (wrapping).
+    """
+    return last is None or 0 < (seq - last) & 0xFFFF < 0x8000
+
+
+class Link:
+    __slots__ = ("snr", "rssi", "samples", "updated", "tx_power", "per", "boost",
+                 "batch", "count", "chunks")
+
+    def __init__(self, tx_power: int):
+        self.snr = None  # EWMA, normalized to REFERENCE_BANDWIDTH and the maximum TX power
+        self.rssi = None
+        self.samples = 0
+        self.updated = 0.0
+        self.tx_power = tx_power  # what the sender transmits with, as far as we know
+        self.per = 0.0  # packet error rate estimate from chunk gaps
+        self.boost = 0.0  # extra margin while the PER is above target
+        self.batch = None
+        self.count = 0
+        self.chunks = set()
+
+
+class LinkTable:
+    def __init__(self, max_power: int = 17, default_power: int = 14, alpha: float = 0.2, ttl: float = 900.0):
+        """
+        Link quality per sender: RSSI and SNR smoothed with an EWMA, the SNR
+        normalized to 125 kHz and max_power so links measured at different
+        settings compare directly. The packet error rate is estimated from
+        the chunks missing when a sender moves on to its next batch.
+        Senders silent for ttl seconds are forgotten.
+        """
+        self.max_power = max_power
+        self.default_power = default_power
+        self.alpha = alpha
+        self.ttl = ttl
+        self.links = {}
+        self.lock = threading.Lock()
+
+    def observe(self, sender: str, rssi: float, snr: float, bandwidth: int,
+                batch: int = None, chunk_id: int = 1, chunk_count: int = 1, now: float = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            link = self.links.get(sender)
+            if link is None:
+                link = self.links[sender] = Link(self.default_power)
+            if snr is not None:
+                snr += 10 * math.log10(bandwidth / REFERENCE_BANDWIDTH) + self.max_power - link.tx_power
+                link.snr = snr if link.snr is None else link.snr + self.alpha * (snr - link.snr)
+            if rssi is not None:
+                link.rssi = rssi if link.rssi is None else link.rssi + self.alpha * (rssi - link.rssi)
+            link.samples += 1
+            link.updated = now
+            if batch is None or chunk_count <= 1:
+                return
+            if batch != link.batch:
+                if link.batch is not None:
+                    lost = (link.count - len(link.chunks)) / link.count
+                    link.per += self.alpha * (lost - link.per)
+                link.batch, link.count, link.chunks = batch, chunk_count, set()
+            if chunk_id <= chunk_count:  # FEC parity chunks are extra, not expected
+                link.chunks.add(chunk_id)
+
+    def recent(self, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for sender in [s for s, link in self.links.items() if now - link.updated > self.ttl]:
+                del self.links[sender]
+            return dict(self.links)
+
+    def get(self, sender: str) -> Link:
+        return self.links.get(sender)
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+
+class AdaptiveDataRate:
+    def __init__(self, node: str, engine, coordinator: bool = False, target_per: float = 0.05,
+                 margin_db: float = 5.0, spreading_factors=range(7, 13), bandwidths=(125000,),
+                 power_range: tuple = (2, 17), power_step: int = 3, min_samples: int = 10, hold: int = 3,
+                 interval: float = 30.0, fallback_after: float = 600.0, repeats: int = 2, links: LinkTable = None,
+                 coordinators=None):
+        """
+        Adaptive data rate for a LoRaEngine or radio_pool.RadioPool.
+        Every node records the RSSI/SNR of each sender (observe()) and obeys
+        ADR control frames (handle_control()) sent by one of `coordinators`
+        (node names; None obeys any node). The coordinator (normally the
+        gateway) also evaluates the link table every `interval` seconds and
+        picks the fastest SF/bandwidth at which every recent link keeps
+        margin_db above the SF's demodulation floor, plus 3 dB per
+        evaluation while a link's PER stays above target_per. Receivers must
+        share the data rate, so it is chosen for the whole broadcast group
+        and announced to BROADCAST; TX power only affects the receiver, so
+        each sender is told the lowest power that keeps its own link in
+        margin, and our broadcasts use the power the weakest link needs.
+        Slower rates are adopted at once, faster ones only after `hold`
+        evaluations agree. A node that hears nothing for fallback_after
+        seconds returns to its initial settings, where a coordinator that
+        lost it looks for it too; nodes on other settings cannot hear each
+        other until then.
+        """
+        self.node = node
+        self.engine = engine
+        self.coordinator = coordinator
+        self.coordinators = frozenset(coordinators) if coordinators is not None else None
+        self.target_per = target_per
+        self.margin_db = margin_db
+        self.spreading_factors = tuple(spreading_factors)
+        self.bandwidths = tuple(bandwidths)
+        self.min_power, self.max_power = power_range
+        self.power_step = power_step
+        self.min_samples = min_samples
+        self.hold = hold
+        self.interval = interval
+        self.fallback_after = fallback_after
+        self.repeats = repeats
+        self.defaults = {key: engine.settings[key] for key in ("spreading_factor", "bandwidth", "tx_power")}
+        self.links = links if links is not None else LinkTable(self.max_power, self.defaults["tx_power"])
+        self.last_heard = time.monotonic()
+        self.last_seq = {}  # sender -> last rate command seq applied
+        self._seq = itertools.count(1)
+        self._faster = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"rate_changes": 0, "power_commands": 0, "commands_applied": 0, "commands_ignored": 0,
+                      "fallbacks": 0}
+        metrics.gauge("hde_radio_spreading_factor", "Spreading factor in use",
+                      fn=lambda: self.engine.settings["spreading_factor"])
+        metrics.gauge("hde_radio_tx_power_dbm", "TX power in use", fn=lambda: self.engine.settings["tx_power"])
+
+    # ---------------------------------------------------------------- receive
+
+    def observe(self, parsed, now: float = None):
+        """
+        Records the link quality of a parsed frame (Parser.parse_message),
+        with the RSSI/SNR the engine read for it.
+        """
+        now = time.monotonic() if now is None else now
+        self.last_heard = now
+        self.links.observe(parsed.sender, self.engine.last_rssi, self.engine.last_snr,
+                           self.engine.settings["bandwidth"], parsed.batch, parsed.chunk_id,
+                           parsed.chunk_count, now)
+
+    def handle_control(self, raw) -> bool:
+        """
+        Consumes ADR frames; returns False for anything else.
+        """
+        if not FrameCodec.peek_flags(raw) & FLAG_ADR:
+            return False
+        try:
+            frame = FrameCodec.decode_binary(raw)
+            target, sf, bandwidth, tx_power = decode_adr(frame)
+        except (FrameError, struct.error, UnicodeDecodeError, IndexError):
+            return True
+        self.last_heard = time.monotonic()
+        if frame.sender == self.node:
+            return True
+        if self.coordinators is not None and frame.sender not in self.coordinators:
+            self.stats["commands_ignored"] += 1
+            return True
+        if target == BROADCAST and sf:
+            if not newer(frame.batch, self.last_seq.get(frame.sender)):
+                return True
+            self.last_seq[frame.sender] = frame.batch
+            log.info("%s switched the group to SF%d/%dkHz", frame.sender, sf, bandwidth // 1000)
+            self.engine.configure(spreading_factor=sf, bandwidth=bandwidth)
+            self.stats["commands_applied"] += 1
+        elif target == self.node:
+            log.info("%s asked for %d dBm", frame.sender, tx_power)
+            self.engine.configure(tx_power=tx_power)
+            self.stats["commands_applied"] += 1
+        return True
+
+    # ------------------------------------------------------------------- plan
+
+    def headroom(self, link: Link, sf: int, bandwidth: int) -> float:
+        """
+        dB left over at max power once the margin for `link` is met.
+        """
+        snr = link.snr - 10 * math.log10(bandwidth / REFERENCE_BANDWIDTH)
+        return snr - SNR_LIMIT[sf] - self.margin_db - link.boost
+
+    def power_for(self, link: Link, sf: int, bandwidth: int) -> int:
+        """
+        Lowest TX power, in power_step steps down from the maximum, that
+        keeps `link` in margin at this rate.
+        """
+        steps = max(0, math.floor(self.headroom(link, sf, bandwidth) / self.power_step))
+        return max(self.min_power, self.max_power - steps * self.power_step)
+
+    def rates(self) -> list:
+        """
+        Candidate (sf, bandwidth) pairs, fastest first.
+        """
+        pairs = [(sf, bw) for sf in self.spreading_factors for bw in self.bandwidths]
+        return sorted(pairs, key=lambda pair: airtime(REFERENCE_PAYLOAD, *pair))
+
+    def plan(self, links: list) -> dict:
+        """
+        Fastest rate every link can sustain and the TX power the weakest
+        of them needs; the most robust rate if none fits.
+        """
+        rates = self.rates()
+        for sf, bandwidth in rates:
+            if all(self.headroom(link, sf, bandwidth) >= 0 for link in links):
+                break
+        else:
+            sf, bandwidth = rates[-1]
+        power = max((self.power_for(link, sf, bandwidth) for link in links), default=self.max_power)
+        return {"spreading_factor": sf, "bandwidth": bandwidth, "tx_power": power}
+
+    # ------------------------------------------------------------ coordinate
+
+    def tick(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        current = self.engine.settings
+        if now - self.last_heard > self.fallback_after:
+            if any(current[key] != value for key, value in self.defaults.items()):
+                log.warning("Nothing heard for %.0f s, back to %s", now - self.last_heard, self.defaults)
+                self.engine.configure(**self.defaults)
+                self.stats["fallbacks"] += 1
+            return
+        if not self.coordinator:
+            return
+        links = {sender: link for sender, link in self.links.recent(now).items()
+                 if link.samples >= self.min_samples and link.snr is not None}
+        if not links:
+            return
+        for link in links.values():
+            if link.per > self.target_per:
+                link.boost = min(link.boost + 3.0, 15.0)
+            elif link.per < self.target_per / 2:
+                link.boost = max(link.boost - 1.0, 0.0)
+
+        plan = self.plan(list(links.values()))
+        rate = (current["spreading_factor"], current["bandwidth"])
+        planned = (plan["spreading_factor"], plan["bandwidth"])
+        if planned != rate:
+            faster = airtime(REFERENCE_PAYLOAD, *planned) < airtime(REFERENCE_PAYLOAD, *rate)
+            self._faster = self._faster + 1 if faster else self.hold
+            if self._faster < self.hold:
+                return
+            self._faster = 0
+            self.switch(*planned)
+            rate = planned
+        else:
+            self._faster = 0
+        if plan["tx_power"] != current["tx_power"]:
+            self.engine.configure(tx_power=plan["tx_power"])
+
+        for sender, link in links.items():
+            power = self.power_for(link, *rate)
+            if abs(power - link.tx_power) >= self.power_step:
+                self.command_power(sender, power)
+
+    def switch(self, sf: int, bandwidth: int):
+        """
+        Announces a new group data rate, then moves our own radio once the
+        announcement is on air (at the old rate).
+        """
+        log.info("Switching the group to SF%d/%dkHz", sf, bandwidth // 1000)
+        frame = encode_adr(self.node, next(self._seq) & 0xFFFF, BROADCAST, sf, bandwidth, self.max_power)
+        queued = self.engine.queue_frames([frame] * self.repeats, PRIORITY_EMERGENCY, durable=False)
+        deadline = time.monotonic() + max(5.0, self.engine.drain_time() * 2)
+        while any(item["id"] in self.engine.outbox for item in queued) and time.monotonic() < deadline:
+            if self._stop.wait(0.05):
+                return
+        self.engine.configure(spreading_factor=sf, bandwidth=bandwidth)
+        self.stats["rate_changes"] += 1
+        CHANGES["rate"].inc()
+
+    def command_power(self, sender: str, tx_power: int):
+        frame = encode_adr(self.node, next(self._seq) & 0xFFFF, sender, 0, 0, tx_power)
+        self.engine.queue_message(frame, PRIORITY_EMERGENCY, durable=False)
+        link = self.links.get(sender)
+        if link is not None:
+            # Later samples are normalized with the new power
+            link.tx_power = tx_power
+        self.stats["power_commands"] += 1
+        CHANGES["power"].inc()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                log.error("Tick failed: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "coordinator": self.coordinator,
+            "settings": dict(self.engine.settings),
+            "stats": dict(self.stats),
+            "links": {sender: {"snr": round(link.snr, 1) if link.snr is not None else None,
+                               "rssi": round(link.rssi, 1) if link.rssi is not None else None,
+                               "per": round(link.per, 3), "samples": link.samples, "tx_power": link.tx_power,
+                               "age": round(now - link.updated, 1)}
+                      for sender, link in self.links.recent(now).items()},
+        }
@@ -0,0 +1,203 @@
+# arq.py
+
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from frame_codec import Frame, FrameCodec, FrameError, FLAG_NACK
+from logs import get_logger
+
+log = get_logger("arq")
+
+# NACK payload: target sender length, target sender, chunk count, bitmap
+NACK_HEADER = struct.Struct("!B")
+
+
+def encode_bitmap(chunk_ids, count: int) -> bytes:
+    """
+    Packs 1-based chunk ids into a little-endian bitmap of count bits.
+    """
+    mask = 0
+    for chunk_id in chunk_ids:
+        mask |= 1 << (chunk_id - 1)
+    return mask.to_bytes((count + 7) // 8, "little")
+
+
+def decode_bitmap(bitmap, count: int) -> list:
+    mask = int.from_bytes(bitmap, "little")
+    return [i + 1 for i in range(count) if mask >> i & 1]
+
+
+def encode_nack(node: str, sender: str, batch: int, count: int, missing: list) -> bytes:
+    target = sender.encode("utf-8")[:255]
+    payload = b"".join((NACK_HEADER.pack(len(target)), target, NACK_HEADER.pack(count),
+                        encode_bitmap(missing, count)))
+    frame = Frame(node, batch, 0, count, int(time.time()), payload, flags=FLAG_NACK)
+    return FrameCodec.encode_binary(frame)
+
+
+def decode_nack(frame: Frame) -> tuple:
+    """
+    Returns (target sender, batch, missing chunk ids) of a NACK frame.
+    """
+    payload = frame.payload
+    (target_len,) = NACK_HEADER.unpack_from(payload, 0)
+    target = str(payload[1:1 + target_len], "utf-8")
+    (count,) = NACK_HEADER.unpack_from(payload, 1 + target_len)
+    return target, frame.batch, decode_bitmap(payload[2 + target_len:], count)
+
+
+class RetransmitCache:
+    def __init__(self, max_batches: int = 32, holdoff: float = 2.0, max_retries: int = 4):
+        """
+        Recently sent frames, kept so a NACK can be answered with just the
+        missing chunks. A chunk is resent at most max_retries times and not
+        again within holdoff seconds, doubling after every resend.
+        report() counts each lost chunk once, however often it is NACKed.
+        """
+        self.max_batches = max_batches
+        self.holdoff = holdoff
+        self.max_retries = max_retries
+        self.batches = OrderedDict()  # (sender, batch) -> {chunk_id: [frame, retries, not_before, reported]}
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: tuple) -> bool:
+        return key in self.batches
+
+    def remember(self, sender: str, batch: int, frames: list):
+        with self.lock:
+            self.batches[(sender, batch)] = {i: [frame, 0, 0.0, False] for i, frame in enumerate(frames, start=1)}
+            self.batches.move_to_end((sender, batch))
+            while len(self.batches) > self.max_batches:
+                self.batches.popitem(last=False)
+
+    def report(self, sender: str, batch: int, missing: list) -> int:
+        """
+        Marks the missing chunks of one of our batches as lost; returns how
+        many had not been reported by an earlier NACK.
+        """
+        new = 0
+        with self.lock:
+            chunks = self.batches.get((sender, batch))
+            if not chunks:
+                return new
+            for chunk_id in missing:
+                slot = chunks.get(chunk_id)
+                if slot is not None and not slot[3]:
+                    slot[3] = True
+                    new += 1
+        return new
+
+    def resend(self, sender: str, batch: int, missing: list, now: float = None) -> list:
+        """
+        Returns the frames to retransmit for a NACK.
+        """
+        now = time.monotonic() if now is None else now
+        frames = []
+        with self.lock:
+            chunks = self.batches.get((sender, batch))
+            if not chunks:
+                return frames
+            for chunk_id in missing:
+                slot = chunks.get(chunk_id)
+                if slot is None or slot[1] >= self.max_retries or now < slot[2]:
+                    continue
+                slot[1] += 1
+                slot[2] = now + self.holdoff * 2 ** (slot[1] - 1)
+                frames.append(slot[0])
+        return frames
+
+
+class SelectiveRepeat:
+    def __init__(self, node: str, reassembler, send, cache: RetransmitCache = None,
+                 nack_delay: float = 3.0, max_nacks: int = 4, interval: float = 0.5, on_nack=None):
+        """
+        Selective-repeat ARQ on top of LoRaEngine.
+        Receiver: a partial message that has not progressed for nack_delay
+        seconds (doubling per attempt) gets a NACK listing only its missing
+        chunk ids. Sender: NACKs for batches in the RetransmitCache are
+        answered by resending just those frames. `send(frame)` queues a
+        frame for transmission; on_nack(lost count) hears about chunks of
+        our batches NACKed for the first time (loss feedback for FEC).
+        """
+        self.node = node
+        self.reassembler = reassembler
+        self.send = send
+        self.cache = cache or RetransmitCache()
+        self.nack_delay = nack_delay
+        self.max_nacks = max_nacks
+        self.interval = interval
+        self.on_nack = on_nack
+        self.attempts = {}  # (sender, batch) -> NACKs sent
+        self.stats = {"nacks_sent": 0, "nacks_received": 0, "chunks_resent": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------------------------------------------------------------- sender
+
+    def remember(self, sender: str, batch: int, frames: list):
+        if len(frames) > 1:
+            self.cache.remember(sender, batch, frames)
+
+    def handle_control(self, raw) -> bool:
+        """
+        Consumes NACK frames; returns False for anything else.
+        """
+        if not FrameCodec.peek_flags(raw) & FLAG_NACK:
+            return False
+        try:
+            frame = FrameCodec.decode_binary(raw)
+            target, batch, missing = decode_nack(frame)
+        except (FrameError, struct.error, UnicodeDecodeError):
+            return True
+        if frame.sender == self.node:
+            return True
+        self.stats["nacks_received"] += 1
+        if self.on_nack is not None:
+            lost = self.cache.report(target, batch, missing)
+            if lost:
+                self.on_nack(lost)
+        for resend in self.cache.resend(target, batch, missing):
+            self.stats["chunks_resent"] += 1
+            self.send(resend)
+        return True
+
+    # -------------------------------------------------------------- receiver
+
+    def tick(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        # Snapshot under the lock: the receive path adds chunks concurrently
+        with self.reassembler.lock:
+            partials = [(key, partial.updated, partial.count, partial.missing())
+                        for key, partial in self.reassembler.partials.items()]
+        live = set()
+        for key, updated, count, missing in partials:
+            live.add(key)
+            attempts = self.attempts.get(key, 0)
+            if attempts >= self.max_nacks:
+                continue
+            if now - updated < self.nack_delay * 2 ** attempts:
+                continue
+            sender, batch = key
+            self.send(encode_nack(self.node, sender, batch, count, missing))
+            self.attempts[key] = attempts + 1
+            self.stats["nacks_sent"] += 1
+        for key in [k for k in self.attempts if k not in live]:
+            del self.attempts[key]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                log.error("Tick failed: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,212 @@
+# asgi.py
+#
+# ASGI serving mode: the same API as main.py on one persistent event loop.
+# Requires Quart (Flask's async twin) and an ASGI server:
+#   pip install quart hypercorn
+#   hypercorn asgi:app --bind 0.0.0.0:5000
+# or simply: python asgi.py
+
+import asyncio
+import os
+from pathlib import Path
+
+from quart import Quart, Response, jsonify, request
+
+import metrics
+from gateway import STATUS_INTERVAL, Gateway, format_event, format_status
+from logs import get_logger
+
+app = Quart(__name__)
+log = get_logger("asgi")
+gateway = None
+
+
+async def run_blocking(fn, *args):
+    """
+    Runs storage or radio calls on the default thread pool so the event
+    loop keeps serving other clients.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+@app.before_serving
+async def startup():
+    # Gateway() only reads configuration; start() builds storage and radio
+    # in the background, so the server accepts connections immediately
+    global gateway
+    gateway = Gateway(Path("messages"))
+    gateway.start()
+
+
+@app.after_serving
+async def shutdown():
+    await run_blocking(gateway.shutdown)
+
+
+@app.route("/api/working_directory")
+async def get_working_directory():
+    return jsonify({"cwd": os.getcwd()})
+
+
+@app.route("/api/send", methods=["POST"])
+async def send_message():
+    data = await request.get_json()
+    from_field = data.get("from")
+    message = data.get("message")
+    checksum = data.get("checksum")
+    priority = data.get("priority", "broadcast")
+
+    if not from_field or not message or not checksum:
+        return jsonify({"error": "Missing fields"}), 400
+
+    try:
+        new_entry = await run_blocking(gateway.send, from_field, message, checksum, priority)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"status": "success", "sent": new_entry}), 200
+
+
+@app.route("/api/messages", methods=["GET"])
+async def query_messages():
+    """
+    See main.query_messages.
+    """
+    try:
+        body = await run_blocking(lambda: gateway.query_messages(
+            sender=request.args.get("from") or None,
+            since=request.args.get("since", None, type=int),
+            until=request.args.get("until", None, type=int),
+            text=request.args.get("q") or None,
+            before=request.args.get("before") or None,
+            limit=request.args.get("limit", 50, type=int)))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    if body is None:
+        return jsonify({"error": "Message index disabled"}), 404
+    return jsonify(body)
+
+
+@app.route("/api/messages/<filename>", methods=["GET"])
+async def source_messages(filename):
+    """
+    See main.source_messages: cursors, ETag and 304 handling are the same.
+    """
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    # Waits for storage during warm-up and stats the file
+    etag = await run_blocking(gateway.messages_etag, filename, since, limit)
+    if etag and request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    body = await run_blocking(gateway.read_messages, filename, since, limit)
+    if body is None:
+        return jsonify({"error": "File not found"}), 404
+    response = jsonify(body)
+    if etag:
+        response.set_etag(etag)
+    return response
+
+
+@app.route("/api/events")
+async def message_events():
+    """
+    Server-Sent Events stream of new messages and status changes, bridged
+    from the radio thread onto this loop without blocking either side.
+    """
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    since = last_id + 1 if last_id is not None else request.args.get("since", None, type=int)
+
+    async def generate():
+        sub = gateway.message_bus.subscribe_async()
+        try:
+            yield "retry: 3000\n\n"
+            sent = await run_blocking(lambda: len(gateway.message_log) - 1)
+            if since is not None:
+                backlog = await run_blocking(lambda: gateway.message_log.read(since))
+                sent = since - 1
+                for seq, entry in enumerate(backlog, start=since):
+                    yield format_event(seq, entry)
+                    sent = seq
+            loop = asyncio.get_running_loop()
+            status, status_due = None, 0.0
+            while not sub.overflowed:
+                if loop.time() >= status_due:
+                    status_due = loop.time() + STATUS_INTERVAL
+                    previous, status = status, await run_blocking(gateway.status)
+                    if status != previous:
+                        yield format_status(status)
+                event = await sub.get(timeout=STATUS_INTERVAL)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                events = [event] if event[0] == sent + 1 else await run_blocking(gateway.events_after, sent, event)
+                for seq, entry in events:
+                    yield format_event(seq, entry)
+                    sent = seq
+        finally:
+            gateway.message_bus.unsubscribe(sub)
+
+    response = Response(generate(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None
+    return response
+
+
+@app.route("/api/state", methods=["GET"])
+async def get_state():
+    return jsonify({"state": gateway.engine_state()})
+
+
+@app.route("/api/checksum")
+async def get_checksum():
+    return jsonify({"checksum": await run_blocking(lambda: gateway.checksum)})
+
+
+@app.route("/api/status")
+async def get_status():
+    return jsonify(await run_blocking(gateway.status))
+
+
+@app.route("/api/sync", methods=["POST"])
+async def sync_with_peer():
+    """
+    See main.sync_with_peer.
+    """
+    peer = (await request.get_json(silent=True) or {}).get("peer")
+    if not peer:
+        return jsonify({"error": "Missing peer"}), 400
+    if not gateway.sync_allowed(peer):
+        return jsonify({"error": "Peer not allowed"}), 403
+    try:
+        return jsonify(await run_blocking(gateway.sync_with, peer))
+    except (OSError, ValueError) as e:
+        log.warning("Sync with %s failed: %s", peer, e)
+        return jsonify({"error": "Sync failed"}), 502
+
+
+@app.route("/api/sync/<action>", methods=["POST"])
+async def sync_request(action):
+    """
+    See main.sync_request.
+    """
+    handlers = {"summary": gateway.sync_summary, "ids": gateway.sync_ids,
+                "fetch": gateway.sync_fetch, "push": gateway.sync_push}
+    if action not in handlers:
+        return jsonify({"error": "Unknown sync request"}), 404
+    if action == "push" and not await run_blocking(gateway.sync_authorized, request.remote_addr,
+                                                   request.headers.get("Authorization")):
+        return jsonify({"error": "Not authorized"}), 403
+    body = await request.get_json(silent=True)
+    try:
+        return jsonify(await run_blocking(handlers[action], body))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/api/metrics")
+async def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5000)
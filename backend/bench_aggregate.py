@@ -0,0 +1,115 @@
+# bench_aggregate.py
+#
+# Frame aggregation under bursty chat traffic on simulated radios, in
+# scaled real time: bursts of short messages are queued on one node and
+# counted as they reach the other. With --linger > 0 the sender's
+# LoRaEngine packs small frames into shared transmissions.
+# Times are reported in radio seconds (wall time / --time-scale).
+# Usage: python bench_aggregate.py --linger 0.05
+#        python bench_aggregate.py --linger 0      # one frame per transmission
+
+import argparse
+import random
+import threading
+import time
+
+from lora_engine import LoRaEngine
+from parser import Parser
+from sim_radio import mesh
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(args) -> dict:
+    channel, radios = mesh(2, loss=args.loss, duty_cycle=1.0, time_scale=args.time_scale, seed=args.seed)
+    for radio in radios:
+        radio.set_spreading_factor(args.sf)
+    linger = args.linger * args.time_scale if args.linger > 0 else None
+    sender = LoRaEngine(radio=radios[0], irq_driven=True, linger=linger)
+    receiver = LoRaEngine(radio=radios[1], irq_driven=True)
+
+    lock = threading.Lock()
+    sent_at, latencies = {}, []
+
+    def on_frame(raw):
+        parsed = Parser.parse_message(raw)
+        if parsed.valid:
+            now = time.perf_counter()
+            with lock:
+                latencies.append(now - sent_at[parsed.batch])
+    receiver.add_listener(on_frame)
+    for engine in (sender, receiver):
+        engine.set_state("receive")
+    time.sleep(0.05)
+
+    rng = random.Random(args.seed)
+    batch = 0
+    start = time.perf_counter()
+    for _ in range(args.bursts):
+        for _ in range(args.burst_size):
+            batch += 1
+            text = "".join(rng.choice("abcdefghij klmnop") for _ in range(rng.randint(*args.length)))
+            frames = Parser.prepare_frames({
+                "from": "node0",
+                "message": text,
+                "checksum": "0",
+                "chunk_id": 1,
+                "chunk_batch": batch,
+                "timestamp": int(time.time())
+            }, binary=True, compress=False)
+            sent_at[batch] = time.perf_counter()
+            sender.queue_frames(frames)
+            time.sleep(rng.expovariate(1 / args.spacing) * args.time_scale)
+        time.sleep(args.gap * args.time_scale)
+    while sender.tx_queue_depth() or sender.get_state() == "transmit":
+        time.sleep(0.005)
+    time.sleep(0.05)
+    wall = time.perf_counter() - start
+
+    for engine in (sender, receiver):
+        engine.shutdown()
+    scale = args.time_scale
+    return {
+        "sent": batch,
+        "delivered": len(latencies),
+        "transmissions": channel.stats["sent"],
+        "airtime": channel.stats["airtime"],
+        "radio_seconds": wall / scale,
+        "latencies": [t / scale for t in latencies],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--linger", type=float, default=0.05, help="radio seconds to wait for more frames, 0 = off")
+    ap.add_argument("--bursts", type=int, default=20)
+    ap.add_argument("--burst-size", type=int, default=10, help="messages per burst")
+    ap.add_argument("--spacing", type=float, default=0.02, help="mean radio seconds between messages of a burst")
+    ap.add_argument("--gap", type=float, default=1.0, help="radio seconds between bursts")
+    ap.add_argument("--length", type=lambda s: tuple(int(n) for n in s.split("-")), default=(10, 60),
+                    help="message text length range, e.g. 10-60")
+    ap.add_argument("--sf", type=int, default=7)
+    ap.add_argument("--loss", type=float, default=0.0)
+    ap.add_argument("--time-scale", type=float, default=0.1, help="real seconds per radio second")
+    ap.add_argument("--seed", type=int, default=11)
+    args = ap.parse_args()
+
+    result = run(args)
+    lat = [t * 1000 for t in result["latencies"]]
+    print(f"messages         : {result['sent']} sent, {result['delivered']} delivered "
+          f"({result['delivered'] / result['sent']:.1%}) in {result['transmissions']} transmissions "
+          f"({result['sent'] / result['transmissions']:.1f} per transmission)")
+    print(f"airtime          : {result['airtime']:.2f} s, {result['airtime'] / result['sent'] * 1000:.1f} ms/message")
+    print(f"throughput       : {result['delivered'] / result['airtime']:.1f} messages per second of airtime, "
+          f"{result['delivered'] / result['radio_seconds']:.1f} msg/s overall")
+    print(f"latency          : p50 {percentile(lat, 50):.0f} ms  p95 {percentile(lat, 95):.0f} ms  "
+          f"max {max(lat, default=0):.0f} ms (radio time)")
+
+
+if __name__ == "__main__":
+    main()
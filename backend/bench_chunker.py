@@ -0,0 +1,66 @@
+# bench_chunker.py
+#
+# Compares the streaming Parser.iter_chunks chunker against the original
+# per-character split_into_chunks. Usage: python bench_chunker.py [size_kb]
+
+import sys
+import time
+
+from parser import Parser
+
+
+def legacy_split_into_chunks(message: str, max_size: int = 240) -> list:
+    """
+    The original implementation, kept here as the reference.
+    """
+    chunks = []
+    current_chunk = ""
+    chunk_id = 1
+
+    for char in message:
+        if len((current_chunk + char).encode('utf-8')) > max_size:
+            chunks.append(f"|c{chunk_id}|{current_chunk}")
+            current_chunk = char
+            chunk_id += 1
+        else:
+            current_chunk += char
+
+    if current_chunk:
+        chunks.append(f"|c{chunk_id}|{current_chunk}")
+
+    return chunks
+
+
+def timed(fn, *args, repeat: int = 5) -> tuple:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    samples = {
+        "ascii": "Evacuation center open at the school gym. " * 64,
+        "mixed": "Salamat po! Ligtas kami ✓ — tubig at pagkain ay kailangan 🙏 " * 64,
+    }
+    for name, text in samples.items():
+        message = (text * (size_kb * 1024 // len(text.encode("utf-8")) + 1))
+        message = message[:size_kb * 1024]
+
+        old, t_old = timed(legacy_split_into_chunks, message)
+        new, t_new = timed(Parser.split_into_chunks, message)
+        lazy, t_lazy = timed(lambda m: sum(1 for _ in Parser.iter_chunks(m)), message)
+        assert "".join(c.split("|", 2)[2] for c in new) == message
+        assert all(len(c.split("|", 2)[2].encode("utf-8")) <= 240 for c in new)
+
+        print(f"{name:5} {len(message.encode('utf-8')) / 1024:6.1f} KiB  "
+              f"legacy {t_old * 1000:8.2f} ms ({len(old)} chunks)  "
+              f"new {t_new * 1000:6.3f} ms ({len(new)} chunks)  "
+              f"iter_chunks {t_lazy * 1000:6.3f} ms  x{t_old / t_new:.0f}")
+
+
+if __name__ == "__main__":
+    main()
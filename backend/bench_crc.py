@@ -0,0 +1,68 @@
+# bench_crc.py
+#
+# Compares the table-driven Parser.file_crc32 against the original
+# bit-by-bit implementation. Usage: python bench_crc.py [size_kb]
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from parser import Parser, _CRC_CACHE
+
+
+def bitwise_crc32(path: Path) -> str:
+    """
+    The original pure-Python engine, kept here as the reference.
+    """
+    crc = 0
+    with path.open("rb") as f:
+        while chunk := f.read(4096):
+            for byte in chunk:
+                crc ^= byte
+                for _ in range(8):
+                    if crc & 1:
+                        crc = (crc >> 1) ^ 0xEDB88320
+                    else:
+                        crc >>= 1
+    return format(crc & 0xFFFFFFFF, '08X')
+
+
+def timed(fn, *args) -> tuple:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    line = b'{"from": "HDE Team", "timestamp": 1625251200, "chunk_batch": 1, "chunk": [{"id": 1, "message": "Hello"}]}\n'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "messages.json"
+        path.write_bytes(line * (size_kb * 1024 // len(line)))
+
+        old, t_old = timed(bitwise_crc32, path)
+        _CRC_CACHE.clear()
+        new, t_new = timed(Parser.file_crc32, path)
+        cached, t_cached = timed(Parser.file_crc32, path)
+
+        with path.open("ab") as f:
+            f.write(line)
+        appended, t_append = timed(Parser.file_crc32, path)
+        _CRC_CACHE.clear()
+        full = Parser.file_crc32(path)
+
+        assert old == new == cached, (old, new, cached)
+        assert appended == full, (appended, full)
+
+        print(f"file size        : {os.path.getsize(path) / 1024:.0f} KiB")
+        print(f"bitwise (old)    : {t_old * 1000:10.2f} ms  {old}")
+        print(f"zlib (new)       : {t_new * 1000:10.2f} ms  {new}  x{t_old / t_new:.0f}")
+        print(f"cached           : {t_cached * 1000:10.3f} ms")
+        print(f"after append     : {t_append * 1000:10.3f} ms  {appended}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# bench_mesh.py
+#
+# Multi-hop flooding benchmark on simulated radios: nodes scattered over a
+# square area wider than one radio's range, messages originated by rotating
+# nodes, relayed by LoRaEngine + relay.Relay.
+# Reports delivery ratio (vs. what the topology can reach) and airtime
+# amplification (airtime on air / airtime of the original frames).
+# Usage: python bench_mesh.py --nodes 20 --mode managed
+#        python bench_mesh.py --mode flood      # every node rebroadcasts once
+#        python bench_mesh.py --mode none       # single hop, no relaying
+
+import argparse
+import random
+import threading
+import time
+from collections import deque
+
+from frame_codec import MAX_FRAME_SIZE, MESH_FRAME_SIZE, MESH_HEADER
+from lora_engine import LoRaEngine
+from parser import Parser
+from radio import SNR_LIMIT, airtime
+from relay import Relay
+from sim_radio import SimChannel
+
+
+def reachable(channel: SimChannel, radios: list, source: int) -> set:
+    """
+    Nodes connected to `source` through links above the SF's SNR floor.
+    """
+    seen = {source}
+    todo = deque([source])
+    while todo:
+        node = todo.popleft()
+        for other, radio in enumerate(radios):
+            if other in seen:
+                continue
+            _, snr = channel.link(radios[node], radio)
+            if snr >= SNR_LIMIT[radio.spreading_factor]:
+                seen.add(other)
+                todo.append(other)
+    return seen
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    channel = SimChannel(loss=args.loss, duty_cycle=1.0, seed=args.seed)
+    radios = [channel.add_node((rng.uniform(0, args.area), rng.uniform(0, args.area)))
+              for _ in range(args.nodes)]
+    for radio in radios:
+        radio.set_spreading_factor(args.sf)
+
+    delivered = set()  # (node, batch)
+    lock = threading.Lock()
+    engines, relays = [], []
+    for i, radio in enumerate(radios):
+        relay = None
+        if args.mode != "none":
+            relay = Relay(f"node{i}", hop_limit=args.hop_limit, backoff_scale=args.backoff_scale, seed=i,
+                          suppress_after=args.suppress_after if args.mode == "managed" else 1 << 30,
+                          contention=4.0 if args.mode == "managed" else 0.0)
+            relays.append(relay)
+        engine = LoRaEngine(radio=radio, irq_driven=True, relay=relay)
+
+        def on_frame(raw, node=i):
+            parsed = Parser.parse_message(raw)
+            if parsed.valid:
+                with lock:
+                    delivered.add((node, parsed.batch))
+        engine.add_listener(on_frame)
+        engine.set_state("receive")
+        engines.append(engine)
+    time.sleep(0.05)
+
+    expected = 0
+    original_airtime = 0.0
+    text = "x" * args.size
+    wall_start = time.perf_counter()
+    for batch in range(1, args.messages + 1):
+        source = (batch - 1) % args.nodes
+        expected += len(reachable(channel, radios, source)) - 1
+        frames = Parser.prepare_frames({
+            "from": f"node{source}",
+            "message": text,
+            "checksum": "0",
+            "chunk_id": 1,
+            "chunk_batch": batch,
+            "timestamp": int(time.time())
+        }, binary=True, compress=False, max_size=MESH_FRAME_SIZE if relays else MAX_FRAME_SIZE)
+        for frame in frames:
+            size = len(frame) + (MESH_HEADER.size if relays else 0)
+            original_airtime += airtime(size, args.sf)
+            engines[source].queue_message(frame)
+        time.sleep(args.interval)
+
+    # Let the flood die out: no frame queued and no rebroadcast pending
+    idle_since = time.perf_counter()
+    while time.perf_counter() - idle_since < 0.5:
+        if any(e.tx_queue_depth() for e in engines) or any(r.pending for r in relays):
+            idle_since = time.perf_counter()
+        time.sleep(0.02)
+    wall = time.perf_counter() - wall_start
+
+    for engine in engines:
+        engine.shutdown()
+
+    stats = {}
+    for relay in relays:
+        for key, value in relay.stats.items():
+            stats[key] = stats.get(key, 0) + value
+    return {
+        "expected": expected,
+        "possible": args.messages * (args.nodes - 1),
+        "delivered": sum(1 for node, batch in delivered if node != (batch - 1) % args.nodes),
+        "airtime": channel.stats["airtime"],
+        "original_airtime": original_airtime,
+        "frames": channel.stats["sent"],
+        "relay": stats,
+        "wall": wall,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--nodes", type=int, default=20)
+    ap.add_argument("--area", type=float, default=12000.0, help="side of the square area in metres")
+    ap.add_argument("--messages", type=int, default=40)
+    ap.add_argument("--size", type=int, default=40, help="message text length in bytes")
+    ap.add_argument("--sf", type=int, default=7)
+    ap.add_argument("--loss", type=float, default=0.0)
+    ap.add_argument("--mode", choices=("managed", "flood", "none"), default="managed")
+    ap.add_argument("--hop-limit", type=int, default=5)
+    ap.add_argument("--suppress-after", type=int, default=2)
+    ap.add_argument("--backoff-scale", type=float, default=0.05,
+                    help="relay backoff in real seconds per airtime second (simulated radios are instant)")
+    ap.add_argument("--interval", type=float, default=0.05, help="seconds between originated messages")
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+
+    result = run(args)
+    print(f"topology         : {args.nodes} nodes over {args.area / 1000:.1f} km square, SF{args.sf}, "
+          f"{result['expected'] / result['possible']:.1%} of node pairs connected")
+    print(f"delivery         : {result['delivered']}/{result['possible']} "
+          f"({result['delivered'] / result['possible']:.1%} of all, "
+          f"{result['delivered'] / max(result['expected'], 1):.1%} of reachable)")
+    print(f"airtime          : {result['airtime']:.2f} s on air for {result['original_airtime']:.2f} s originated "
+          f"(amplification x{result['airtime'] / result['original_airtime']:.2f}), {result['frames']} frames")
+    if result["relay"]:
+        r = result["relay"]
+        print(f"relay            : {r['forwarded']} forwarded, {r['suppressed']} suppressed, "
+              f"{r['duplicates']} duplicates heard, {r['ttl_expired']} hop-limited")
+    print(f"wall             : {result['wall']:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
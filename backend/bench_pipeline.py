@@ -0,0 +1,192 @@
+# bench_pipeline.py
+#
+# End-to-end benchmark on simulated radios:
+#   /api/send framing -> LoRaEngine TX -> SimChannel -> LoRaEngine RX
+#   -> Parser.parse_message -> MessageStream -> MessageLog
+# Usage: python bench_pipeline.py --messages 500 --sf 7 --loss 0.05
+#        python bench_pipeline.py --messages 200 --size 600 --loss 0.1 --arq --fec --fec-loss 0.1
+
+import argparse
+import contextlib
+import os
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from arq import RetransmitCache, SelectiveRepeat
+import fec
+from lora_engine import LoRaEngine
+from outbox import PRIORITY_DIRECT
+from message_log import MessageLog
+from parser import Parser
+from sim_radio import mesh
+from stream import MessageStream
+
+
+def percentile(values: list, pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(args) -> dict:
+    channel, radios = mesh(args.nodes, loss=args.loss, duty_cycle=args.duty_cycle,
+                           time_scale=args.time_scale, seed=1)
+    for radio in radios:
+        radio.set_spreading_factor(args.sf)
+        radio.set_bandwidth(args.bw)
+
+    tmp = tempfile.TemporaryDirectory()
+    sent_at = {}
+    latencies = []
+    received = threading.Event()
+    lock = threading.Lock()
+    last_delivery = [0.0]
+
+    policy = fec.FecPolicy(loss=args.fec_loss) if args.fec else None
+    engines, logs, arqs = [], [], []
+    for i, radio in enumerate(radios):
+        log = MessageLog(Path(tmp.name) / f"node{i}")
+        stream = MessageStream(log=log)
+        engine = LoRaEngine(radio=radio, irq_driven=True)
+        cache = RetransmitCache(max_batches=max(32, args.messages), holdoff=args.nack_delay)
+        arq = SelectiveRepeat(f"node{i}", stream.reassembler, cache=cache, nack_delay=args.nack_delay, interval=0.05,
+                              send=lambda frame, engine=engine: engine.queue_message(frame, PRIORITY_DIRECT),
+                              on_nack=(lambda n: policy.observe(lost=n)) if policy else None)
+        if args.arq:
+            arq.start()
+        logs.append(log)
+        engines.append(engine)
+        arqs.append(arq)
+        if i == 1:
+            def on_frame(raw, stream=stream, arq=arq):
+                if arq.handle_control(raw):
+                    return
+                stored = stream.receive_frame(Parser.parse_message(raw))
+                if stored is None:
+                    return
+                _, entry = stored
+                now = time.perf_counter()
+                with lock:
+                    latencies.append(now - sent_at[entry["chunk_batch"]])
+                    last_delivery[0] = now
+                    if len(latencies) == args.messages:
+                        received.set()
+            engine.add_listener(on_frame)
+        elif i > 1:
+            engine.add_listener(lambda raw, stream=stream, arq=arq: arq.handle_control(raw)
+                                or stream.receive_frame(Parser.parse_message(raw)))
+        else:
+            engine.add_listener(arq.handle_control)
+        engine.set_state("receive")
+    time.sleep(0.05)
+
+    text = ("x" * args.size)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for batch in range(1, args.messages + 1):
+        entry = {
+            "from": "bench",
+            "message": text,
+            "checksum": "0",
+            "chunk_id": 1,
+            "chunk_batch": batch,
+            "timestamp": int(time.time())
+        }
+        frames = Parser.prepare_frames(entry, binary=True, compress=args.compress,
+                                       parity=policy.parity if policy else None)
+        if policy:
+            policy.observe(sent=len(frames))
+        logs[0].append(entry)
+        arqs[0].remember("bench", batch, frames)
+        sent_at[batch] = time.perf_counter()
+        for frame in frames:
+            engines[0].queue_message(frame)
+
+    while engines[0].tx_queue_depth() and not received.is_set():
+        time.sleep(0.01)
+    grace = 1.0 + (args.nack_delay * 8 if args.arq else 0)
+    received.wait(timeout=grace + args.time_scale * channel.stats["airtime"])
+    cpu = time.process_time() - cpu_start
+    wall = (last_delivery[0] or time.perf_counter()) - wall_start
+
+    for arq in arqs:
+        arq.stop()
+    for engine in engines:
+        engine.shutdown()
+    for log in logs:
+        log.close()
+    tmp.cleanup()
+
+    delivered = len(latencies)
+    virtual = max(r.clock for r in radios)
+    return {
+        "sent": args.messages,
+        "delivered": delivered,
+        "latencies": latencies,
+        "airtime": channel.stats["airtime"],
+        "virtual": virtual,
+        "wall": wall,
+        "cpu": cpu,
+        "frames": channel.stats["sent"],
+        "frame_bytes": len(frames[0]),
+        "arq": arqs[0].stats,
+        "arq_rx": arqs[1].stats,
+        "parity": fec.PARITY_SENT.value,
+        "recovered": fec.RECOVERED.value,
+        "dedup_hits": sum(engine.dedup.hits for engine in engines),
+        "dedup_misses": sum(engine.dedup.misses for engine in engines),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--messages", type=int, default=500)
+    ap.add_argument("--size", type=int, default=40, help="message text length in bytes")
+    ap.add_argument("--nodes", type=int, default=2)
+    ap.add_argument("--sf", type=int, default=7)
+    ap.add_argument("--bw", type=int, default=125000)
+    ap.add_argument("--loss", type=float, default=0.0)
+    ap.add_argument("--duty-cycle", type=float, default=1.0)
+    ap.add_argument("--compress", action="store_true", help="deflate payloads with the preset dictionary")
+    ap.add_argument("--arq", action="store_true", help="enable selective-repeat retransmission")
+    ap.add_argument("--fec", action="store_true", help="add adaptive Reed-Solomon parity chunks (fed by NACKs)")
+    ap.add_argument("--fec-loss", type=float, default=0.0,
+                    help="initial FEC loss estimate; 0 learns it from NACKs only")
+    ap.add_argument("--nack-delay", type=float, default=0.2)
+    ap.add_argument("--time-scale", type=float, default=0.0,
+                    help="0 runs airtime on the virtual clock only, 1 sleeps in real time")
+    args = ap.parse_args()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        result = run(args)
+
+    lat = [t * 1000 for t in result["latencies"]]
+    payload = result["delivered"] * args.size
+    print(f"messages         : {result['sent']} sent, {result['delivered']} delivered "
+          f"({result['delivered'] / result['sent']:.1%}), {result['frames']} frames on air, "
+          f"first frame {result['frame_bytes']} B")
+    if args.arq:
+        print(f"arq              : {result['arq_rx']['nacks_sent']} NACKs, "
+              f"{result['arq']['chunks_resent']} chunks resent")
+    if args.fec:
+        print(f"fec              : {result['parity']:.0f} parity chunks sent, "
+              f"{result['recovered']:.0f} missing chunks rebuilt without a round trip")
+    print(f"dedup            : {result['dedup_hits']} duplicate frames dropped, "
+          f"{result['dedup_misses']} unique")
+    print(f"latency (wall)   : p50 {percentile(lat, 50):.2f} ms  p95 {percentile(lat, 95):.2f} ms  "
+          f"max {max(lat, default=0):.2f} ms")
+    print(f"airtime          : {result['airtime']:.2f} s total, "
+          f"{result['airtime'] / result['frames'] * 1000:.1f} ms/frame at SF{args.sf}/{args.bw // 1000}kHz")
+    print(f"goodput (air)    : {payload / max(result['virtual'], 1e-9):.1f} B/s of payload")
+    print(f"throughput (wall): {result['delivered'] / result['wall']:.0f} msg/s")
+    print(f"cpu per message  : {result['cpu'] / result['sent'] * 1e6:.0f} us")
+    if lat:
+        print(f"latency stdev    : {statistics.pstdev(lat):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# bench_pool.py
+#
+# Gateway capacity with one half-duplex radio vs. a radio_pool.RadioPool
+# (one radio listening on the uplink frequency, one transmitting on the
+# downlink frequency), on simulated radios in scaled real time.
+# The gateway drains a backlog of broadcast frames while clients keep
+# sending uplink frames; a single radio misses every uplink frame that
+# arrives while it transmits. Clients use a matching pool in pool mode.
+# Usage: python bench_pool.py --mode pool
+#        python bench_pool.py --mode single
+
+import argparse
+import threading
+import time
+
+from lora_engine import LoRaEngine
+from outbox import PRIORITY_BROADCAST
+from parser import Parser
+from radio_pool import RadioPool
+from sim_radio import SimChannel
+
+UPLINK = 433.175
+DOWNLINK = 434.665
+
+
+def frames_for(sender: str, batch: int, size: int) -> list:
+    return Parser.prepare_frames({
+        "from": sender,
+        "message": "x" * size,
+        "checksum": "0",
+        "chunk_id": 1,
+        "chunk_batch": batch,
+        "timestamp": int(time.time())
+    }, binary=True, compress=False)
+
+
+def node(channel: SimChannel, position: tuple, mode: str, rx_frequency: float, tx_frequency: float):
+    if mode == "single":
+        return LoRaEngine(radio=channel.add_node(position, frequency=UPLINK), irq_driven=True)
+    radios = [channel.add_node(position, frequency=rx_frequency), channel.add_node(position, frequency=tx_frequency)]
+    return RadioPool(radios, ["rx", "tx"], irq_driven=True)
+
+
+def run(args) -> dict:
+    channel = SimChannel(duty_cycle=1.0, time_scale=args.time_scale, seed=args.seed)
+    gateway = node(channel, (0.0, 0.0), args.mode, UPLINK, DOWNLINK)
+    clients = [node(channel, (100.0 * (i + 1), 0.0), args.mode, DOWNLINK, UPLINK) for i in range(args.clients)]
+
+    lock = threading.Lock()
+    uplink, downlink = set(), set()
+
+    def on_gateway(raw):
+        parsed = Parser.parse_message(raw)
+        if parsed.valid and parsed.sender != "gateway":
+            with lock:
+                uplink.add((parsed.sender, parsed.batch))
+    gateway.add_listener(on_gateway)
+    for i, client in enumerate(clients):
+        def on_client(raw, i=i):
+            parsed = Parser.parse_message(raw)
+            if parsed.valid and parsed.sender == "gateway":
+                with lock:
+                    downlink.add((i, parsed.batch))
+        client.add_listener(on_client)
+    for engine in [gateway] + clients:
+        engine.set_state("receive")
+    time.sleep(0.05)
+
+    start = time.perf_counter()
+    for batch in range(1, args.downlink + 1):
+        gateway.queue_frames(frames_for("gateway", batch, args.size), PRIORITY_BROADCAST)
+    for batch in range(1, args.uplink + 1):
+        for i, client in enumerate(clients):
+            client.queue_frames(frames_for(f"client{i}", batch, args.size))
+        time.sleep(args.interval)
+
+    while gateway.tx_queue_depth() or any(c.tx_queue_depth() for c in clients):
+        time.sleep(0.005)
+    drained = time.perf_counter() - start
+    time.sleep(0.1)
+
+    for engine in [gateway] + clients:
+        engine.shutdown()
+    return {
+        "uplink": len(uplink),
+        "uplink_sent": args.uplink * args.clients,
+        "downlink": len(downlink),
+        "downlink_sent": args.downlink * args.clients,
+        "airtime": channel.stats["airtime"],
+        "wall": drained,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--mode", choices=("pool", "single"), default="pool")
+    ap.add_argument("--clients", type=int, default=4)
+    ap.add_argument("--uplink", type=int, default=25, help="frames sent by each client")
+    ap.add_argument("--downlink", type=int, default=200, help="broadcast frames queued on the gateway")
+    ap.add_argument("--size", type=int, default=40, help="message text length in bytes")
+    ap.add_argument("--interval", type=float, default=0.02, help="seconds between client frames")
+    ap.add_argument("--time-scale", type=float, default=0.02, help="real seconds per second of airtime")
+    ap.add_argument("--seed", type=int, default=3)
+    args = ap.parse_args()
+
+    result = run(args)
+    air = result["airtime"]
+    print(f"uplink received  : {result['uplink']}/{result['uplink_sent']} "
+          f"({result['uplink'] / result['uplink_sent']:.1%})")
+    print(f"downlink heard   : {result['downlink']}/{result['downlink_sent']} "
+          f"({result['downlink'] / result['downlink_sent']:.1%})")
+    print(f"airtime          : {air:.2f} s on air, drained in {result['wall']:.2f} s wall "
+          f"({air * args.time_scale / result['wall']:.2f} radio-seconds per second)")
+    print(f"goodput          : {(result['uplink'] + result['downlink']) / result['wall']:.0f} frames/s delivered")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# bench_sync.py
+#
+# History sync between two gateways whose logs share most messages but
+# each hold some the other lacks.
+#   lan  : Gateway.sync_with over the /api/sync JSON protocol, looped back
+#          in-process; bytes on the wire against shipping the whole log.
+#   radio: RadioSync beacons on simulated radios until both logs agree;
+#          frames and airtime spent.
+# Usage: python bench_sync.py --messages 20000 --missing 50
+#        python bench_sync.py --mode radio --messages 2000 --missing 10
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+os.environ.setdefault("HDE_SYNC_INTERVAL", "3600")  # beacons are driven by hand below
+
+from gateway import Gateway
+from sim_radio import mesh
+from sync import ROOT, HttpPeer
+
+
+class LoopbackPeer(HttpPeer):
+    """
+    HttpPeer answered by another Gateway in-process, through the same
+    JSON bodies the HTTP endpoints exchange.
+    """
+    def __init__(self, gateway: Gateway):
+        super().__init__("http://loopback")
+        self.handlers = {"/api/sync/summary": gateway.sync_summary, "/api/sync/ids": gateway.sync_ids,
+                         "/api/sync/fetch": gateway.sync_fetch, "/api/sync/push": gateway.sync_push}
+
+    def _post(self, path: str, body: dict) -> dict:
+        data = json.dumps(body)
+        raw = json.dumps(self.handlers[path](json.loads(data)))
+        self.stats["requests"] += 1
+        self.stats["bytes_sent"] += len(data)
+        self.stats["bytes_received"] += len(raw)
+        return json.loads(raw)
+
+
+def make_history(count: int, missing: int, seed: int) -> tuple:
+    """
+    Entries both gateways hold, plus `missing` only each one holds, spread
+    over the last 30 days.
+    """
+    rng = random.Random(seed)
+    now = int(time.time())
+    entries = []
+    for i in range(count + 2 * missing):
+        entries.append({
+            "from": f"node{rng.randrange(12)}",
+            "timestamp": now - rng.randrange(30 * 86400),
+            "chunk_batch": i % 0xFFFF + 1,
+            "chunk": [{"id": 1, "message": "".join(rng.choice("abcdefgh ") for _ in range(rng.randint(10, 120)))}]
+        })
+    shared = entries[:count]
+    only_a = entries[count:count + missing]
+    only_b = entries[count + missing:]
+    return sorted(shared + only_a, key=lambda e: e["timestamp"]), sorted(shared + only_b, key=lambda e: e["timestamp"])
+
+
+def open_gateways(tmp: str, histories: tuple, radios: list = None) -> list:
+    gateways = []
+    for i, history in enumerate(histories):
+        gateway = Gateway(Path(tmp) / f"gw{i}", radio=radios[i] if radios else None, node_name=f"gw{i}", index=False,
+                          duty_cycle=1.0, adr="off", linger=0, sync="radio" if radios else "lan")
+        for entry in history:
+            gateway.message_log.append(entry, sync=False)
+        gateway.message_log.sync()
+        gateways.append(gateway)
+    return gateways
+
+
+def converged(gateways: list) -> bool:
+    a, b = (g.sync_index for g in gateways)
+    return len(a) == len(b) and a.buckets(*ROOT) == b.buckets(*ROOT)
+
+
+def run_lan(args, tmp: str) -> dict:
+    gateways = open_gateways(tmp, make_history(args.messages, args.missing, args.seed))
+    full = sum(len(json.dumps(e)) for e in gateways[1].message_log.read())
+    for g in gateways:
+        g.build("sync_index")
+    started = time.perf_counter()
+    result = gateways[0].sync_with("http://loopback", peer=LoopbackPeer(gateways[1]))
+    result.update(seconds=time.perf_counter() - started, full_bytes=full, converged=converged(gateways))
+    for g in gateways:
+        g.shutdown()
+    return result
+
+
+def wait_idle(gateways: list):
+    while any(g.lora_engine.tx_queue_depth() or g.lora_engine.get_state() == "transmit" for g in gateways):
+        time.sleep(0.002)
+    time.sleep(0.05)
+
+
+def run_radio(args, tmp: str) -> dict:
+    channel, radios = mesh(2, duty_cycle=1.0, loss=args.loss, seed=args.seed)
+    gateways = open_gateways(tmp, make_history(args.messages, args.missing, args.seed), radios)
+    for g in gateways:
+        g.build("lora_engine", "arq", "radio_sync")
+        # Beacons come every few hundred ms here instead of every 10 minutes:
+        # scale the answer holdoff down with them
+        g.radio_sync.answered.window = 0.2
+    rounds = 0
+    while not converged(gateways) and rounds < args.rounds:
+        # Each gateway beacons in turn; answers and pushes follow by themselves
+        gateways[rounds % 2].radio_sync.send_summary(*ROOT, descend=True)
+        rounds += 1
+        wait_idle(gateways)
+        time.sleep(0.3)
+        wait_idle(gateways)
+    result = {
+        "rounds": rounds,
+        "converged": converged(gateways),
+        "frames": channel.stats["sent"],
+        "airtime": channel.stats["airtime"],
+        "sync": [g.radio_sync.stats for g in gateways],
+        "missing": [args.messages + 2 * args.missing - len(g.sync_index) for g in gateways],
+    }
+    for g in gateways:
+        g.shutdown()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--mode", choices=("lan", "radio"), default="lan")
+    ap.add_argument("--messages", type=int, default=20000, help="messages both gateways hold")
+    ap.add_argument("--missing", type=int, default=50, help="messages only each gateway holds")
+    ap.add_argument("--loss", type=float, default=0.0, help="radio frame loss")
+    ap.add_argument("--rounds", type=int, default=40, help="most beacons in radio mode")
+    ap.add_argument("--seed", type=int, default=5)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            result = run_lan(args, tmp) if args.mode == "lan" else run_radio(args, tmp)
+
+    if args.mode == "lan":
+        wire = result["bytes_sent"] + result["bytes_received"]
+        print(f"moved            : {result['received']} received, {result['sent']} sent "
+              f"(converged: {result['converged']})")
+        print(f"requests         : {result['requests']} in {result['seconds'] * 1000:.0f} ms")
+        print(f"bytes on wire    : {wire} B, vs {result['full_bytes']} B to ship the whole log "
+              f"({result['full_bytes'] / max(wire, 1):.0f}x less)")
+    else:
+        print(f"beacons          : {result['rounds']} (converged: {result['converged']}, "
+              f"still missing {result['missing']})")
+        print(f"frames on air    : {result['frames']}, {result['airtime']:.1f} s airtime")
+        for i, stats in enumerate(result["sync"]):
+            print(f"gw{i}              : {stats}")
+
+
+if __name__ == "__main__":
+    main()
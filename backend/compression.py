@@ -0,0 +1,98 @@
+# compression.py
+
+import zlib
+from pathlib import Path
+
+from frame_codec import MAX_CHUNKS, MAX_FRAME_SIZE
+
+DICT_DIR = Path("messages") / "dict"
+
+# A batch cannot carry more than this, so no payload inflates past it
+MAX_DECOMPRESSED = MAX_CHUNKS * MAX_FRAME_SIZE
+
+# Built-in preset dictionary, id 1. zlib favours strings near the end of the
+# dictionary, so the most common phrases come last.
+DEFAULT_DICTIONARY = (
+    "please stay tuned for updates. Check Offline Services for instructions. "
+    "evacuation center, medical, rescue, water, food, shelter, power, signal, "
+    "is anyone there? we need help at the . Thank you! Salamat po. "
+    "Can't see your messages? New features coming soon! "
+    "Hello HDE Users, we have some updates for you! HDE Team "
+    "we are safe. are you safe? the and to of in on at is are "
+).encode("utf-8")
+
+# Dictionary id 0 means raw deflate without a preset dictionary.
+DEFAULT_DICTIONARY_ID = 1
+_dictionaries = {DEFAULT_DICTIONARY_ID: DEFAULT_DICTIONARY}
+# What compress() uses: the built-in dictionary every node has, until
+# use_dictionary() switches to a trained one
+_send_dictionary = DEFAULT_DICTIONARY_ID
+
+
+def load_dictionaries(directory: Path = DICT_DIR):
+    """
+    Registers trained dictionaries stored as <id>.bin (see train_dictionary.py)
+    for decompression. Senders keep the built-in one until use_dictionary().
+    """
+    for path in Path(directory).glob("*.bin"):
+        if path.stem.isdigit() and 1 < int(path.stem) < 256:
+            _dictionaries[int(path.stem)] = path.read_bytes()
+
+
+def dictionary_ids() -> list:
+    return sorted(_dictionaries)
+
+
+def latest_dictionary() -> int:
+    return max(_dictionaries)
+
+
+def use_dictionary(dict_id: int):
+    """
+    Makes compress() use dictionary `dict_id` by default. Only switch once
+    every receiving node has loaded it. Raises ValueError for an unknown id.
+    """
+    global _send_dictionary
+    if dict_id and dict_id not in _dictionaries:
+        raise ValueError(f"Unknown compression dictionary {dict_id}")
+    _send_dictionary = dict_id
+
+
+def compress(data: bytes, dict_id: int = None) -> bytes:
+    """
+    Returns dict_id byte + raw deflate stream, or None when that would not
+    be smaller than `data` and the caller should send it uncompressed.
+    """
+    dict_id = _send_dictionary if dict_id is None else dict_id
+    if dict_id:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, _dictionaries[dict_id])
+    else:
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+    packed = bytes((dict_id,)) + c.compress(data) + c.flush()
+    return packed if len(packed) < len(data) else None
+
+
+def decompress(packed) -> bytes:
+    """
+    Inverse of compress. Raises ValueError for an unknown dictionary, a
+    corrupted, truncated or empty stream, or one that inflates past
+    MAX_DECOMPRESSED bytes.
+    """
+    if not packed:
+        raise ValueError("Empty compressed payload")
+    dict_id = packed[0]
+    if dict_id and dict_id not in _dictionaries:
+        raise ValueError(f"Unknown compression dictionary {dict_id}")
+    try:
+        if dict_id:
+            d = zlib.decompressobj(-15, zdict=_dictionaries[dict_id])
+        else:
+            d = zlib.decompressobj(-15)
+        data = d.decompress(packed[1:], MAX_DECOMPRESSED)
+    except zlib.error as e:
+        raise ValueError(f"Corrupted compressed payload: {e}")
+    if d.unconsumed_tail:
+        raise ValueError(f"Compressed payload inflates past {MAX_DECOMPRESSED} bytes")
+    if not d.eof:
+        raise ValueError("Truncated compressed payload")
+    return data
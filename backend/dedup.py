@@ -0,0 +1,80 @@
+# dedup.py
+
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+class DedupCache:
+    def __init__(self, name: str, max_entries: int = 4096, window: float = 600.0):
+        """
+        Time-windowed LRU of recently seen keys. A key seen again within
+        `window` seconds is a duplicate; the oldest keys are evicted beyond
+        max_entries, so memory stays bounded however many repeats arrive.
+        Exact (no false positives), unlike a Bloom filter, which matters
+        because a dropped unique frame would cost a NACK round trip.
+        `name` labels the hde_dedup_* metrics ("frame", "message").
+        """
+        self.max_entries = max_entries
+        self.window = window
+        self.entries = OrderedDict()  # key -> last seen
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._hits = metrics.counter("hde_dedup_hits_total", "Duplicates dropped", {"layer": name})
+        self._misses = metrics.counter("hde_dedup_misses_total", "First sightings passed on", {"layer": name})
+        metrics.gauge("hde_dedup_entries", "Keys held by the dedup cache", {"layer": name}, fn=self.__len__)
+
+    def seen(self, key, now: float = None) -> bool:
+        """
+        Records `key` and returns True if it was already seen within the
+        window. A repeat refreshes the key, so a frame rebroadcast for
+        longer than the window is still caught.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            last = self.entries.pop(key, None)
+            self.entries[key] = now
+            if last is not None and now - last < self.window:
+                self.hits += 1
+                self._hits.inc()
+                return True
+            self.misses += 1
+            self._misses.inc()
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            # Entries are in last-seen order, so expired ones sit at the front
+            while self.entries:
+                oldest_key, oldest = next(iter(self.entries.items()))
+                if now - oldest < self.window:
+                    break
+                del self.entries[oldest_key]
+            return False
+
+    def contains(self, key, now: float = None) -> bool:
+        """
+        True (counted as a hit) if `key` was seen within the window; unlike
+        seen() an unknown key is not recorded.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            last = self.entries.get(key)
+            if last is None or now - last >= self.window:
+                return False
+            self.hits += 1
+            self._hits.inc()
+            return True
+
+    def stats(self) -> dict:
+        hits, misses = self.hits, self.misses
+        return {
+            "entries": len(self),
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,102 @@
+# event_bus.py
+
+import asyncio
+import queue
+import threading
+
+
+class Subscription:
+    def __init__(self, max_pending: int):
+        """
+        One consumer of the bus. `overflowed` is set when the consumer fell
+        too far behind; it should then resync from the message log.
+        """
+        self.events = queue.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def deliver(self, event) -> bool:
+        try:
+            self.events.put_nowait(event)
+            return True
+        except queue.Full:
+            self.overflowed = True
+            return False
+
+    def get(self, timeout: float = None):
+        """
+        Returns the next (seq, entry) pair, or None on timeout.
+        """
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    def __init__(self, max_pending: int, loop: asyncio.AbstractEventLoop):
+        """
+        Subscription consumed from an event loop. Publishers on other
+        threads hand events over with call_soon_threadsafe, so neither
+        side ever blocks the other.
+        """
+        self.events = asyncio.Queue(maxsize=max_pending)
+        self.loop = loop
+        self.overflowed = False
+
+    def deliver(self, event) -> bool:
+        if self.overflowed:
+            return False
+        self.loop.call_soon_threadsafe(self._put, event)
+        return True
+
+    def _put(self, event):
+        try:
+            self.events.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float = None):
+        try:
+            return await asyncio.wait_for(self.events.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class MessageBus:
+    def __init__(self, max_pending: int = 256):
+        """
+        In-process fan-out of newly stored messages to live subscribers
+        (SSE clients). Publishing never blocks the caller.
+        """
+        self.max_pending = max_pending
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self) -> Subscription:
+        sub = Subscription(self.max_pending)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def subscribe_async(self) -> AsyncSubscription:
+        """
+        Subscribes from a coroutine; events arrive on the running loop.
+        """
+        sub = AsyncSubscription(self.max_pending, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def publish(self, seq: int, entry):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if not sub.deliver((seq, entry)):
+                self.unsubscribe(sub)
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
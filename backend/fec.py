@@ -0,0 +1,190 @@
+# fec.py
+
+import math
+import struct
+import threading
+import time
+
+import metrics
+
+# Parity frame payload: parity chunk count, message length; then the block
+FEC_HEADER = struct.Struct("!BH")
+MAX_BLOCKS = 255  # data + parity chunks of one batch (chunk ids are one byte)
+
+RECOVERED = metrics.counter("hde_fec_recovered_chunks_total", "Missing chunks rebuilt from parity")
+PARITY_SENT = metrics.counter("hde_fec_parity_chunks_total", "Parity chunks generated")
+
+# GF(2^8) with the 0x11D polynomial, as used by most Reed-Solomon codes
+_EXP = [0] * 512
+_LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    _EXP[_i] = _x
+    _LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    _EXP[_i] = _EXP[_i - 255]
+_MUL = {}  # constant -> bytes.translate table, built on first use
+
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _EXP[_LOG[a] + _LOG[b]]
+
+
+def gf_inv(a: int) -> int:
+    if a == 0:
+        raise ZeroDivisionError("0 has no inverse in GF(256)")
+    return _EXP[255 - _LOG[a]]
+
+
+def _table(c: int) -> bytes:
+    table = _MUL.get(c)
+    if table is None:
+        table = _MUL[c] = bytes(gf_mul(c, v) for v in range(256))
+    return table
+
+
+def scale(block: bytes, c: int) -> int:
+    """
+    c * block, byte-wise in GF(256), as an int so blocks add with XOR.
+    The multiply is one bytes.translate (C speed) per block.
+    """
+    if c == 1:
+        return int.from_bytes(block, "big")
+    return int.from_bytes(bytes(block).translate(_table(c)), "big")
+
+
+def coefficient(parity: int, data: int, parity_count: int) -> int:
+    """
+    Cauchy matrix entry 1 / (x_parity + y_data) with x = 0..K-1 and
+    y = K..K+N-1: every square submatrix is invertible, so any N of the
+    N+K chunks determine the data.
+    """
+    return gf_inv(parity ^ (parity_count + data))
+
+
+def encode(blocks: list, parity_count: int) -> list:
+    """
+    Parity blocks for equal-length data blocks (systematic: the data
+    blocks are sent unchanged).
+    """
+    size = len(blocks[0])
+    parity = []
+    for j in range(parity_count):
+        acc = 0
+        for i, block in enumerate(blocks):
+            acc ^= scale(block, coefficient(j, i, parity_count))
+        parity.append(acc.to_bytes(size, "big"))
+    PARITY_SENT.inc(parity_count)
+    return parity
+
+
+def _invert(matrix: list) -> list:
+    """
+    Gauss-Jordan inverse of a small square matrix over GF(256).
+    """
+    n = len(matrix)
+    rows = [list(row) + [int(i == r) for i in range(n)] for r, row in enumerate(matrix)]
+    for col in range(n):
+        pivot = next(r for r in range(col, n) if rows[r][col])
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        inv = gf_inv(rows[col][col])
+        rows[col] = [gf_mul(inv, v) for v in rows[col]]
+        for r in range(n):
+            if r != col and rows[r][col]:
+                factor = rows[r][col]
+                rows[r] = [v ^ gf_mul(factor, p) for v, p in zip(rows[r], rows[col])]
+    return [row[n:] for row in rows]
+
+
+def decode(data: dict, parity: dict, count: int, parity_count: int, size: int) -> list:
+    """
+    Rebuilds every data block from any `count` of the data blocks
+    {index: block} and parity blocks {parity index: block} (0-based, data
+    blocks zero-padded to `size`). Raises ValueError with too few blocks.
+    """
+    missing = [i for i in range(count) if i not in data]
+    if not missing:
+        return [data[i] for i in range(count)]
+    rows = sorted(parity)[:len(missing)]
+    if len(rows) < len(missing):
+        raise ValueError(f"{len(missing)} chunks missing, only {len(parity)} parity chunks")
+    # Syndromes: parity minus the contribution of the data we have
+    syndromes = []
+    for j in rows:
+        acc = int.from_bytes(parity[j], "big")
+        for i, block in data.items():
+            acc ^= scale(block, coefficient(j, i, parity_count))
+        syndromes.append(acc)
+    inverse = _invert([[coefficient(j, m, parity_count) for m in missing] for j in rows])
+    blocks = dict(data)
+    for row, m in zip(inverse, missing):
+        acc = 0
+        for c, syndrome in zip(row, syndromes):
+            if c:
+                acc ^= scale(syndrome.to_bytes(size, "big"), c)
+        blocks[m] = acc.to_bytes(size, "big")
+    RECOVERED.inc(len(missing))
+    return [blocks[i] for i in range(count)]
+
+
+class FecPolicy:
+    def __init__(self, target: float = 0.99, loss: float = 0.0, half_life: float = 600.0,
+                 max_ratio: float = 0.5, clock=time.monotonic):
+        """
+        Adaptive redundancy: the fewest parity chunks that deliver an
+        N-chunk batch with probability `target` at the estimated frame loss
+        rate, capped at max_ratio * N. The estimate starts at `loss` and
+        follows chunks reported missing (NACKs) against chunks sent, with
+        older observations fading after half_life seconds, so a clean link
+        drops back to no parity at all.
+        """
+        self.target = target
+        self.max_ratio = max_ratio
+        self.half_life = half_life
+        self.clock = clock
+        self.sent = 100.0 if loss else 0.0
+        self.lost = 100.0 * loss
+        self.updated = clock()
+        self.lock = threading.Lock()
+        metrics.gauge("hde_fec_loss_estimate", "Frame loss rate FEC sizes parity for", fn=self.loss)
+
+    def _decay(self):
+        now = self.clock()
+        factor = 0.5 ** ((now - self.updated) / self.half_life)
+        self.sent *= factor
+        self.lost *= factor
+        self.updated = now
+
+    def observe(self, lost: int = 0, sent: int = 0):
+        with self.lock:
+            self._decay()
+            self.lost += lost
+            self.sent += sent
+
+    def loss(self) -> float:
+        with self.lock:
+            self._decay()
+            return min(self.lost / self.sent, 0.9) if self.sent else 0.0
+
+    @staticmethod
+    def delivery(count: int, parity: int, loss: float) -> float:
+        """
+        Probability that at least `count` of count + parity chunks arrive.
+        """
+        total = count + parity
+        return sum(math.comb(total, k) * (1 - loss) ** k * loss ** (total - k) for k in range(count, total + 1))
+
+    def parity(self, count: int, loss: float = None) -> int:
+        loss = self.loss() if loss is None else loss
+        if count < 2 or loss <= 0:
+            return 0
+        limit = min(math.ceil(count * self.max_ratio), MAX_BLOCKS - count)
+        for parity in range(limit + 1):
+            if self.delivery(count, parity, loss) >= self.target:
+                return parity
+        return limit
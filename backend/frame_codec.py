@@ -0,0 +1,370 @@
+# frame_codec.py
+
+import binascii
+import operator
+import struct
+from functools import reduce
+
+# First byte of a binary frame: high nibble marks binary, low nibble is the
+# version. Text frames always start with "from:" so the two never collide.
+BINARY_MAGIC = 0xC0
+BINARY_VERSION = 1
+
+# version, flags, batch, chunk_id, chunk_count, timestamp, sender length
+BINARY_HEADER = struct.Struct("!BBHBBIB")
+BINARY_CRC = struct.Struct("!H")
+MAX_SENDER_BYTES = 32
+MAX_CHUNKS = 255
+
+# Binary header flag bits
+FLAG_NACK = 0x01  # control frame: selective-repeat request, see arq.py
+FLAG_COMPRESSED = 0x02  # payload is compression.compress() output, split over the batch
+FLAG_ADR = 0x04  # control frame: data-rate / TX power command, see adr.py
+FLAG_FEC = 0x08  # batch carries Reed-Solomon parity chunks (ids past chunk_count), see fec.py
+FLAG_SYNC = 0x10  # control frame: history sync summary or id list, see sync.py
+# Frames carrying any of these are never messages, whichever features a node runs
+CONTROL_FLAGS = FLAG_NACK | FLAG_ADR | FLAG_SYNC
+
+# SX127x FIFO payload limit we allow per frame
+MAX_FRAME_SIZE = 240
+
+# Multi-hop envelope put around a binary or text frame by relay.py:
+# magic/version, hops left (TTL), hops taken, origin node id, origin packet
+# id, last hop node id. The inner frame is never modified, so its CRC and
+# dedup key stay the same on every hop.
+MESH_MAGIC = 0xD0
+MESH_VERSION = 1
+MESH_HEADER = struct.Struct("!BBBHHH")
+# Largest frame a relaying node may originate: the envelope must still fit
+MESH_FRAME_SIZE = MAX_FRAME_SIZE - MESH_HEADER.size
+
+# Aggregate: several small frames sharing one transmission (one preamble and
+# PHY header) when the engine lingers: magic/version and frame count, then
+# each frame prefixed with its length, then a CRC-16 of all of it. Inner
+# frames keep their own CRC and dedup key.
+AGGREGATE_MAGIC = 0xE0
+AGGREGATE_VERSION = 1
+AGGREGATE_HEADER = struct.Struct("!BB")
+AGGREGATE_LENGTH = struct.Struct("!B")
+AGGREGATE_OVERHEAD = AGGREGATE_HEADER.size + BINARY_CRC.size
+
+TEXT_FIELDS = ("from", "message", "checksum", "chunk_id", "chunk_batch", "timestamp")
+TEXT_OPTIONAL_FIELDS = ("chunk_count",)
+
+
+class FrameError(ValueError):
+    pass
+
+
+class ChecksumError(FrameError):
+    """
+    The frame arrived intact enough to parse but its CRC does not match.
+    """
+
+
+class MeshHeader:
+    __slots__ = ("ttl", "hops", "origin", "packet_id", "last_hop")
+
+    def __init__(self, ttl: int, hops: int, origin: int, packet_id: int, last_hop: int):
+        self.ttl = ttl
+        self.hops = hops
+        self.origin = origin
+        self.packet_id = packet_id
+        self.last_hop = last_hop
+
+
+def node_id(name: str) -> int:
+    """
+    16-bit node id carried in mesh envelopes, derived from the node name.
+    """
+    return binascii.crc_hqx(name.encode("utf-8"), 0xFFFF)
+
+
+def sender_bytes(sender: str) -> bytes:
+    """
+    The sender field of a binary frame: UTF-8, cut to MAX_SENDER_BYTES on a
+    code point boundary so the receiver decodes a prefix of the name.
+    """
+    encoded = sender.encode("utf-8")
+    if len(encoded) <= MAX_SENDER_BYTES:
+        return encoded
+    return encoded[:MAX_SENDER_BYTES].decode("utf-8", "ignore").encode("utf-8")
+
+
+class Frame:
+    __slots__ = ("sender", "batch", "chunk_id", "chunk_count", "timestamp",
+                 "payload", "flags", "checksum", "version")
+
+    def __init__(self, sender: str, batch: int, chunk_id: int = 1, chunk_count: int = 1,
+                 timestamp: int = 0, payload=b"", flags: int = 0, checksum: str = None,
+                 version: int = BINARY_VERSION):
+        """
+        One LoRa frame. `payload` is bytes or a memoryview into the received
+        buffer; it is only decoded to text on demand.
+        """
+        self.sender = sender
+        self.batch = batch
+        self.chunk_id = chunk_id
+        self.chunk_count = chunk_count
+        self.timestamp = timestamp
+        self.payload = payload
+        self.flags = flags
+        self.checksum = checksum
+        self.version = version
+
+    def text(self) -> str:
+        return str(self.payload, "utf-8", "replace")
+
+    def __repr__(self):
+        return (f"Frame(sender={self.sender!r}, batch={self.batch}, chunk={self.chunk_id}/"
+                f"{self.chunk_count}, timestamp={self.timestamp}, payload={len(self.payload)}B)")
+
+
+class FrameCodec:
+    @staticmethod
+    def xor_crc(payload: str) -> str:
+        """
+        The legacy text-frame checksum: XOR of all code points.
+        """
+        return format(reduce(operator.xor, map(ord, payload), 0), "02X")
+
+    @staticmethod
+    def crc16(data) -> int:
+        """
+        CRC-16/CCITT-FALSE, computed in C by binascii.
+        """
+        return binascii.crc_hqx(data, 0xFFFF)
+
+    # ---------------------------------------------------------------- binary
+
+    @staticmethod
+    def header_size(sender: str) -> int:
+        return BINARY_HEADER.size + len(sender_bytes(sender)) + BINARY_CRC.size
+
+    @staticmethod
+    def encode_binary(frame: Frame) -> bytes:
+        sender = sender_bytes(frame.sender)
+        header = BINARY_HEADER.pack(
+            BINARY_MAGIC | BINARY_VERSION, frame.flags & 0xFF, frame.batch & 0xFFFF,
+            frame.chunk_id & 0xFF, frame.chunk_count & 0xFF, frame.timestamp & 0xFFFFFFFF,
+            len(sender)
+        )
+        body = b"".join((header, sender, frame.payload))
+        return body + BINARY_CRC.pack(FrameCodec.crc16(body))
+
+    @staticmethod
+    def decode_binary(raw) -> Frame:
+        """
+        Decodes a binary frame without copying the payload: the returned
+        frame's payload is a memoryview slice of `raw`.
+        """
+        view = memoryview(raw)
+        if len(view) < BINARY_HEADER.size + BINARY_CRC.size:
+            raise FrameError("Frame too short.")
+        end = len(view) - BINARY_CRC.size
+        (expected,) = BINARY_CRC.unpack_from(view, end)
+        actual = FrameCodec.crc16(view[:end])
+        if expected != actual:
+            raise ChecksumError(f"CRC mismatch (expected {actual:04X}, got {expected:04X})")
+
+        magic, flags, batch, chunk_id, chunk_count, timestamp, sender_len = BINARY_HEADER.unpack_from(view)
+        if magic & 0xF0 != BINARY_MAGIC:
+            raise FrameError("Not a binary frame.")
+        if magic & 0x0F != BINARY_VERSION:
+            raise FrameError(f"Unsupported frame version {magic & 0x0F}.")
+        start = BINARY_HEADER.size + sender_len
+        if start > end:
+            raise FrameError("Sender overruns frame.")
+        sender = str(view[BINARY_HEADER.size:start], "utf-8", "replace")
+        return Frame(sender, batch, chunk_id, chunk_count, timestamp, view[start:end], flags,
+                     version=magic & 0x0F)
+
+    # ------------------------------------------------------------------ text
+
+    @staticmethod
+    def text_overhead(sender: str, checksum: str = "") -> int:
+        """
+        Worst-case bytes a text frame adds around its message.
+        """
+        widest = Frame(sender, 0xFFFF, MAX_CHUNKS, MAX_CHUNKS, 0xFFFFFFFF, b"", checksum=checksum)
+        # The XOR checksum is up to 6 hex digits for astral code points
+        return len(FrameCodec.encode_text(widest)) - 2 + 6
+
+    @staticmethod
+    def encode_text(frame: Frame) -> bytes:
+        """
+        Legacy "from:..|message:..|...*CRC" framing. Multi-chunk frames
+        add a trailing chunk_count field, which older parsers ignore.
+        """
+        values = (frame.sender, frame.text(), frame.checksum or "", frame.chunk_id,
+                  frame.batch, frame.timestamp)
+        payload = "|".join(f"{key}:{value}" for key, value in zip(TEXT_FIELDS, values))
+        if frame.chunk_count != 1:
+            payload += f"|chunk_count:{frame.chunk_count}"
+        return f"{payload}*{FrameCodec.xor_crc(payload)}".encode("utf-8")
+
+    @staticmethod
+    def decode_text(raw) -> Frame:
+        text = raw if isinstance(raw, str) else str(raw, "utf-8", "ignore")
+        payload, sep, crc = text.rpartition("*")
+        if not sep:
+            raise FrameError("CRC delimiter not found.")
+        expected_crc = FrameCodec.xor_crc(payload)
+        if crc.upper() != expected_crc:
+            raise ChecksumError(f"CRC mismatch (expected {expected_crc}, got {crc.upper()})")
+
+        fields = {}
+        key = None
+        for part in payload.split("|"):
+            name, colon, value = part.partition(":")
+            if colon and (name in TEXT_FIELDS or name in TEXT_OPTIONAL_FIELDS):
+                key = name
+                fields[key] = value
+            elif key == "message":
+                # A "|" inside the message text
+                fields[key] += "|" + part
+
+        try:
+            timestamp = int(fields.get("timestamp") or 0)
+        except ValueError:
+            raise FrameError("Invalid timestamp format.")
+        try:
+            batch = int(fields.get("chunk_batch") or 0)
+        except ValueError:
+            raise FrameError("Invalid chunk batch format.")
+        try:
+            chunk_id = int(fields.get("chunk_id") or 1)
+            chunk_count = int(fields.get("chunk_count") or 1)
+        except ValueError:
+            chunk_id, chunk_count = 1, 1
+
+        return Frame(fields.get("from"), batch, chunk_id, chunk_count, timestamp,
+                     fields.get("message", "").encode("utf-8"),
+                     checksum=fields.get("checksum"), version=0)
+
+    # ---------------------------------------------------------------- common
+
+    @staticmethod
+    def capacity(sender: str, binary: bool = True, checksum: str = "", max_size: int = MAX_FRAME_SIZE) -> int:
+        """
+        Message bytes that fit in one frame for this sender.
+        """
+        overhead = FrameCodec.header_size(sender) if binary else FrameCodec.text_overhead(sender, checksum)
+        return max_size - overhead
+
+    @staticmethod
+    def is_binary(raw) -> bool:
+        return bool(raw) and not isinstance(raw, str) and raw[0] & 0xF0 == BINARY_MAGIC
+
+    @staticmethod
+    def peek_flags(raw) -> int:
+        """
+        Header flags of a binary frame without decoding it; 0 for text frames.
+        """
+        return raw[1] if FrameCodec.is_binary(raw) and len(raw) > 1 else 0
+
+    @staticmethod
+    def is_mesh(raw) -> bool:
+        return bool(raw) and not isinstance(raw, str) and raw[0] & 0xF0 == MESH_MAGIC
+
+    @staticmethod
+    def encode_mesh(header: MeshHeader, frame) -> bytes:
+        return MESH_HEADER.pack(MESH_MAGIC | MESH_VERSION, header.ttl, header.hops,
+                                header.origin, header.packet_id, header.last_hop) + frame
+
+    @staticmethod
+    def decode_mesh(raw) -> tuple:
+        """
+        Returns (MeshHeader, inner frame as a memoryview of `raw`).
+        """
+        if len(raw) < MESH_HEADER.size:
+            raise FrameError("Mesh envelope too short.")
+        magic, ttl, hops, origin, packet_id, last_hop = MESH_HEADER.unpack_from(raw)
+        if magic & 0x0F != MESH_VERSION:
+            raise FrameError(f"Unsupported mesh version {magic & 0x0F}.")
+        return MeshHeader(ttl, hops, origin, packet_id, last_hop), memoryview(raw)[MESH_HEADER.size:]
+
+    @staticmethod
+    def unwrap(raw):
+        """
+        The inner frame of a mesh envelope; any other frame as is.
+        """
+        if FrameCodec.is_mesh(raw):
+            return memoryview(raw)[MESH_HEADER.size:]
+        return raw
+
+    @staticmethod
+    def is_aggregate(raw) -> bool:
+        return bool(raw) and not isinstance(raw, str) and raw[0] & 0xF0 == AGGREGATE_MAGIC
+
+    @staticmethod
+    def encode_aggregate(frames: list) -> bytes:
+        parts = [AGGREGATE_HEADER.pack(AGGREGATE_MAGIC | AGGREGATE_VERSION, len(frames))]
+        for frame in frames:
+            parts.append(AGGREGATE_LENGTH.pack(len(frame)))
+            parts.append(frame)
+        body = b"".join(parts)
+        return body + BINARY_CRC.pack(FrameCodec.crc16(body))
+
+    @staticmethod
+    def split(raw) -> list:
+        """
+        The frames packed in an aggregate, as memoryviews of `raw`; any
+        other frame as a one-item list.
+        """
+        if not FrameCodec.is_aggregate(raw):
+            return [raw]
+        view = memoryview(raw)
+        if len(view) < AGGREGATE_OVERHEAD:
+            raise FrameError("Aggregate too short.")
+        end = len(view) - BINARY_CRC.size
+        (expected,) = BINARY_CRC.unpack_from(view, end)
+        if expected != FrameCodec.crc16(view[:end]):
+            raise ChecksumError("Aggregate CRC mismatch")
+        magic, count = AGGREGATE_HEADER.unpack_from(view)
+        if magic & 0x0F != AGGREGATE_VERSION:
+            raise FrameError(f"Unsupported aggregate version {magic & 0x0F}.")
+        frames = []
+        pos = AGGREGATE_HEADER.size
+        for _ in range(count):
+            if pos >= end:
+                raise FrameError("Aggregate truncated.")
+            length = view[pos]
+            pos += AGGREGATE_LENGTH.size
+            if pos + length > end:
+                raise FrameError("Aggregate frame overruns.")
+            frames.append(view[pos:pos + length])
+            pos += length
+        return frames
+
+    @staticmethod
+    def frame_key(raw):
+        """
+        Identity of a frame for duplicate detection, read without decoding:
+        (sender, batch, chunk_id, crc) for binary frames, the raw frame for
+        text frames. Mesh envelopes are looked through.
+        """
+        raw = FrameCodec.unwrap(raw)
+        if FrameCodec.is_binary(raw) and len(raw) >= BINARY_HEADER.size + BINARY_CRC.size:
+            _, _, batch, chunk_id, _, _, sender_len = BINARY_HEADER.unpack_from(raw)
+            sender = bytes(raw[BINARY_HEADER.size:BINARY_HEADER.size + sender_len])
+            (crc,) = BINARY_CRC.unpack_from(raw, len(raw) - BINARY_CRC.size)
+            return sender, batch, chunk_id, crc
+        return raw if isinstance(raw, str) else bytes(raw)
+
+    @staticmethod
+    def encode(frame: Frame, binary: bool = True) -> bytes:
+        return FrameCodec.encode_binary(frame) if binary else FrameCodec.encode_text(frame)
+
+    @staticmethod
+    def decode(raw) -> Frame:
+        """
+        Decodes either framing, detected from the first byte.
+        Raises FrameError on malformed or corrupted frames.
+        """
+        raw = FrameCodec.unwrap(raw)
+        if FrameCodec.is_binary(raw):
+            return FrameCodec.decode_binary(raw)
+        if FrameCodec.is_aggregate(raw):
+            raise FrameError("Aggregate frame, split() it first.")
+        return FrameCodec.decode_text(raw)
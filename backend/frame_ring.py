@@ -0,0 +1,34 @@
+# frame_ring.py
+
+# SX127x FIFO: the longest packet a radio can hand over
+FIFO_SIZE = 255
+
+
+class FrameRing:
+    def __init__(self, slots: int = 4, slot_size: int = FIFO_SIZE):
+        """
+        Preallocated receive buffers, used in turn. read() has the radio
+        copy its FIFO straight into the next slot and returns a memoryview
+        of the frame, so receiving allocates no bytes objects. A view stays
+        valid until the ring wraps around to its slot again: listeners that
+        keep a frame past their call must copy it with bytes().
+        """
+        self.slot_size = slot_size
+        self._buffers = [bytearray(slot_size) for _ in range(slots)]
+        self._views = [memoryview(buffer) for buffer in self._buffers]
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._views)
+
+    def read(self, radio) -> memoryview:
+        """
+        Reads one frame from `radio` (which must offer read_into). Returns
+        None for a frame longer than a slot, which arrives truncated.
+        """
+        view = self._views[self._next]
+        self._next = (self._next + 1) % len(self._views)
+        length = radio.read_into(view)
+        if length > len(view):
+            return None
+        return view[:length]
@@ -0,0 +1,671 @@
+# gateway.py
+
+import json
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import compression
+from adr import AdaptiveDataRate
+from arq import SelectiveRepeat
+from event_bus import MessageBus
+from fec import FecPolicy
+from frame_codec import CONTROL_FLAGS, MAX_FRAME_SIZE, MAX_SENDER_BYTES, MESH_FRAME_SIZE, FrameCodec
+from id_allocator import IdAllocator
+from logs import get_logger
+from lora_engine import LoRaEngine
+from message_index import MessageIndex, message_text
+from message_log import MessageLog
+from outbox import Outbox, DutyCycleScheduler, PRIORITY_BROADCAST, PRIORITY_DIRECT, PRIORITY_NAMES
+from parser import Parser
+from radio_pool import RadioPool
+from relay import Relay
+from stream import MessageStream
+from sync import (MAX_FETCH, HttpPeer, RadioSync, SyncIndex, exchange, ids_body, message_key, parse_ids,
+                  peer_addresses, peer_origin, summary_body, token_matches)
+
+log = get_logger("gateway")
+
+PRIORITIES = {name: priority for priority, name in PRIORITY_NAMES.items()}
+
+# Seconds between status checks on each event stream; changes are pushed
+STATUS_INTERVAL = 5.0
+
+# Entries per /api/messages/<filename> response from the message log
+DEFAULT_PAGE = 200
+MAX_PAGE = 1000
+
+
+class component:
+    """
+    Gateway attribute built by the decorated method on first access, once,
+    under the gateway's init lock; later reads are plain attribute lookups.
+    """
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+
+    def __get__(self, gateway, owner=None):
+        if gateway is None:
+            return self
+        with gateway._init_lock:
+            if self.name not in gateway.__dict__:
+                gateway.__dict__[self.name] = self.build(gateway)
+            return gateway.__dict__[self.name]
+
+
+def format_event(seq: int, entry) -> str:
+    """
+    One Server-Sent Events message; the id is the message log offset.
+    """
+    return f"id: {seq}\nevent: message\ndata: {json.dumps(entry)}\n\n"
+
+
+def page_limit(limit: int = None) -> int:
+    """
+    Entries per /api/messages/<filename> page: DEFAULT_PAGE unless asked,
+    MAX_PAGE at most.
+    """
+    return max(1, min(limit or DEFAULT_PAGE, MAX_PAGE))
+
+
+def format_status(status: dict) -> str:
+    """
+    Status bar update for SSE clients. It carries no id, so Last-Event-ID
+    keeps tracking message log offsets.
+    """
+    return f"event: status\ndata: {json.dumps(status)}\n\n"
+
+
+class Gateway:
+    def __init__(self, messages_dir: Path = Path("messages"), radio=None, radios: list = None,
+                 binary_frames: bool = None, node_name: str = None, index: bool = None,
+                 duty_cycle: float = None, relay: bool = None, adr: str = None, adr_coordinators: list = None,
+                 linger: float = None, fec: str = None, sync: str = None, sync_peers: list = None,
+                 sync_token: str = None):
+        """
+        The gateway core shared by the Flask (main.py) and ASGI (asgi.py)
+        servers: message storage, radio engine, ARQ and the live event bus.
+        Several `radios` (or the HDE_RADIOS spec list) form a RadioPool in
+        place of the single-radio LoRaEngine.
+        Construction only reads configuration: storage and radio are
+        components built on first use, and start() warms them up on a
+        background thread so a server is answering right away.
+        """
+        self.messages_dir = Path(messages_dir)
+        self.messages_file = self.messages_dir / "messages.json"
+        self.save_dir = self.messages_dir / "saves"
+        self.message_bus = MessageBus()
+        self.ready = threading.Event()
+        self._init_lock = threading.RLock()
+        self._radio, self._radios = radio, radios
+        self.radio_error = None  # why the radio could not be opened, if it could not
+
+        # Optional SQLite index behind /api/messages queries; HDE_INDEX=0 disables it
+        if index is None:
+            index = os.environ.get("HDE_INDEX", "1") != "0"
+        self.index_enabled = index
+
+        # "binary" for the compact struct-packed frames, "text" for legacy nodes
+        if binary_frames is None:
+            binary_frames = os.environ.get("HDE_FRAME_MODE", "binary") != "text"
+        self.binary_frames = binary_frames
+
+        # Regional duty-cycle limit (fraction of airtime); HDE_DUTY_CYCLE=1 disables it
+        if duty_cycle is None:
+            duty_cycle = float(os.environ.get("HDE_DUTY_CYCLE", "0.01"))
+        self.duty_cycle = duty_cycle
+        self.node_name = node_name or os.environ.get("HDE_NODE_NAME", socket.gethostname())
+
+        # Multi-hop relay mode (HDE_RELAY=1); HDE_HOP_LIMIT bounds how far our frames travel
+        if relay is None:
+            relay = os.environ.get("HDE_RELAY", "0") == "1"
+        self.relay = Relay(self.node_name, hop_limit=int(os.environ.get("HDE_HOP_LIMIT", "3"))) if relay else None
+        # Largest frame we originate: relayed ones leave room for the mesh envelope
+        self.max_frame = MESH_FRAME_SIZE if self.relay is not None else MAX_FRAME_SIZE
+        # Seconds to wait for more small frames to share a transmission
+        # (HDE_LINGER, 0 disables); legacy text-frame nodes cannot split them
+        if linger is None:
+            linger = float(os.environ.get("HDE_LINGER", "0.05"))
+        self.linger = linger if linger > 0 and self.binary_frames else None
+
+        # Forward error correction (HDE_FEC): "adaptive" adds parity chunks to
+        # multi-frame binary batches as the link loses frames, "off" disables it
+        if fec is None:
+            fec = os.environ.get("HDE_FEC", "adaptive")
+        self.fec = FecPolicy() if fec != "off" and self.binary_frames else None
+
+        # Adaptive data rate (HDE_ADR): "coordinate" picks SF/bandwidth/power
+        # from link quality, "follow" obeys the coordinator(s) named in
+        # HDE_ADR_COORDINATOR (comma-separated), "off" (the default) disables it
+        if adr is None:
+            adr = os.environ.get("HDE_ADR", "off")
+        if adr_coordinators is None:
+            adr_coordinators = [name.strip() for name in os.environ.get("HDE_ADR_COORDINATOR", "").split(",")
+                                if name.strip()]
+        self.adr_coordinators = tuple(adr_coordinators)
+        if adr == "follow" and not self.adr_coordinators:
+            log.warning("HDE_ADR=follow needs HDE_ADR_COORDINATOR; adaptive data rate disabled")
+            adr = "off"
+        if adr != "off" and self.relay is not None:
+            log.warning("Adaptive data rate measures direct links only; disabled in relay mode")
+            adr = "off"
+        self.adr_mode = adr
+
+        # History sync with other gateways (HDE_SYNC): the /api/sync endpoints
+        # always answer; "radio" also beacons summaries and answers them over LoRa
+        if sync is None:
+            sync = os.environ.get("HDE_SYNC", "lan")
+        if sync == "radio" and not self.binary_frames:
+            log.warning("Radio history sync needs binary frames; disabled")
+            sync = "lan"
+        self.sync_mode = sync
+        self._sync_lock = threading.Lock()
+        # Gateways /api/sync may contact (HDE_SYNC_PEERS, comma-separated
+        # URLs), and the shared secret (HDE_SYNC_TOKEN) a peer must present
+        # to push entries; without one, pushes are taken from those peers only
+        if sync_peers is None:
+            sync_peers = [url for url in os.environ.get("HDE_SYNC_PEERS", "").split(",") if url.strip()]
+        self.sync_peers = {peer_origin(url): url.strip() for url in sync_peers}
+        self.sync_token = sync_token if sync_token is not None else os.environ.get("HDE_SYNC_TOKEN") or None
+
+    # ------------------------------------------------------------ components
+
+    @component
+    def message_log(self) -> MessageLog:
+        return MessageLog(self.messages_dir / "log", legacy_path=self.messages_file)
+
+    @component
+    def message_index(self) -> MessageIndex:
+        if not self.index_enabled:
+            return None
+        message_index = MessageIndex(self.messages_dir / "index.sqlite3")
+        message_index.catch_up(self.message_log)
+        return message_index
+
+    @component
+    def stream(self) -> MessageStream:
+        stream = MessageStream(log=self.message_log, persist_path=self.save_dir / "partials.json")
+        stream.reassembler.start()
+        return stream
+
+    @component
+    def id_allocator(self) -> IdAllocator:
+        return Parser.open_id_allocator(self.messages_dir / "ids.json", self.messages_dir / "to_send.json",
+                                        last_batch=lambda: self.message_log.max_batch())
+
+    @component
+    def outbox(self) -> Outbox:
+        return Outbox(self.messages_dir / "outbox.journal")
+
+    @component
+    def lora_engine(self):
+        """
+        Opens the radio(s) and starts receiving. Frames may arrive at once,
+        so everything the receive path needs is built first.
+        """
+        compression.load_dictionaries(self.messages_dir / "dict")
+        # Senders stay on the built-in dictionary until HDE_COMPRESSION_DICT
+        # names a trained one that every node has loaded
+        if os.environ.get("HDE_COMPRESSION_DICT"):
+            try:
+                compression.use_dictionary(int(os.environ["HDE_COMPRESSION_DICT"]))
+            except ValueError as e:
+                log.warning("Keeping the default compression dictionary: %s", e)
+        self.build("stream", "message_index")
+        if self.radio_error is not None:
+            # Opening it again on every request would fail the same way
+            raise RuntimeError(f"Radio unavailable: {self.radio_error}")
+        scheduler = DutyCycleScheduler(self.duty_cycle) if 0 < self.duty_cycle < 1 else None
+        try:
+            # HDE_RADIOS: JSON list of radio_pool.RadioPool.from_specs specs
+            if self._radios is None and self._radio is None and os.environ.get("HDE_RADIOS"):
+                engine = RadioPool.from_specs(json.loads(os.environ["HDE_RADIOS"]), outbox=self.outbox,
+                                              duty_cycle=self.duty_cycle, relay=self.relay, linger=self.linger)
+            elif self._radios:
+                engine = RadioPool(self._radios, outbox=self.outbox, duty_cycle=self.duty_cycle, relay=self.relay,
+                                   linger=self.linger)
+            else:
+                engine = LoRaEngine(radio=self._radio, outbox=self.outbox, scheduler=scheduler, relay=self.relay,
+                                    linger=self.linger)
+        except Exception as e:
+            self.radio_error = f"{type(e).__name__}: {e}"
+            raise
+        engine.set_state("receive")
+        engine.add_listener(self.handle_received_frame)
+        return engine
+
+    @component
+    def arq(self) -> SelectiveRepeat:
+        # NACKs and retransmissions are only useful now; they are not journaled
+        arq = SelectiveRepeat(self.node_name, self.stream.reassembler,
+                              send=lambda frame: self.lora_engine.queue_message(frame, PRIORITY_DIRECT,
+                                                                                durable=False),
+                              on_nack=(lambda n: self.fec.observe(lost=n)) if self.fec is not None else None)
+        arq.start()
+        return arq
+
+    @component
+    def adr(self) -> AdaptiveDataRate:
+        if self.adr_mode == "off":
+            return None
+        adr = AdaptiveDataRate(self.node_name, self.lora_engine, coordinator=self.adr_mode == "coordinate",
+                               coordinators=self.adr_coordinators)
+        adr.start()
+        return adr
+
+    @component
+    def sync_index(self) -> SyncIndex:
+        """
+        Message ids by time for history sync. Reading them parses the whole
+        log once, so start() builds it after the radio is up; from then on
+        the stream also checks it for old messages re-sent by peers.
+        """
+        sync_index = SyncIndex()
+        sync_index.catch_up(self.message_log)
+        self.stream.known = sync_index.knows
+        return sync_index
+
+    @component
+    def radio_sync(self) -> RadioSync:
+        if self.sync_mode != "radio":
+            return None
+        radio_sync = RadioSync(self.node_name, self.lora_engine, self.sync_index,
+                               read=lambda ids: self.message_log.read_seqs(self.sync_index.seqs(ids)),
+                               send=self.resend, interval=float(os.environ.get("HDE_SYNC_INTERVAL", "600")),
+                               max_size=self.max_frame)
+        radio_sync.start()
+        return radio_sync
+
+    @property
+    def checksum(self) -> str:
+        """
+        CRC32 of the message history, kept up by the message log on every
+        append (and restored from its snapshot on restart).
+        """
+        return self.message_log.checksum()
+
+    def start(self):
+        """
+        Builds every component on a background thread: storage first, then
+        the radio with ARQ, ADR and radio sync, then the sync index. Requests
+        that need a component before that wait for it; `ready` is set once
+        all are up. A radio that cannot be opened leaves storage and the
+        message API working, with status() reporting the error.
+        """
+        threading.Thread(target=self._warm_up, name="gateway-init", daemon=True).start()
+
+    def _warm_up(self):
+        started = time.perf_counter()
+        try:
+            self.build("outbox", "id_allocator", "message_log", "stream", "message_index")
+        except Exception as e:
+            log.error("Gateway start failed: %s", e)
+            return
+        try:
+            self.build("lora_engine", "arq", "adr")
+        except Exception as e:
+            log.error("Radio unavailable, serving stored messages only: %s", e)
+        try:
+            self.build("sync_index")
+            if self.radio_error is None:
+                self.build("radio_sync")
+        except Exception as e:
+            log.error("Gateway start failed: %s", e)
+            return
+        self.ready.set()
+        log.info("Gateway ready in %.3f s", time.perf_counter() - started)
+
+    def build(self, *names):
+        """
+        Builds the named components now, in order.
+        """
+        for name in names:
+            getattr(self, name)
+
+    def _built(self, name: str):
+        """
+        The component if it has been built, else None (without building it).
+        """
+        return self.__dict__.get(name)
+
+    def engine_state(self) -> str:
+        """
+        Radio state without waiting for the radio: "error" if it could not
+        be opened, None while it is still starting.
+        """
+        engine = self._built("lora_engine")
+        if engine is not None:
+            return engine.get_state()
+        return "error" if self.radio_error is not None else None
+
+    def _queue_frames(self, frames: list, priority: int, durable: bool = True):
+        if self.radio_error is not None:
+            # Journaled in the outbox until a restart brings the radio back
+            self.outbox.put_many(frames, priority, durable)
+        else:
+            self.lora_engine.queue_frames(frames, priority, durable)
+
+    def handle_received_frame(self, raw):
+        """
+        LoRaEngine listener: parses a received frame, stores the completed
+        message and pushes it to connected clients. NACKs go to the ARQ layer,
+        rate commands to ADR, sync summaries to radio sync; control frames
+        for a feature that is off are dropped.
+        """
+        if self.arq.handle_control(raw):
+            return
+        if self.adr is not None and self.adr.handle_control(raw):
+            return
+        if self.radio_sync is not None and self.radio_sync.handle_control(raw):
+            return
+        if FrameCodec.peek_flags(raw) & CONTROL_FLAGS:
+            # Control traffic for a feature this node has turned off
+            return
+        parsed = Parser.parse_message(raw)
+        if not parsed.valid:
+            log.debug("Dropping frame: %s", parsed.error)
+            return
+        if self.adr is not None:
+            self.adr.observe(parsed)
+        stored = self.stream.receive_frame(parsed)
+        if stored is not None:
+            self.stored(*stored)
+
+    def stored(self, seq: int, entry: dict):
+        """
+        Called once an entry is in the message log: indexes it and pushes it
+        to connected clients.
+        """
+        if self.message_index is not None:
+            self.message_index.add(seq, entry)
+        if self._built("sync_index") is not None:
+            self.sync_index.add(seq, entry)
+        self.message_bus.publish(seq, entry)
+
+    def events_after(self, sent: int, event: tuple) -> list:
+        """
+        The (seq, entry) pairs an SSE client that has sent up to `sent`
+        streams on bus event `event`. The radio thread and /api/send
+        publish concurrently, so seqs can arrive out of order: any skipped
+        are read back from the log instead of being lost.
+        """
+        seq = event[0]
+        if seq <= sent:
+            return []
+        if seq == sent + 1:
+            return [event]
+        return list(enumerate(self.message_log.read(sent + 1, seq - sent), start=sent + 1))
+
+    def save_message(self, entry):
+        try:
+            seq = self.message_log.append(entry)
+            log.debug("Appended message #%d to %s", seq, self.message_log.root)
+            return seq
+        except Exception as e:
+            log.error("Saving message failed: %s", e)
+            return None
+
+    def send(self, from_field: str, message: str, checksum: str, priority: str = "broadcast") -> dict:
+        """
+        Frames, queues, stores and publishes an outgoing message.
+        `priority` is a class name: "emergency", "direct" or "broadcast".
+        Raises ValueError for an unknown class, a sender name too long for
+        a binary frame or a message that cannot be framed.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        if self.binary_frames and len(from_field.encode("utf-8")) > MAX_SENDER_BYTES:
+            raise ValueError(f"Sender name is longer than {MAX_SENDER_BYTES} bytes")
+        # Structure the new message
+        new_entry = {
+            "from": from_field,
+            "timestamp": int(time.time()),
+            "chunk_batch": Parser.generate_batch_id(self.id_allocator),
+            "chunk": [
+                {
+                    "id": Parser.generate_chunk_id(allocator=self.id_allocator),
+                    "message": message
+                }
+            ]
+        }
+        log.debug("New entry to send: %s", new_entry)
+        frames = Parser.prepare_frames({
+            "from": from_field,
+            "message": message,
+            "checksum": checksum,
+            "chunk_id": new_entry["chunk"][0]["id"],
+            "chunk_batch": new_entry["chunk_batch"],
+            "timestamp": new_entry["timestamp"]
+        }, binary=self.binary_frames, parity=self._parity if self.fec is not None else None,
+            max_size=self.max_frame)
+        if self.fec is not None:
+            self.fec.observe(sent=len(frames))
+        self.arq.remember(from_field, new_entry["chunk_batch"], frames)
+        # Our own message heard back from another node is not stored again
+        self.stream.completed.seen((from_field, new_entry["chunk_batch"], new_entry["timestamp"]))
+        self._queue_frames(frames, PRIORITIES[priority])
+
+        seq = self.save_message(new_entry)
+        if seq is not None:
+            self.stored(seq, new_entry)
+        return new_entry
+
+    def _parity(self, count: int) -> int:
+        """
+        Parity chunks for a batch of `count` frames: sized for the worse of
+        the NACK-reported loss and the chunk loss ADR sees from our peers
+        (links are assumed roughly symmetric).
+        """
+        loss = self.fec.loss()
+        adr = self._built("adr")
+        if adr is not None:
+            loss = max([loss] + [link.per for link in adr.links.recent().values()])
+        return self.fec.parity(count, loss)
+
+    # ------------------------------------------------------------ history sync
+
+    def sync_summary(self, body: dict) -> dict:
+        """
+        /api/sync/summary: fingerprints of time buckets (sync.summary_body).
+        Raises ValueError for a malformed request.
+        """
+        # Picks up entries written around the gateway (e.g. other tools)
+        self.sync_index.catch_up(self.message_log)
+        return summary_body(self.sync_index, body)
+
+    def sync_ids(self, body: dict) -> dict:
+        return ids_body(self.sync_index, body)
+
+    def sync_fetch(self, body: dict) -> dict:
+        """
+        /api/sync/fetch: the entries with the given ids, at most MAX_FETCH.
+        """
+        ids = parse_ids(body.get("ids") if isinstance(body, dict) else None)
+        return {"data": self.message_log.read_seqs(self.sync_index.seqs(ids[:MAX_FETCH]))}
+
+    def sync_push(self, body: dict) -> dict:
+        entries = body.get("data") if isinstance(body, dict) else None
+        if not isinstance(entries, list):
+            raise ValueError("`data` must be a list of entries")
+        return {"stored": self.import_entries(entries)}
+
+    def sync_allowed(self, url: str) -> bool:
+        """
+        Whether `url` is one of the configured sync peers.
+        """
+        try:
+            return peer_origin(url) in self.sync_peers
+        except ValueError:
+            return False
+
+    def sync_authorized(self, remote_addr: str, authorization: str = None) -> bool:
+        """
+        Whether a request may push entries into our log: it must carry the
+        sync token if one is set, or else come from a configured peer.
+        """
+        if self.sync_token:
+            return token_matches(self.sync_token, authorization)
+        return bool(remote_addr) and remote_addr in peer_addresses(self.sync_peers.values())
+
+    def sync_with(self, url: str, peer=None) -> dict:
+        """
+        Two-way history sync with the configured peer at `url` (its
+        /api/sync endpoints), or with `peer` (see sync.HttpPeer); returns
+        what moved each way. Raises ValueError for a peer not in sync_peers.
+        """
+        if peer is None and not self.sync_allowed(url):
+            raise ValueError("Peer not allowed")
+        self.sync_index.catch_up(self.message_log)
+        peer = peer or HttpPeer(url, token=self.sync_token)
+        result = exchange(self.sync_index, peer,
+                          read=lambda ids: self.message_log.read_seqs(self.sync_index.seqs(ids)),
+                          store=self.import_entries)
+        result.update(peer.stats)
+        return result
+
+    def import_entries(self, entries: list) -> int:
+        """
+        Stores entries from a peer that we do not have yet, as if they had
+        been received; returns how many were new.
+        """
+        stored = 0
+        with self._sync_lock:
+            for entry in entries:
+                key = message_key(entry)
+                if key is None or self.sync_index.knows(key):
+                    continue
+                entry = {name: value for name, value in entry.items() if name != "seq"}
+                # A radio copy arriving later is not stored again
+                self.stream.completed.seen(key)
+                seq = self.save_message(entry)
+                if seq is not None:
+                    self.stored(seq, entry)
+                    stored += 1
+        return stored
+
+    def resend(self, entry: dict):
+        """
+        Puts a stored message back on air, framed as its sender did, for a
+        peer that lacks it (radio sync). Its sender, batch and timestamp
+        are unchanged, so every node keeps one copy.
+        """
+        sender, batch, timestamp = message_key(entry)
+        if not sender or not timestamp or not 0 < batch <= 0xFFFF:
+            return
+        frames = Parser.prepare_frames({
+            "from": sender,
+            "message": message_text(entry),
+            "checksum": entry.get("checksum") or "0",
+            "chunk_id": 1,
+            "chunk_batch": batch,
+            "timestamp": timestamp
+        }, binary=True, parity=self._parity if self.fec is not None else None, max_size=self.max_frame)
+        self.arq.remember(sender, batch, frames)
+        self._queue_frames(frames, PRIORITY_BROADCAST, durable=False)
+
+    def messages_etag(self, filename: str, since: int = 0, limit: int = None):
+        """
+        Cheap validator for /api/messages/<filename>, covering everything
+        read_messages(filename, since, limit) puts in the body: the page
+        and the engine state. None if there is no such file.
+        """
+        state = self.engine_state()
+        if filename == self.messages_file.name:
+            return f"log-{self.message_log.generation:x}-{since:x}-{page_limit(limit):x}-{state}"
+        path = self.messages_dir / filename
+        if not path.is_file():
+            return None
+        st = path.stat()
+        return f"file-{st.st_size:x}-{st.st_mtime_ns:x}-{state}"
+
+    def read_messages(self, filename: str, since: int = 0, limit: int = None) -> dict:
+        """
+        Response body for /api/messages/<filename>. The message log is read
+        from the cursor on, at most `limit` entries (DEFAULT_PAGE by default,
+        MAX_PAGE at most); `more` tells whether entries remain past `next`.
+        Any other file under messages/ is read whole. Returns None when the
+        name exists but is not a file.
+        """
+        if filename == self.messages_file.name:
+            messages, next_offset = self.message_log.read_cursor(since, page_limit(limit))
+            return {"lora": self.engine_state(), "data": messages, "next": next_offset,
+                    "more": next_offset < len(self.message_log), "generation": self.message_log.generation}
+
+        path = self.messages_dir / filename
+        if not path.exists():
+            return {"data": []}
+        if not path.is_file():
+            return None
+        log.debug("Reading messages from %s", path)
+        with open(path, "r", encoding="utf-8") as f:
+            messages = [json.loads(line) for line in f if line.strip()]
+        log.debug("Messages read: %d entries", len(messages))
+        return {"lora": self.engine_state(), "data": messages}
+
+    def query_messages(self, **filters) -> dict:
+        """
+        Filtered, newest-first page from the message index (see
+        MessageIndex.query). Returns None when the index is disabled.
+        """
+        if self.message_index is None:
+            return None
+        # Picks up entries written around the gateway (e.g. other tools)
+        self.message_index.catch_up(self.message_log)
+        return self.message_index.query(**filters)
+
+    def status(self) -> dict:
+        """
+        Radio summary for the UI status bar; /api/metrics has the details.
+        Until start() has brought everything up only `ready` is reported.
+        """
+        if not self.ready.is_set():
+            return {"state": "starting", "ready": False}
+        if self.radio_error is not None:
+            return {
+                "ready": True,
+                "state": "error",
+                "error": self.radio_error,
+                "tx_queue": self.outbox.depth(),
+                "partial_messages": len(self.stream.reassembler),
+            }
+        return {
+            "ready": True,
+            "state": self.lora_engine.get_state(),
+            "tx_queue_depth": self.lora_engine.tx_queue_depth(),
+            "tx_queue": self.outbox.depth(),
+            "tx_drain_seconds": round(self.lora_engine.drain_time(), 2),
+            "rssi": self.lora_engine.last_rssi,
+            "snr": self.lora_engine.last_snr,
+            "partial_messages": len(self.stream.reassembler),
+            "dedup": {"frames": self.lora_engine.dedup.stats(), "messages": self.stream.completed.stats()},
+            "relay": self.relay.status() if self.relay is not None else None,
+            "adr": self.adr.status() if self.adr is not None else None,
+            "fec": {"loss_estimate": round(self.fec.loss(), 3)} if self.fec is not None else None,
+            "radios": self.lora_engine.radios() if isinstance(self.lora_engine, RadioPool) else None,
+            "sync": self.radio_sync.status() if self.radio_sync is not None else None,
+        }
+
+    def shutdown(self):
+        """
+        Stops whatever has been built; components never used are skipped.
+        """
+        with self._init_lock:
+            built = dict(self.__dict__)
+        # Stopped outside the init lock: the engine thread may be waiting
+        # on it to build a component for the frame it is handling
+        for name in ("radio_sync", "arq", "adr"):
+            if built.get(name) is not None:
+                built[name].stop()
+        if built.get("lora_engine") is not None:
+            built["lora_engine"].shutdown()
+        elif built.get("outbox") is not None:
+            built["outbox"].close()
+        if built.get("stream") is not None:
+            built["stream"].reassembler.stop()
+        for name in ("message_log", "message_index"):
+            if built.get(name) is not None:
+                built[name].close()
@@ -0,0 +1,72 @@
+# id_allocator.py
+
+import json
+import os
+import threading
+from pathlib import Path
+
+from logs import get_logger
+
+log = get_logger("id_allocator")
+
+
+class IdAllocator:
+    def __init__(self, path: Path, block_size: int = 256, seed=None):
+        """
+        Hands out monotonically increasing ids per counter name ("batch",
+        "chunk", ...) from memory under a lock.
+        Persistence is hi/lo style: the file stores a ceiling per counter,
+        raised by block_size whenever allocation reaches it, so disk is
+        touched once per block and a restart resumes above anything that
+        may have been handed out. `seed` (a dict, or a callable returning
+        one) gives the last ids used when the file does not exist yet or
+        cannot be read. Raises ValueError for an unreadable file and no
+        seed, rather than restarting at ids peers have already seen.
+        """
+        self.path = Path(path)
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.next = {}
+        self.ceiling = {}
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.ceiling = {k: int(v) for k, v in json.load(f).items()}
+            self.next = dict(self.ceiling)
+            return
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, ValueError, TypeError, AttributeError) as e:
+            if seed is None:
+                raise ValueError(f"Cannot resume ids from {self.path}: {e}")
+            log.warning("Unreadable %s (%s); resuming ids from the seed", self.path, e)
+        seed = seed() if callable(seed) else seed
+        self.next = {k: int(v) + 1 for k, v in (seed or {}).items()}
+
+    def _checkpoint(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.ceiling, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def reserve(self, name: str, count: int = 1) -> int:
+        """
+        Reserves `count` consecutive ids and returns the first one.
+        """
+        with self.lock:
+            first = self.next.get(name, 1)
+            self.next[name] = first + count
+            if self.next[name] > self.ceiling.get(name, 0):
+                self.ceiling[name] = self.next[name] + self.block_size
+                self._checkpoint()
+            return first
+
+    def peek(self, name: str) -> int:
+        """
+        The id the next reserve() call would return.
+        """
+        with self.lock:
+            return self.next.get(name, 1)
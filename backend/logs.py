@@ -0,0 +1,66 @@
+# logs.py
+
+import logging
+import os
+import sys
+import threading
+import time
+
+LOG_FORMAT = "[%(levelname)s] [%(name)s] %(message)s"
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst: int = 10, interval: float = 10.0):
+        """
+        Lets through at most `burst` records per call site (logger + format
+        string) every `interval` seconds. The first record after a
+        suppressed run says how many were dropped.
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sites = {}  # (name, msg) -> [window start, emitted, suppressed]
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site else 0
+                self.sites[key] = [now, 1, 0]
+                if suppressed:
+                    record.msg = f"{record.msg} ({suppressed} similar suppressed)"
+                return True
+            if site[1] < self.burst:
+                site[1] += 1
+                return True
+            site[2] += 1
+            return False
+
+
+def setup(level: str = None, burst: int = 10, interval: float = 10.0):
+    """
+    Configures the "hde" logger tree once. HDE_LOG_LEVEL picks the level
+    (default INFO); DEBUG brings back per-frame tracing.
+    """
+    root = logging.getLogger("hde")
+    if root.handlers:
+        return root
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(RateLimitFilter(burst, interval))
+    root.addHandler(handler)
+    root.setLevel((level or os.environ.get("HDE_LOG_LEVEL", "INFO")).upper())
+    root.propagate = False
+    return root
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Logger for a backend module. Pass arguments %-style
+    (log.debug("Sent %s", frame)) so disabled levels cost no formatting.
+    """
+    setup()
+    return logging.getLogger(f"hde.{name}")
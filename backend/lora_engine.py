@@ -1,88 +1,478 @@
 import threading
-import queue
 import time
-from pyLoRa.lora_module import LoRa as lora_module
+import weakref
+from collections import deque
+from radio import airtime, open_radio
+from outbox import Outbox, PRIORITY_EMERGENCY, PRIORITY_DIRECT, PRIORITY_BROADCAST
+from dedup import DedupCache
+from frame_codec import AGGREGATE_LENGTH, AGGREGATE_OVERHEAD, MAX_FRAME_SIZE, MESH_FRAME_SIZE, FrameCodec, FrameError
+from frame_ring import FrameRing
+import metrics
+from logs import get_logger
+
+log = get_logger("lora")
+
+STATES = ("idle", "receive", "transmit", "reset")
+
+# configure() key -> radio setter
+SETTERS = {
+    "frequency": "set_frequency",
+    "spreading_factor": "set_spreading_factor",
+    "bandwidth": "set_bandwidth",
+    "tx_power": "set_tx_power",
+}
+DEFAULT_SETTINGS = {"frequency": 433, "spreading_factor": 7, "bandwidth": 125000, "tx_power": 14}
+
+TX_FRAMES = metrics.counter("hde_tx_frames_total", "Frames handed to the radio")
+TX_BYTES = metrics.counter("hde_tx_bytes_total", "Bytes handed to the radio")
+TX_AIRTIME = metrics.histogram("hde_tx_airtime_seconds", "Time on air per transmitted frame")
+RX_FRAMES = metrics.counter("hde_rx_frames_total", "Frames read from the radio")
+RX_BYTES = metrics.counter("hde_rx_bytes_total", "Bytes read from the radio")
+LISTENER_ERRORS = metrics.counter("hde_rx_listener_errors_total", "Exceptions raised by RX listeners")
+TX_AGGREGATED = metrics.counter("hde_tx_aggregated_frames_total", "Frames sent inside an aggregate")
+RX_AGGREGATE_ERRORS = metrics.counter("hde_rx_aggregate_errors_total", "Aggregates that failed to split")
+RX_OVERSIZED = metrics.counter("hde_rx_oversized_frames_total", "Frames longer than a receive buffer")
+ENGINE_ERRORS = metrics.counter("hde_engine_errors_total", "Exceptions raised by radio operations")
+TX_OVERSIZED = metrics.counter("hde_tx_oversized_frames_total", "Frames dropped for exceeding MAX_FRAME_SIZE")
+RX_RSSI = metrics.gauge("hde_rx_rssi_dbm", "RSSI of the last received frame")
+RX_SNR = metrics.gauge("hde_rx_snr_db", "SNR of the last received frame")
+
+# Everything that queues frames for the air: standalone engines, and radio
+# pools in place of their own engines. The TX gauges add them all up.
+TRANSMITTERS = weakref.WeakSet()
+_transmitters_lock = threading.Lock()
+
+
+def register_transmitter(transmitter):
+    with _transmitters_lock:
+        TRANSMITTERS.add(transmitter)
+
+
+def unregister_transmitter(transmitter):
+    with _transmitters_lock:
+        TRANSMITTERS.discard(transmitter)
+
+
+def _transmitters() -> list:
+    with _transmitters_lock:
+        return list(TRANSMITTERS)
+
+
+metrics.gauge("hde_tx_queue_depth", "Frames waiting to be transmitted",
+              fn=lambda: sum(t.tx_queue_depth() for t in _transmitters()))
+metrics.gauge("hde_tx_drain_seconds", "Estimated time to send every queued frame",
+              fn=lambda: max((t.drain_time() for t in _transmitters()), default=0.0))
+
+# Most frames one aggregate carries
+MAX_AGGREGATE = 16
+
 
 class LoRaEngine:
-    def __init__(self):
-        self.lora = lora_module()
+    def __init__(self, radio=None, irq_driven: bool = None, poll_interval: float = 0.01, tx_timeout: float = 5.0,
+                 outbox: Outbox = None, scheduler=None, dedup: DedupCache = None, relay=None,
+                 rx: bool = True, tx: bool = True, linger: float = None):
+        """
+        Event-driven radio scheduler.
+        The worker sleeps on a Condition and wakes as soon as a frame is
+        queued, the state changes or the radio raises its DIO line. Radios
+        with an attach_irq hook are IRQ-driven by default; for others, wire
+        the GPIO edge callback to notify_irq and pass irq_driven=True. Only
+        radios without any IRQ line fall back to polling RX-done every
+        poll_interval seconds.
+        `radio` is any radio.Radio; by default open_radio() picks one.
+        Frames to send wait in `outbox` (memory-only by default); with a
+        outbox.DutyCycleScheduler they are held back until the duty-cycle
+        budget covers their airtime, receiving in the meantime.
+        Repeated frames (same sender, batch, chunk and CRC) are dropped by
+        `dedup` before any listener sees them. With a relay.Relay the engine
+        takes part in the multi-hop flood; without one, mesh envelopes from
+        relaying nodes are simply unwrapped.
+        rx=False or tx=False restricts the radio to one direction, for
+        radio_pool.RadioPool where engines share an outbox and dedup cache.
+        With `linger` (seconds), small queued frames are packed into one
+        aggregate frame of up to max_frame, waiting at most linger for
+        more to arrive (never for emergency frames), so they share one
+        preamble and header. Received aggregates are split before dedup.
+        Radios offering read_into are read into a preallocated FrameRing,
+        so listeners get memoryviews (see add_listener).
+        """
+        self.lora = radio if radio is not None else open_radio()
         self.state = "idle"
         self.lock = threading.Lock()
-        self.message_queue = queue.Queue()
+        self.wakeup = threading.Condition(self.lock)
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.scheduler = scheduler
+        self.dedup = dedup if dedup is not None else DedupCache("frame")
+        self.relay = relay
+        # Relayed frames get a mesh envelope on the way out
+        self.max_frame = MESH_FRAME_SIZE if relay is not None else MAX_FRAME_SIZE
+        self.rx = rx
+        self.tx = tx
+        self.linger = linger
+        self.inbox = deque(maxlen=256)  # received frames when nobody listens
+        self.listeners = []
+        self.ring = FrameRing() if hasattr(self.lora, "read_into") else None
+        if irq_driven is None:
+            irq_driven = hasattr(self.lora, "attach_irq")
+        self.irq_driven = irq_driven
+        self.poll_interval = poll_interval
+        self.tx_timeout = tx_timeout
+        self._irq_pending = False
+        self._rx_armed = False
+        self.last_rssi = None
+        self.last_snr = None
+        # What the radio is set to, for radios that do not expose it
+        self.settings = {key: getattr(self.lora, key, value) for key, value in DEFAULT_SETTINGS.items()}
+        self._pending_config = None
         self.running = True
+        if tx:
+            register_transmitter(self)
+        if irq_driven and hasattr(self.lora, "attach_irq"):
+            self.lora.attach_irq(self.notify_irq)
+
+        if tx:
+            self.outbox.watch(self._wake)
 
         # Start state handler thread
         self.worker = threading.Thread(target=self._loop, daemon=True)
         self.worker.start()
+        if relay is not None and relay.engine is None:
+            relay.attach(self)
+
+    def airtime(self, payload_len: int) -> float:
+        """
+        Time on air of a frame with the radio's current settings.
+        """
+        if hasattr(self.lora, "airtime"):
+            return self.lora.airtime(payload_len)
+        return airtime(payload_len, self.settings["spreading_factor"], self.settings["bandwidth"])
+
+    def _tx_delay(self) -> float:
+        """
+        Seconds until the next queued frame may go out; None if none is queued.
+        """
+        item = self.outbox.peek() if self.tx else None
+        if item is None:
+            return None
+        if self.scheduler is None:
+            return 0.0
+        return self.scheduler.delay(self.airtime(len(item.frame)))
+
+    def _next_action(self, tx_delay):
+        # Called with the lock held
+        if self.state == "reset":
+            return "reset"
+        if tx_delay == 0.0:
+            return "transmit"
+        if self.rx and self.state in ("receive", "transmit"):
+            return "receive"
+        return None
 
     def _loop(self):
         while self.running:
-            with self.lock:
-                state = self.state
-
-            if state == "reset":
-                self._do_reset()
-            elif state == "transmit":
-                self._do_transmit()
-            elif state == "receive":
-                self._do_receive()
-            elif state == "idle":
-                time.sleep(0.1)
-            else:
-                print(f"[LoRaEngine] Unknown state: {state}")
-                self.set_state("idle")
-                time.sleep(0.1)
+            if self._pending_config is not None:
+                with self.wakeup:
+                    config, self._pending_config = self._pending_config, None
+                self._do_configure(config)
+                continue
+            with self.wakeup:
+                tx_delay = self._tx_delay()
+                action = self._next_action(tx_delay)
+                if action is None:
+                    self.wakeup.wait(tx_delay)
+                    continue
+                if action == "receive" and self._rx_armed and not self._irq_pending:
+                    timeout = None if self.irq_driven else self.poll_interval
+                    if tx_delay is not None:
+                        timeout = tx_delay if timeout is None else min(timeout, tx_delay)
+                    self.wakeup.wait(timeout)
+                    tx_delay = self._tx_delay()
+                    action = self._next_action(tx_delay)
+                    if action is None:
+                        continue
+
+                irq = self._irq_pending
+                self._irq_pending = False
+                item = None
+                if action == "transmit":
+                    item = self.outbox.take()
+                    if item is None:
+                        continue  # Another engine sharing the outbox took it
+                    self.state = "transmit"
+
+            try:
+                if action == "reset":
+                    self._do_reset()
+                elif action == "transmit":
+                    self._do_transmit(item)
+                elif action == "receive":
+                    self._do_receive(irq)
+            except Exception as e:
+                # One bad frame or radio hiccup must not stop RX and TX for good
+                ENGINE_ERRORS.inc()
+                log.error("Radio %s failed: %s", action, e)
+                self._rx_armed = False
+                with self.wakeup:
+                    if self.state == "transmit":
+                        self.state = "receive"
+                    self.wakeup.wait(self.poll_interval)
+
+    def _do_configure(self, config: dict):
+        for key, value in config.items():
+            setter = getattr(self.lora, SETTERS[key], None)
+            if setter is None:
+                log.warning("Radio cannot change %s", key)
+                continue
+            setter(value)
+            self.settings[key] = value
+        self._rx_armed = False  # Re-enter RX with the new parameters
+        log.info("Radio settings: %s", self.settings)
 
     def _do_reset(self):
-        print("[LoRaEngine] Resetting...")
+        log.info("Resetting radio")
         self.lora.reset()
+        self._rx_armed = False
         self.set_state("idle")
 
-    def _do_receive(self):
-        self.lora.set_mode_rx()
-        if self.lora.receive():
-            raw = self.lora.read()
-            textformatted = raw.decode('utf-8', errors='ignore')
-            print("[LoRaEngine] Received:", textformatted)
-            print("[LoRaEngine] Received:", raw)
-            self.message_queue.put(raw)
-        time.sleep(0.2)
-
-    def _do_transmit(self):
-        try:
-            message = self.message_queue.get(timeout=1)
-        except queue.Empty:
-            self.set_state("idle")
+    def _do_receive(self, irq: bool):
+        if not self._rx_armed:
+            # Re-arming also drains anything that arrived during TX
+            self.lora.set_mode_rx()
+            self._rx_armed = True
+        elif self.irq_driven and not irq:
+            return
+        while self.lora.receive():
+            raw = self.ring.read(self.lora) if self.ring is not None else self.lora.read()
+            if raw is None:
+                RX_OVERSIZED.inc()
+                log.warning("Dropped frame longer than %d B", self.ring.slot_size)
+                continue
+            RX_FRAMES.inc()
+            RX_BYTES.inc(len(raw))
+            if hasattr(self.lora, "packet_rssi"):
+                self.last_rssi = self.lora.packet_rssi()
+                self.last_snr = self.lora.packet_snr()
+                RX_RSSI.set(self.last_rssi)
+                RX_SNR.set(self.last_snr)
+            if self.relay is not None:
+                raw = self.relay.incoming(raw, self.last_rssi, self.last_snr)
+                if raw is None:
+                    continue
+            elif FrameCodec.is_mesh(raw):
+                raw = FrameCodec.unwrap(raw)
+            try:
+                frames = FrameCodec.split(raw)
+            except FrameError as e:
+                RX_AGGREGATE_ERRORS.inc()
+                log.debug("Dropped aggregate: %s", e)
+                continue
+            for frame in frames:
+                if self.dedup.seen(FrameCodec.frame_key(frame)):
+                    log.debug("Dropped duplicate frame (%d B)", len(frame))
+                    continue
+                log.debug("Received frame (%d B)", len(frame))
+                self._dispatch(frame)
+
+    def _dispatch(self, raw):
+        """
+        Hands a received frame to the registered listeners. Frames are kept
+        (copied) in the inbox only when no listener is registered.
+        """
+        if not self.listeners:
+            self.inbox.append(bytes(raw))
+            return
+        for listener in self.listeners:
+            try:
+                listener(raw)
+            except Exception as e:
+                LISTENER_ERRORS.inc()
+                log.error("Listener failed: %s", e)
+
+    def add_listener(self, callback):
+        """
+        Registers callback(raw), called from the engine thread for every
+        received frame. Callbacks must not block. `raw` may be a memoryview
+        of a receive buffer that is reused later: copy it (bytes(raw)) to
+        keep it beyond the call.
+        """
+        self.listeners.append(callback)
+
+    def _gather(self, item) -> list:
+        """
+        Takes further small frames to send along with `item`, lingering
+        for up to self.linger seconds while there is room.
+        """
+        items = [item]
+        size = AGGREGATE_OVERHEAD + AGGREGATE_LENGTH.size + len(item.frame)
+        if FrameCodec.is_mesh(item.frame) or size > self.max_frame:
+            return items
+        linger = self.linger if item.priority != PRIORITY_EMERGENCY else 0.0
+        deadline = time.monotonic() + linger
+
+        def fits(next_item):
+            # Rebroadcasts keep their own envelope, so they travel alone
+            return (not FrameCodec.is_mesh(next_item.frame)
+                    and size + AGGREGATE_LENGTH.size + len(next_item.frame) <= self.max_frame)
+
+        while len(items) < MAX_AGGREGATE and self.running:
+            next_item = self.outbox.take(fits)
+            if next_item is not None:
+                items.append(next_item)
+                size += AGGREGATE_LENGTH.size + len(next_item.frame)
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or len(self.outbox):
+                break  # Out of time, or the next frame does not fit
+            with self.wakeup:
+                self.wakeup.wait(remaining)
+        return items
+
+    def _do_transmit(self, item):
+        items = self._gather(item) if self.linger is not None else [item]
+        frame = FrameCodec.encode_aggregate([i.frame for i in items]) if len(items) > 1 else item.frame
+        if self.scheduler is not None and len(items) > 1 and self.scheduler.delay(self.airtime(len(frame))) > 0:
+            # The budget covers the first frame but not the whole aggregate
+            for i in items[1:]:
+                self.outbox.release(i.id)
+            items, frame = [item], item.frame
+        if len(items) > 1:
+            TX_AGGREGATED.inc(len(items))
+        if self.relay is not None:
+            frame = self.relay.outgoing(frame)
+        if len(frame) > MAX_FRAME_SIZE:
+            # Senders size frames to max_frame; one that does not fit the
+            # radio would never go out, so drop it instead of retrying it
+            TX_OVERSIZED.inc()
+            log.error("Dropping %d-byte frame, over MAX_FRAME_SIZE", len(frame))
+            for i in items:
+                self.outbox.ack(i.id)
+            with self.wakeup:
+                if self.state == "transmit":
+                    self.state = "receive"
             return
-        self.lora.set_mode_tx()
-        self.lora.send(message)
-        print("[LoRaEngine] Sent:", message)
-        time.sleep(0.5)
-        self.set_state("receive")  # Auto-switch back to RX
+        duration = self.airtime(len(frame))
+        if self.scheduler is not None:
+            if self.scheduler.delay(duration) > 0:
+                # Another engine sharing the outbox took the frame we checked
+                # and this one does not fit our budget yet
+                for i in items:
+                    self.outbox.release(i.id)
+                with self.wakeup:
+                    if self.state == "transmit":
+                        self.state = "receive"
+                return
+            self.scheduler.consume(duration)
+        if not self.rx:
+            # A pool's RX radio on the same channel hears these frames too
+            for i in items:
+                self.dedup.seen(FrameCodec.frame_key(i.frame))
+        self._rx_armed = False
+        started = time.perf_counter()
+        try:
+            self.lora.set_mode_tx()
+            self.lora.send(frame)
+        except Exception:
+            # Back in the queue for the next attempt
+            for i in items:
+                self.outbox.release(i.id)
+            raise
+        if self.irq_driven:
+            # TX-done arrives on the same DIO line
+            with self.wakeup:
+                self.wakeup.wait_for(lambda: self._irq_pending or not self.running, self.tx_timeout)
+                self._irq_pending = False
+        for i in items:
+            self.outbox.ack(i.id)
+        TX_FRAMES.inc()
+        TX_BYTES.inc(len(frame))
+        if hasattr(self.lora, "airtime"):
+            TX_AIRTIME.observe(duration)
+        else:
+            TX_AIRTIME.observe(time.perf_counter() - started)
+        log.debug("Sent %r", frame)
+        with self.wakeup:
+            if self.state == "transmit":
+                self.state = "receive"  # Auto-switch back to RX
+
+    def notify_irq(self, *_):
+        """
+        Radio DIO/IRQ callback (RX-done or TX-done). Safe to call from a
+        GPIO interrupt thread.
+        """
+        with self.wakeup:
+            self._irq_pending = True
+            self.wakeup.notify()
+
+    def _wake(self):
+        with self.wakeup:
+            self.wakeup.notify()
+
+    def configure(self, **settings):
+        """
+        Changes radio parameters (frequency, spreading_factor, bandwidth,
+        tx_power). Applied by the worker between frames, never mid-frame.
+        """
+        for key in settings:
+            if key not in SETTERS:
+                raise ValueError(f"Unknown radio setting: {key}")
+        with self.wakeup:
+            self._pending_config = {**(self._pending_config or {}), **settings}
+            self.wakeup.notify()
 
     def set_state(self, new_state):
-        with self.lock:
+        if new_state not in STATES:
+            log.warning("Unknown state: %s", new_state)
+            return
+        with self.wakeup:
             self.state = new_state
+            if new_state != "receive":
+                self._rx_armed = False
+            self.wakeup.notify()
 
     def get_state(self):
         with self.lock:
             return self.state
 
-    def queue_message(self, msg):
-        self.message_queue.put(msg)
-        self.set_state("transmit")
-        self.get_state()
-        print(f"[LoRaEngine] Queued message: {msg}")
-        if self.get_state() != "receive":
-            self.set_state("receive")  # Ensure we are ready to receive after sending
-        return {"status": "queued", "message": msg}
+    def queue_message(self, msg, priority: int = PRIORITY_DIRECT, durable: bool = True):
+        """
+        Queues one frame. Non-durable frames (NACKs, retransmissions) are
+        not journaled by a persistent outbox.
+        """
+        return self.queue_frames([msg], priority, durable)[0]
+
+    def queue_frames(self, frames: list, priority: int = PRIORITY_DIRECT, durable: bool = True) -> list:
+        """
+        Queues the frames of one message together (one journal fsync).
+        """
+        ids = self.outbox.put_many(frames, priority, durable)
+        log.debug("Queued %d frame(s) at priority %d", len(frames), priority)
+        return [{"status": "queued", "id": i, "message": frame} for i, frame in zip(ids, frames)]
+
+    def tx_queue_depth(self) -> int:
+        return len(self.outbox)
+
+    def drain_time(self) -> float:
+        """
+        Estimated seconds until every queued frame is on air.
+        """
+        total = sum(self.airtime(len(frame)) for frame in self.outbox.frames())
+        if self.scheduler is None:
+            return total
+        return self.scheduler.drain_time(total)
 
     def get_messages(self):
         items = []
-        while not self.message_queue.empty():
-            items.append(self.message_queue.get())
+        while self.inbox:
+            items.append(self.inbox.popleft())
         return items
 
-    def shutdown(self):
-        self.running = False
+    def shutdown(self, close_outbox: bool = True):
+        unregister_transmitter(self)
+        if self.relay is not None and self.relay.engine is self:
+            self.relay.stop()
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify()
         self.worker.join()
+        if close_outbox:
+            self.outbox.close()
@@ -1,118 +1,40 @@
-# main_flask.py
+# main.py
 
-from flask import Flask, jsonify, request, send_from_directory, abort
+from flask import Flask, Response, jsonify, request, abort
 from pathlib import Path
-import json
 import time
 import os
 import atexit
-import aiofiles
-import asyncio
-from lora_engine import LoRaEngine
+import metrics
+from logs import get_logger
 from parser import Parser
-from stream import MessageStream
-from threading import Lock
-# Initialize Flask and LoRa
+from gateway import STATUS_INTERVAL, Gateway, format_event, format_status
+# Importing does no I/O; create_app() sets up the gateway
 app = Flask(__name__)
-file_lock = Lock()
-stream = MessageStream()
-messages_dir = Path("messages")
-messages_file = messages_dir / "messages.json"
-to_send_file = messages_dir / "to_send.json"
-save_dir = Path("messages/saves")
-checksum = Parser.updated_messages_checksum(messages_file)
-from_user = Parser.parse_username(checksum)
-lora_engine = LoRaEngine()
-lora_engine.get_state()
-lora_engine.set_state("idle")
-
-def parse_heard_data(data: str):
-    """
-    Parses the received LoRa data and returns a structured dictionary.
-    """
-    parsed = Parser.parse_message(data)
-    if not parsed["valid"]:
-        return None
-
-    chunk_data = parsed["fields"].get("chunk")
-    if Parser.is_it_in_batches(parsed):
-        Parser.reassemble_chunks(parsed["fields"])
-        chunk_id, chunk_message = extract_chunk_info(chunk_data)
-    else:
-        # fallback to flat message
-        chunk_id, chunk_message = (1, parsed["fields"].get("message", ""))
-
-    return {
-        "sender": parsed["fields"].get("from"),
-        "timestamp": int(parsed["fields"].get("timestamp", time.time())),
-        "chunk_batch": parsed["fields"].get("batch", 0),
-        "chunk_id": chunk_id,
-        "chunk_message": chunk_message
-    }
-
-
-def extract_chunk_info(chunks):
-    if not chunks or len(chunks) == 0:
-        return (0, "")
-    return (chunks[0].get("id", 0), chunks[0].get("message", ""))
-
-
-def parse_send_data(data: dict):
+log = get_logger("main")
+gateway = None
+
+
+def create_app(messages_dir: Path = Path("messages"), **gateway_options) -> Flask:
     """
-    Parses the data to be sent via LoRa and returns a structured dictionary.
+    Application factory, e.g. `gunicorn 'main:create_app()'`.
+    The gateway answers right away; storage and radio come up
+    on a background thread (Gateway.start) and requests needing them wait.
     """
-    print(f"[DEBUG] Parsing send data: {data}")
-    if not isinstance(data, dict):
-        print("[ERROR] Invalid data format, expected a dictionary.")
-        return data
-    parsed = Parser.parse_message(data)
-    if not parsed["valid"]:
-        return None
-
-    chunk_data = parsed["fields"].get("chunk")
-    chunk_id, chunk_message = extract_chunk_info(chunk_data)
-
-    return {
-        "from": parsed["fields"].get("from"),
-        "checksum": parsed["fields"].get("checksum"),
-        "timestamp": int(parsed["fields"].get("timestamp", time.time())),
-        "chunk_batch": parsed["fields"].get("batch", 0),
-        "chunk_id": chunk_id,
-        "chunk_message": chunk_message
-    }
-    
-def save_message_manually(entry):
-    filepath = "messages/messages.json"  # match the reader path
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    try:
-        with open(filepath, "a", encoding="utf-8") as f:
-            f.write(json.dumps(entry) + "\n")
-        print(f"[DEBUG] Appended new message to {filepath}")
-    except Exception as e:
-        print(f"[ERROR] Saving message failed: {e}")
+    global gateway
+    gateway = Gateway(messages_dir, **gateway_options)
+    gateway.start()
+    atexit.register(gateway.shutdown)
+    return app
 
 
+def save_message_manually(entry):
+    return gateway.save_message(entry)
 
 
 def auto_save_message_async(data: dict):
-    messages_dir.mkdir(parents=True, exist_ok=True)
-
-    if not messages_file.exists():
-        messages_file.write_text("[]")  # Optional: make this async too
-
     mdata = Parser.prepare(data)
-
-    with open(messages_file, "r+") as f:
-        content = f.read()
-        try:
-            messages = json.loads(content)
-        except json.JSONDecodeError:
-            messages = []
-        messages.append(mdata)
-
-        f.seek(0)
-        f.write(json.dumps(messages))
-        f.truncate()
+    return gateway.message_log.append(mdata)
 
 @app.route("/api/working_directory")
 def get_working_directory():
@@ -120,73 +42,166 @@ def get_working_directory():
 
 @app.route("/api/send", methods=["POST"])
 def send_message():
-    lora_engine.get_state()
     data = request.get_json()
     from_field = data.get("from")
     message = data.get("message")
     checksum = data.get("checksum")
+    priority = data.get("priority", "broadcast")
 
     if not from_field or not message or not checksum:
         return jsonify({"error": "Missing fields"}), 400
 
-    # Structure the new message
-    new_entry = {
-        "from": from_field,
-        "timestamp": int(time.time()),
-        "chunk_batch": Parser.generate_batch_id(),
-        "chunk": [
-            {
-                "id": Parser.generate_chunk_id(),
-                "message": message
-            }
-        ]
-    }
-    print(f"[DEBUG] New entry to send: {new_entry}")
-    lora_engine.queue_message(new_entry)
-    # Manually save the message to a log (append style)
-    print(f"[DEBUG] Saving message: {new_entry}")
-    save_message_manually(new_entry)
-
-    # Simulate LoRa send (or place real send function here)
-    print(f"[INFO] Sending via LoRa: {message}")
+    try:
+        new_entry = gateway.send(from_field, message, checksum, priority)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    log.info("Sending via LoRa: %s", message)
     return jsonify({"status": "success", "sent": new_entry}), 200
 
 
+@app.route("/api/messages", methods=["GET"])
+def query_messages():
+    """
+    Newest-first page of stored messages from the SQLite index.
+    Filters: `from`, `since`/`until` (unix timestamps), `q` (full-text),
+    `before` (the `next` cursor of the previous page) and `limit`.
+    """
+    try:
+        body = gateway.query_messages(
+            sender=request.args.get("from") or None,
+            since=request.args.get("since", None, type=int),
+            until=request.args.get("until", None, type=int),
+            text=request.args.get("q") or None,
+            before=request.args.get("before") or None,
+            limit=request.args.get("limit", 50, type=int))
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    if body is None:
+        return jsonify({"error": "Message index disabled"}), 404
+    return jsonify(body)
 
 @app.route("/api/messages/<filename>", methods=["GET"])
 def source_messages(filename):
-    path = os.path.join("messages", filename)
-    if not os.path.exists(path):
-        return jsonify({"data": []}), 200
-
-    print(f"[DEBUG] Reading messages from {path}")
-    if not os.path.isfile(path):
+    """
+    Returns stored messages.
+    For the message log, `since=<offset|timestamp>` and `limit=<n>` select
+    only new entries, a page at a time (see Gateway.read_messages), and the
+    response carries a `next` cursor and whether `more` follow. Every
+    response has an ETag; a matching If-None-Match gets a 304 without
+    touching the disk.
+    """
+    since = request.args.get("since", 0, type=int)
+    limit = request.args.get("limit", None, type=int)
+    etag = gateway.messages_etag(filename, since, limit)
+    if etag and request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    body = gateway.read_messages(filename, since, limit)
+    if body is None:
         return jsonify({"error": "File not found"}), 404
-    
-    async def read():
-        async with aiofiles.open(path, mode='r') as f:
-            lines = await f.readlines()
-            return [json.loads(line.strip()) for line in lines if line.strip()]
-
-    lora_state = lora_engine.get_state()
-    print(f"[DEBUG] LoRa state: {lora_state}")
-    messages = asyncio.run(read())
-    print(f"[DEBUG] Messages read: {len(messages)} entries")
-    return jsonify({"lora": lora_state,"data": messages})
+    response = jsonify(body)
+    if etag:
+        response.set_etag(etag)
+    return response
+
+@app.route("/api/events")
+def message_events():
+    """
+    Server-Sent Events stream of new messages. Event ids are message log
+    offsets, so a reconnecting client (Last-Event-ID) or one passing
+    `since=<offset>` first gets whatever it missed from the log. `status`
+    events carry Gateway.status() whenever it changes.
+    """
+    last_id = request.headers.get("Last-Event-ID", type=int)
+    since = last_id + 1 if last_id is not None else request.args.get("since", None, type=int)
+
+    def generate():
+        sub = gateway.message_bus.subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            sent = len(gateway.message_log) - 1
+            if since is not None:
+                backlog = gateway.message_log.read(since)
+                sent = since - 1
+                for seq, entry in enumerate(backlog, start=since):
+                    yield format_event(seq, entry)
+                    sent = seq
+            status, status_due = None, 0.0
+            while not sub.overflowed:
+                if time.monotonic() >= status_due:
+                    status_due = time.monotonic() + STATUS_INTERVAL
+                    previous, status = status, gateway.status()
+                    if status != previous:
+                        yield format_status(status)
+                event = sub.get(timeout=STATUS_INTERVAL)
+                if event is None:
+                    yield ": keepalive\n\n"
+                    continue
+                for seq, entry in gateway.events_after(sent, event):
+                    yield format_event(seq, entry)
+                    sent = seq
+        finally:
+            gateway.message_bus.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/api/state", methods=["GET"])
 def get_state():
-    return jsonify({"state": lora_engine.get_state()})
+    return jsonify({"state": gateway.engine_state()})
 
 @app.route("/api/checksum")
 def get_checksum():
-    return jsonify({"checksum": checksum})
+    return jsonify({"checksum": gateway.checksum})
+
+@app.route("/api/status")
+def get_status():
+    return jsonify(gateway.status())
 
-def cleanup_gpio():
-        lora_engine.shutdown()
+@app.route("/api/sync", methods=["POST"])
+def sync_with_peer():
+    """
+    Two-way history sync with the gateway at {"peer": "http://host:5000"},
+    which must be one of the configured sync peers (HDE_SYNC_PEERS).
+    """
+    peer = (request.get_json(silent=True) or {}).get("peer")
+    if not peer:
+        return jsonify({"error": "Missing peer"}), 400
+    if not gateway.sync_allowed(peer):
+        return jsonify({"error": "Peer not allowed"}), 403
+    try:
+        return jsonify(gateway.sync_with(peer))
+    except (OSError, ValueError) as e:
+        log.warning("Sync with %s failed: %s", peer, e)
+        return jsonify({"error": "Sync failed"}), 502
+
+@app.route("/api/sync/<action>", methods=["POST"])
+def sync_request(action):
+    """
+    History sync requests from a peer (sync.py): `summary` and `ids`
+    compare time-bucket fingerprints, `fetch` and `push` move the entries
+    one side lacks. Only authorized peers may push (Gateway.sync_authorized).
+    """
+    handlers = {"summary": gateway.sync_summary, "ids": gateway.sync_ids,
+                "fetch": gateway.sync_fetch, "push": gateway.sync_push}
+    if action not in handlers:
+        abort(404)
+    if action == "push" and not gateway.sync_authorized(request.remote_addr, request.headers.get("Authorization")):
+        return jsonify({"error": "Not authorized"}), 403
+    try:
+        return jsonify(handlers[action](request.get_json(silent=True)))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/metrics")
+def get_metrics():
+    """
+    Counters and latency histograms in Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True, use_reloader=False)
-    atexit.register(cleanup_gpio)
+    # Threaded dev server; for many concurrent clients run asgi.py instead
+    create_app().run(host="0.0.0.0", port=5000, debug=True, use_reloader=False, threaded=True)
 
@@ -0,0 +1,201 @@
+# message_index.py
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from logs import get_logger
+
+log = get_logger("message_index")
+
+ADD_TIME = metrics.histogram("hde_index_add_seconds", "MessageIndex insert latency")
+QUERY_TIME = metrics.histogram("hde_index_query_seconds", "MessageIndex.query latency")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    seq         INTEGER PRIMARY KEY,
+    sender      TEXT,
+    timestamp   INTEGER NOT NULL,
+    chunk_batch INTEGER,
+    body        TEXT NOT NULL,
+    entry       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, timestamp);
+CREATE INDEX IF NOT EXISTS messages_batch ON messages (chunk_batch);
+"""
+
+# External-content FTS table: the text lives once, in messages.body
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    body, content='messages', content_rowid='seq'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, body) VALUES (new.seq, new.body);
+END;
+"""
+
+DEFAULT_PAGE = 50
+MAX_PAGE = 500
+
+
+def message_text(entry: dict) -> str:
+    """
+    The searchable text of a stored entry: received messages carry
+    `message`, sent ones a `chunk` list.
+    """
+    if entry.get("message") is not None:
+        return str(entry["message"])
+    return "".join(str(c.get("message", "")) for c in entry.get("chunk") or [])
+
+
+def encode_cursor(timestamp: int, seq: int) -> str:
+    return f"{timestamp}-{seq}"
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Raises ValueError for a malformed cursor.
+    """
+    timestamp, seq = cursor.split("-")
+    return int(timestamp), int(seq)
+
+
+class MessageIndex:
+    def __init__(self, path: Path):
+        """
+        Queryable SQLite copy of the message log, keyed by log offset (seq).
+        The log stays the source of truth: the index can be deleted at any
+        time and is rebuilt by catch_up(). WAL mode lets API readers run
+        while the radio thread inserts.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self._local = threading.local()
+
+        self.db = self._connect()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            log.warning("FTS5 unavailable, text search falls back to LIKE")
+            self.fts = False
+        self.db.commit()
+        self.next_seq = self.db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages").fetchone()[0]
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # The index is derived data; losing the last commits on power loss
+        # only means catch_up() re-reads them from the log.
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _reader(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = self._connect()
+        return db
+
+    @staticmethod
+    def _row(seq: int, entry: dict) -> tuple:
+        return (seq, entry.get("from"), int(entry.get("timestamp") or 0),
+                entry.get("chunk_batch"), message_text(entry), json.dumps(entry))
+
+    def add(self, seq: int, entry: dict):
+        self.add_many([(seq, entry)])
+
+    def add_many(self, items):
+        """
+        Indexes (seq, entry) pairs; already indexed offsets are ignored.
+        """
+        rows = [self._row(seq, entry) for seq, entry in items]
+        if not rows:
+            return
+        started = time.perf_counter()
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+            self.next_seq = max(self.next_seq, rows[-1][0] + 1)
+        ADD_TIME.observe(time.perf_counter() - started)
+
+    def catch_up(self, message_log, batch: int = 1000) -> int:
+        """
+        Indexes whatever the log holds beyond the index. Cheap when the two
+        are in sync. Returns the number of entries added.
+        """
+        added = 0
+        while self.next_seq < message_log.generation:
+            start = self.next_seq
+            entries, _ = message_log.read_cursor(start, batch)
+            if not entries:
+                break
+            self.add_many(enumerate(entries, start=start))
+            added += len(entries)
+        if added:
+            log.info("Indexed %d entries from %s", added, message_log.root)
+        return added
+
+    def query(self, sender: str = None, since: int = None, until: int = None,
+              text: str = None, before: str = None, limit: int = DEFAULT_PAGE) -> dict:
+        """
+        Newest-first page of entries matching every given filter. `since`
+        and `until` are inclusive unix timestamps, `text` is a word search
+        and `before` is the `next` cursor of the previous page (keyset
+        pagination, so deep pages cost the same as the first).
+        Raises ValueError for a malformed cursor.
+        """
+        started = time.perf_counter()
+        limit = max(1, min(limit or DEFAULT_PAGE, MAX_PAGE))
+        where, args = [], []
+        source = "messages m"
+        if text:
+            if self.fts:
+                source += " JOIN messages_fts f ON f.rowid = m.seq"
+                where.append("messages_fts MATCH ?")
+                # Quote every word so user input is never parsed as FTS syntax
+                args.append(" ".join('"%s"' % w.replace('"', '""') for w in text.split()))
+            else:
+                where.append("m.body LIKE ?")
+                args.append(f"%{text}%")
+        if sender:
+            where.append("m.sender = ?")
+            args.append(sender)
+        if since is not None:
+            where.append("m.timestamp >= ?")
+            args.append(since)
+        if until is not None:
+            where.append("m.timestamp <= ?")
+            args.append(until)
+        if before:
+            where.append("(m.timestamp, m.seq) < (?, ?)")
+            args.extend(decode_cursor(before))
+
+        sql = f"SELECT m.seq, m.timestamp, m.entry FROM {source}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY m.timestamp DESC, m.seq DESC LIMIT ?"
+        rows = self._reader().execute(sql, args + [limit + 1]).fetchall()
+
+        more = len(rows) > limit
+        rows = rows[:limit]
+        data = []
+        for seq, timestamp, entry in rows:
+            entry = json.loads(entry)
+            entry["seq"] = seq
+            data.append(entry)
+        QUERY_TIME.observe(time.perf_counter() - started)
+        return {
+            "data": data,
+            "next": encode_cursor(rows[-1][1], rows[-1][0]) if more else None,
+            "latest": self.next_seq - 1,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,520 @@
+# message_log.py
+
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, repeat
+from pathlib import Path
+
+import metrics
+from logs import get_logger
+from parser import Parser
+
+log = get_logger("message_log")
+
+APPEND_TIME = metrics.histogram("hde_log_append_seconds", "MessageLog.append latency")
+FSYNC_TIME = metrics.histogram("hde_log_fsync_seconds", "MessageLog.sync latency")
+
+# seq, byte offset, line length, timestamp, chunk_batch, crc32(sender)
+INDEX_RECORD = struct.Struct("<QQIqII")
+
+# In-memory index columns saved in the warm-start snapshot, in file order
+SNAPSHOT_COLUMNS = ("_segments", "_offsets", "_lengths", "_ts_max", "_skeys", "_batches")
+
+# Cursors at or above this value are unix timestamps rather than offsets.
+TIMESTAMP_CURSOR_MIN = 1_000_000_000
+
+
+def sender_key(sender) -> int:
+    """
+    Short hash used by the index to group entries by sender.
+    """
+    if sender is None:
+        return 0
+    return zlib.crc32(str(sender).encode("utf-8"))
+
+
+class MessageLog:
+    def __init__(self, root: Path, segment_max_bytes: int = 1 << 20,
+                 fsync_batch: int = 32, fsync_interval: float = 1.0,
+                 legacy_path: Path = None):
+        """
+        Append-only message log stored as numbered JSONL segments.
+        Every segment has a sidecar .idx file of fixed-size records so an
+        entry can be located by sequence number, timestamp, sender or batch
+        without parsing the rest of the history. The in-memory index of
+        sealed segments is snapshotted at every rotation, so a restart only
+        reads the snapshot and the active segment's .idx. A running CRC32
+        of the data, kept up on every append, is the history checksum.
+        """
+        self.root = Path(root)
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.lock = threading.RLock()
+
+        # Columns indexed by seq; arrays keep the whole history out of the
+        # garbage collector's way and load without per-entry objects
+        self._segments = array("I")
+        self._offsets = array("Q")
+        self._lengths = array("I")
+        self._ts_max = array("q")  # running max of timestamps, for bisect
+        self._skeys = array("I")
+        self._batches = array("I")
+        self._by_sender = None  # sender_key -> [seq], built by the first find()
+        self._by_batch = None   # chunk_batch -> [seq]
+        self._segment = 0
+        self._sealed = []
+        self._size = 0
+        self._data = None
+        self._index = None
+        self._pending = 0
+        self._timer = None
+        self._crc = 0  # Parser.crc32_update of every data byte, segments in order
+        self.generation = 0
+
+        self._open(legacy_path)
+        # Bumped on every append; since the log is append-only this equals
+        # the entry count and survives restarts, which makes it a cheap ETag.
+        self.generation = len(self._offsets)
+
+    # ------------------------------------------------------------------ open
+
+    def _segment_paths(self, number: int) -> tuple:
+        return (self.root / f"{number:06d}.jsonl", self.root / f"{number:06d}.idx")
+
+    def _open(self, legacy_path: Path = None):
+        self.root.mkdir(parents=True, exist_ok=True)
+        numbers = sorted(int(p.stem) for p in self.root.glob("*.jsonl") if p.stem.isdigit())
+
+        self._sealed = numbers[:-1]
+        covered = self._load_snapshot(self._sealed)
+        for number in self._sealed[covered:]:
+            self._load_segment(number)
+        if covered < len(self._sealed):
+            self._save_snapshot()
+        for number in numbers[-1:]:
+            self._load_segment(number, active=True)
+
+        self._segment = numbers[-1] if numbers else 1
+        self._open_active()
+
+        if not numbers and legacy_path is not None:
+            self._import_legacy(Path(legacy_path))
+
+    def _load_segment(self, number: int, active: bool = False):
+        """
+        Loads the index of one segment and repairs it against the data file:
+        index records past the end of the data are dropped and complete
+        lines missing from the index are re-indexed. Lines that do not
+        decode are logged and skipped, never indexed; only the torn last
+        line of the active segment (an interrupted append) is cut off.
+        """
+        data_path, index_path = self._segment_paths(number)
+        size = data_path.stat().st_size
+        end = 0
+
+        raw = index_path.read_bytes() if index_path.exists() else b""
+        usable = len(raw) - len(raw) % INDEX_RECORD.size
+        records = list(INDEX_RECORD.iter_unpack(memoryview(raw)[:usable]))
+        first = len(self._offsets)
+        count = 0
+        for seq, offset, length, *_ in records:
+            # Gaps are lines skipped as undecodable
+            if seq != first + count or offset < end or offset + length > size:
+                break
+            end = offset + length
+            count += 1
+        self._register_many(number, records[:count])
+        kept = count * INDEX_RECORD.size
+
+        missing = []
+        if end < size:
+            with data_path.open("rb") as f:
+                f.seek(end)
+                for line in f:
+                    if active and not line.endswith(b"\n"):
+                        break
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        log.warning("Skipping undecodable line in %s at byte %d", data_path.name, end)
+                        end += len(line)
+                        continue
+                    ts, batch, skey = self._index_fields(entry)
+                    missing.append(INDEX_RECORD.pack(len(self._offsets), end, len(line), ts, batch, skey))
+                    self._register(number, end, len(line), ts, batch, skey)
+                    end += len(line)
+
+        if active and end < size:
+            log.warning("Truncating torn tail of %s at %d", data_path.name, end)
+            with data_path.open("r+b") as f:
+                f.truncate(end)
+        with data_path.open("rb") as f:
+            while chunk := f.read(1 << 16):
+                self._crc = Parser.crc32_update(self._crc, chunk)
+
+        if kept != len(raw) or missing:
+            with index_path.open("r+b" if index_path.exists() else "wb") as f:
+                f.truncate(kept)
+                f.seek(kept)
+                f.write(b"".join(missing))
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _load_snapshot(self, sealed: list) -> int:
+        """
+        Restores the index columns of the leading sealed segments from the
+        snapshot written by _save_snapshot. Returns how many segments it
+        covered; 0 when it is missing, stale or damaged.
+        """
+        path = self.root / "snapshot.bin"
+        try:
+            with path.open("rb") as f:
+                header = json.loads(f.readline())
+                body = f.read()
+            covered = header["segments"]  # [[number, data size], ...]
+            if [number for number, _ in covered] != sealed[:len(covered)]:
+                return 0
+            for number, size in covered:
+                if self._segment_paths(number)[0].stat().st_size != size:
+                    return 0
+            count = header["count"]
+            data_crc = int(header["data_crc"])
+            if zlib.crc32(body) != header["crc"] or len(body) != count * sum(
+                    getattr(self, name).itemsize for name in SNAPSHOT_COLUMNS):
+                return 0
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+        view = memoryview(body)
+        for name in SNAPSHOT_COLUMNS:
+            column = getattr(self, name)
+            column.frombytes(view[:count * column.itemsize])
+            view = view[count * column.itemsize:]
+        self._crc = data_crc
+        return len(covered)
+
+    def _save_snapshot(self):
+        """
+        Writes the index columns of every sealed segment (called when no
+        entry of the active segment is registered yet). The snapshot is
+        derived data: a torn or stale one is detected and ignored on open.
+        """
+        if not self._sealed:
+            return
+        try:
+            body = b"".join(getattr(self, name).tobytes() for name in SNAPSHOT_COLUMNS)
+            header = {"count": len(self._offsets), "crc": zlib.crc32(body), "data_crc": self._crc,
+                      "segments": [[number, self._segment_paths(number)[0].stat().st_size]
+                                   for number in self._sealed]}
+            tmp = self.root / "snapshot.tmp"
+            with tmp.open("wb") as f:
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                f.write(body)
+            os.replace(tmp, self.root / "snapshot.bin")
+        except OSError as e:
+            log.warning("Writing index snapshot failed: %s", e)
+
+    def _open_active(self):
+        data_path, index_path = self._segment_paths(self._segment)
+        self._data = data_path.open("ab")
+        self._index = index_path.open("ab")
+        self._size = self._data.tell()
+
+    def _import_legacy(self, path: Path):
+        """
+        Seeds an empty log from the old messages.json, which may hold either
+        a JSON array or one JSON object per line.
+        """
+        if not path.is_file():
+            return
+        content = path.read_text(encoding="utf-8").strip()
+        if not content:
+            return
+        if content.startswith("["):
+            try:
+                entries = json.loads(content)
+            except json.JSONDecodeError:
+                entries = []
+        else:
+            entries = []
+            for line in content.splitlines():
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        for entry in entries:
+            self.append(entry, sync=False)
+        self.sync()
+
+    # --------------------------------------------------------------- writing
+
+    @staticmethod
+    def _index_fields(entry) -> tuple:
+        if not isinstance(entry, dict):
+            return 0, 0, 0
+        try:
+            ts = int(entry.get("timestamp") or 0)
+        except (TypeError, ValueError):
+            ts = 0
+        try:
+            batch = int(entry.get("chunk_batch") or entry.get("batch") or 0)
+        except (TypeError, ValueError):
+            batch = 0
+        return ts, batch & 0xFFFFFFFF, sender_key(entry.get("from"))
+
+    def _register(self, segment: int, offset: int, length: int, ts: int, batch: int, skey: int):
+        seq = len(self._offsets)
+        self._segments.append(segment)
+        self._offsets.append(offset)
+        self._lengths.append(length)
+        self._ts_max.append(max(ts, self._ts_max[-1]) if self._ts_max else ts)
+        self._skeys.append(skey)
+        self._batches.append(batch)
+        if self._by_sender is not None:
+            self._by_sender.setdefault(skey, []).append(seq)
+            self._by_batch.setdefault(batch, []).append(seq)
+
+    def _register_many(self, segment: int, records: list):
+        """
+        Bulk _register for validated index records: column-wise array
+        extends instead of per-entry work, since this runs for the whole
+        history on every start.
+        """
+        if not records:
+            return
+        _, offsets, lengths, stamps, batches, skeys = zip(*records)
+        self._segments.extend(repeat(segment, len(offsets)))
+        self._offsets.extend(offsets)
+        self._lengths.extend(lengths)
+        initial = self._ts_max[-1] if self._ts_max else stamps[0]
+        running = accumulate(stamps, max, initial=initial)
+        next(running)
+        self._ts_max.extend(running)
+        self._skeys.extend(skeys)
+        self._batches.extend(batches)
+        self._by_sender = self._by_batch = None
+
+    def _build_lookups(self):
+        self._by_sender, self._by_batch = {}, {}
+        for seq, (skey, batch) in enumerate(zip(self._skeys, self._batches)):
+            self._by_sender.setdefault(skey, []).append(seq)
+            self._by_batch.setdefault(batch, []).append(seq)
+
+    def _rotate(self):
+        self.sync()
+        self._data.close()
+        self._index.close()
+        self._sealed.append(self._segment)
+        self._save_snapshot()
+        self._segment += 1
+        self._open_active()
+
+    def append(self, entry, sync: bool = True) -> int:
+        """
+        Appends one entry and returns its sequence number.
+        The write is flushed to the OS immediately; fsync is batched.
+        """
+        started = time.perf_counter()
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        ts, batch, skey = self._index_fields(entry)
+
+        with self.lock:
+            if self._size and self._size + len(line) > self.segment_max_bytes:
+                self._rotate()
+
+            seq = len(self._offsets)
+            offset = self._size
+            self._data.write(line)
+            self._data.flush()
+            self._index.write(INDEX_RECORD.pack(seq, offset, len(line), ts, batch, skey))
+            self._index.flush()
+
+            self._size += len(line)
+            self._crc = Parser.crc32_update(self._crc, line)
+            self._register(self._segment, offset, len(line), ts, batch, skey)
+            self.generation += 1
+            self._pending += 1
+            if sync:
+                self._schedule_sync()
+            APPEND_TIME.observe(time.perf_counter() - started)
+            return seq
+
+    async def append_async(self, entry) -> int:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.append, entry)
+
+    def _schedule_sync(self):
+        if self._pending >= self.fsync_batch:
+            self.sync()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.fsync_interval, self.sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def sync(self):
+        """
+        Forces pending appends to disk. Data is synced before the index so
+        a crash can never leave index records pointing at missing bytes.
+        """
+        with self.lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending or self._data is None:
+                return
+            started = time.perf_counter()
+            os.fsync(self._data.fileno())
+            os.fsync(self._index.fileno())
+            FSYNC_TIME.observe(time.perf_counter() - started)
+            self._pending = 0
+
+    def close(self):
+        with self.lock:
+            if self._data is None:
+                return
+            self.sync()
+            self._data.close()
+            self._index.close()
+            self._data = None
+            self._index = None
+
+    # --------------------------------------------------------------- reading
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def max_batch(self) -> int:
+        """
+        Highest chunk_batch in the log (0 when empty).
+        """
+        with self.lock:
+            return max(self._batches, default=0)
+
+    def checksum(self) -> str:
+        """
+        CRC32 of the whole history as hex (e.g. 'A1B2C3D4'), in the same
+        variant as Parser.file_crc32; it changes with every append.
+        """
+        return format(self._crc, "08X")
+
+    def _locate(self, seqs) -> tuple:
+        """
+        Segment, offset and length columns for the given sequence numbers;
+        called with the lock held. Appends never move bytes already
+        written, so _read_located can then run without it.
+        """
+        if isinstance(seqs, range) and seqs.step == 1:
+            return (self._segments[seqs.start:seqs.stop], self._offsets[seqs.start:seqs.stop],
+                    self._lengths[seqs.start:seqs.stop])
+        return ([self._segments[seq] for seq in seqs], [self._offsets[seq] for seq in seqs],
+                [self._lengths[seq] for seq in seqs])
+
+    def _read_located(self, located: tuple) -> list:
+        """
+        Reads the entries _locate found, coalescing runs that sit next to
+        each other in the same segment into a single read.
+        """
+        result = []
+        handles = {}
+        try:
+            run = []
+            for segment, offset, length in zip(*located):
+                if run and (run[0][0] != segment or run[-1][1] + run[-1][2] != offset):
+                    result.extend(self._read_run(run, handles))
+                    run = []
+                run.append((segment, offset, length))
+            if run:
+                result.extend(self._read_run(run, handles))
+        finally:
+            for f in handles.values():
+                f.close()
+        return result
+
+    def _read_run(self, run: list, handles: dict) -> list:
+        segment, start, _ = run[0]
+        f = handles.get(segment)
+        if f is None:
+            f = handles[segment] = self._segment_paths(segment)[0].open("rb")
+        end = run[-1][1] + run[-1][2]
+        f.seek(start)
+        buf = f.read(end - start)
+        return [json.loads(buf[offset - start:offset - start + length]) for _, offset, length in run]
+
+    def read(self, since: int = 0, limit: int = None) -> list:
+        """
+        Returns entries with sequence number >= since, oldest first.
+        """
+        with self.lock:
+            stop = len(self._offsets)
+            if limit is not None:
+                stop = min(stop, since + limit)
+            located = self._locate(range(max(since, 0), stop))
+        return self._read_located(located)
+
+    def read_cursor(self, since: int = 0, limit: int = None) -> tuple:
+        """
+        Reads entries after a client cursor.
+        `since` is a sequence offset, or a unix timestamp when it is at
+        least TIMESTAMP_CURSOR_MIN. Returns (entries, next_offset).
+        """
+        with self.lock:
+            if since >= TIMESTAMP_CURSOR_MIN:
+                start = bisect_left(self._ts_max, since)
+            else:
+                start = min(max(since, 0), len(self._offsets))
+            stop = len(self._offsets) if limit is None else min(len(self._offsets), start + limit)
+            located = self._locate(range(start, stop))
+        entries = self._read_located(located)
+        next_offset = start + len(entries)
+        if since >= TIMESTAMP_CURSOR_MIN:
+            entries = [e for e in entries if isinstance(e, dict) and self._index_fields(e)[0] >= since]
+        return entries, next_offset
+
+    def read_seqs(self, seqs) -> list:
+        """
+        Returns the entries at the given sequence numbers, oldest first.
+        """
+        with self.lock:
+            located = self._locate(sorted(seq for seq in set(seqs) if 0 <= seq < len(self._offsets)))
+        return self._read_located(located)
+
+    async def read_async(self, since: int = 0, limit: int = None) -> list:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.read, since, limit)
+
+    def seq_for_timestamp(self, timestamp: int) -> int:
+        """
+        Returns the first sequence number whose entry may have a timestamp
+        >= the given one.
+        """
+        with self.lock:
+            return bisect_left(self._ts_max, timestamp)
+
+    def find(self, sender: str = None, batch: int = None) -> list:
+        """
+        Returns entries matching a sender and/or chunk batch using the index.
+        """
+        with self.lock:
+            if self._by_sender is None:
+                self._build_lookups()
+            candidates = None
+            if sender is not None:
+                candidates = set(self._by_sender.get(sender_key(sender), ()))
+            if batch is not None:
+                by_batch = set(self._by_batch.get(int(batch) & 0xFFFFFFFF, ()))
+                candidates = by_batch if candidates is None else candidates & by_batch
+            if candidates is None:
+                candidates = range(len(self._offsets))
+            located = self._locate(sorted(candidates))
+        entries = self._read_located(located)
+
+        if sender is not None:
+            entries = [e for e in entries if isinstance(e, dict) and e.get("from") == sender]
+        return entries
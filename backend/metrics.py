@@ -0,0 +1,200 @@
+# metrics.py
+
+import threading
+
+# Histogram resolution: every power-of-two range is split into
+# 2 ** SUB_BUCKET_BITS linear buckets, so a recorded value is off by at most
+# 1 / 2 ** SUB_BUCKET_BITS (12.5%) whatever its magnitude, HDR style.
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value in (float("inf"), float("-inf")):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+class Counter:
+    __slots__ = ("name", "help", "labels", "value")
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: dict = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        yield self.name, self.labels, self.value
+
+
+class Gauge:
+    __slots__ = ("name", "help", "labels", "value", "fn")
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: dict = None, fn=None):
+        """
+        Either set() from the code that owns the value, or pass `fn` to
+        read it only when scraped, which costs the hot path nothing.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception:
+                value = None
+        return float("nan") if value is None else value
+
+    def samples(self):
+        yield self.name, self.labels, self.get()
+
+
+class Histogram:
+    __slots__ = ("name", "help", "labels", "unit", "counts", "count", "sum", "max")
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: dict = None, unit: float = 1e-6):
+        """
+        Log-linear histogram of non-negative values in multiples of `unit`
+        (1 µs by default for latencies in seconds). observe() is a few
+        integer operations and a dict update; updates from several threads
+        are not locked, so a rare concurrent sample may be lost.
+        """
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.unit = unit
+        self.counts = {}
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket(units: int) -> int:
+        if units < 2 * SUB_BUCKETS:
+            return units
+        shift = units.bit_length() - SUB_BUCKET_BITS - 1
+        return (shift + 1) * SUB_BUCKETS + (units >> shift) - SUB_BUCKETS
+
+    @staticmethod
+    def bucket_upper(index: int) -> int:
+        """
+        Exclusive upper bound, in units, of bucket `index`.
+        """
+        if index < 2 * SUB_BUCKETS:
+            return index + 1
+        shift = index // SUB_BUCKETS - 1
+        return (index - shift * SUB_BUCKETS + 1) << shift
+
+    def observe(self, value: float):
+        index = self.bucket(int(value / self.unit)) if value > 0 else 0
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-quantile (0 <= q <= 1).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_upper(index) * self.unit, self.max)
+        return self.max
+
+    def samples(self):
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            le = self.bucket_upper(index) * self.unit
+            yield self.name + "_bucket", dict(self.labels, le=f"{le:.6g}"), seen
+        yield self.name + "_bucket", dict(self.labels, le="+Inf"), self.count
+        yield self.name + "_sum", self.labels, self.sum
+        yield self.name + "_count", self.labels, self.count
+
+
+class Registry:
+    def __init__(self):
+        """
+        Named metrics of this process. Getting a metric that already exists
+        returns it, so modules can declare theirs at import time and
+        instances (engines, streams) can re-bind callback gauges.
+        """
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, labels: dict = None, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: dict = None) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: dict = None, fn=None) -> Gauge:
+        gauge = self._get(Gauge, name, help, labels)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, labels: dict = None, unit: float = 1e-6) -> Histogram:
+        return self._get(Histogram, name, help, labels, unit=unit)
+
+    def render(self) -> str:
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        last = None
+        for (name, _), metric in metrics:
+            if name != last:
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.kind}")
+                last = name
+            for sample, labels, value in metric.samples():
+                lines.append(f"{sample}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+render = REGISTRY.render
@@ -0,0 +1,281 @@
+# outbox.py
+
+import heapq
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from logs import get_logger
+
+log = get_logger("outbox")
+
+# Priority classes, lowest value is sent first
+PRIORITY_EMERGENCY = 0
+PRIORITY_DIRECT = 1
+PRIORITY_BROADCAST = 2
+PRIORITY_NAMES = {PRIORITY_EMERGENCY: "emergency", PRIORITY_DIRECT: "direct", PRIORITY_BROADCAST: "broadcast"}
+
+# Journal record: kind, frame id, priority, payload length; then the payload
+# and a CRC32 of header + payload so a torn tail is detected on replay.
+JOURNAL_RECORD = struct.Struct("<BQBI")
+JOURNAL_CRC = struct.Struct("<I")
+RECORD_ENQUEUE = 1
+RECORD_ACK = 2
+
+
+class OutboxItem:
+    __slots__ = ("id", "priority", "frame", "durable")
+
+    def __init__(self, id: int, priority: int, frame: bytes, durable: bool = True):
+        self.id = id
+        self.priority = priority
+        self.frame = frame
+        self.durable = durable
+
+
+class Outbox:
+    def __init__(self, path: Path = None, compact_bytes: int = 256 * 1024):
+        """
+        Frames waiting for the radio, highest priority class first and FIFO
+        within a class.
+        With a path, durable frames are journaled (fsynced) on put() and an
+        ack record is appended once they are on air, so a restart resends
+        exactly the frames that never went out (at-least-once). The journal
+        is compacted to the pending frames when it outgrows compact_bytes.
+        Without a path the outbox is memory-only.
+        Several LoRaEngines may share one outbox: each registers with
+        watch() and takes the next frame whenever its radio is free.
+        """
+        self.path = Path(path) if path else None
+        self.compact_bytes = compact_bytes
+        self._compact_at = compact_bytes
+        self.lock = threading.Lock()
+        self.heap = []  # (priority, id, item)
+        self.inflight = {}  # id -> item taken but not acked yet
+        self.next_id = 1
+        self.watchers = []  # called after frames become available
+        self._journal = None
+        if self.path:
+            self._replay()
+            self._journal = self.path.open("ab")
+
+    # ---------------------------------------------------------------- journal
+
+    @staticmethod
+    def _record(kind: int, item_id: int, priority: int = 0, payload: bytes = b"") -> bytes:
+        head = JOURNAL_RECORD.pack(kind, item_id, priority, len(payload))
+        return head + payload + JOURNAL_CRC.pack(zlib.crc32(head + payload))
+
+    def _replay(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            raw = self.path.read_bytes()
+        except FileNotFoundError:
+            return
+        pending = {}
+        pos = 0
+        while pos + JOURNAL_RECORD.size <= len(raw):
+            kind, item_id, priority, length = JOURNAL_RECORD.unpack_from(raw, pos)
+            end = pos + JOURNAL_RECORD.size + length
+            if end + JOURNAL_CRC.size > len(raw):
+                break
+            (crc,) = JOURNAL_CRC.unpack_from(raw, end)
+            if crc != zlib.crc32(raw[pos:end]):
+                break
+            if kind == RECORD_ENQUEUE:
+                pending[item_id] = OutboxItem(item_id, priority, raw[pos + JOURNAL_RECORD.size:end])
+            elif kind == RECORD_ACK:
+                pending.pop(item_id, None)
+            self.next_id = max(self.next_id, item_id + 1)
+            pos = end + JOURNAL_CRC.size
+
+        if pos < len(raw):
+            log.warning("Truncating torn tail of %s at %d", self.path.name, pos)
+            with self.path.open("r+b") as f:
+                f.truncate(pos)
+        for item in pending.values():
+            heapq.heappush(self.heap, (item.priority, item.id, item))
+        if pending:
+            log.info("Recovered %d unsent frames from %s", len(pending), self.path.name)
+
+    def _append(self, data: bytes, fsync: bool):
+        self._journal.write(data)
+        self._journal.flush()
+        if fsync:
+            os.fsync(self._journal.fileno())
+
+    def _compact(self):
+        # Called with the lock held
+        items = list(self.inflight.values()) + [item for _, _, item in self.heap]
+        data = b"".join(self._record(RECORD_ENQUEUE, item.id, item.priority, item.frame)
+                        for item in sorted(items, key=lambda item: item.id) if item.durable)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal.close()
+        os.replace(tmp, self.path)
+        self._journal = self.path.open("ab")
+        # A large backlog must not make every ack rewrite the journal
+        self._compact_at = max(self.compact_bytes, 2 * len(data))
+
+    # ------------------------------------------------------------------ queue
+
+    def put(self, frame: bytes, priority: int = PRIORITY_DIRECT, durable: bool = True) -> int:
+        return self.put_many([frame], priority, durable)[0]
+
+    def put_many(self, frames: list, priority: int = PRIORITY_DIRECT, durable: bool = True) -> list:
+        """
+        Queues frames (one message's chunks) with a single fsync. Returns
+        their ids. Non-durable frames (NACKs, retransmissions) are never
+        journaled.
+        """
+        with self.lock:
+            items = []
+            for frame in frames:
+                frame = frame.encode("utf-8") if isinstance(frame, str) else bytes(frame)
+                items.append(OutboxItem(self.next_id, priority, frame, durable))
+                self.next_id += 1
+            if self._journal and durable:
+                self._append(b"".join(self._record(RECORD_ENQUEUE, item.id, priority, item.frame)
+                                      for item in items), fsync=True)
+            for item in items:
+                heapq.heappush(self.heap, (priority, item.id, item))
+        self._notify()
+        return [item.id for item in items]
+
+    def watch(self, callback):
+        """
+        Registers callback(), called (without the lock held) whenever
+        frames are queued or released.
+        """
+        self.watchers.append(callback)
+
+    def _notify(self):
+        for callback in self.watchers:
+            callback()
+
+    def peek(self) -> OutboxItem:
+        with self.lock:
+            return self.heap[0][2] if self.heap else None
+
+    def take(self, accept=None) -> OutboxItem:
+        """
+        Removes the next frame; it stays in flight until ack() or release().
+        With `accept`, only if accept(item) is true for the next frame.
+        """
+        with self.lock:
+            if not self.heap or (accept is not None and not accept(self.heap[0][2])):
+                return None
+            _, _, item = heapq.heappop(self.heap)
+            self.inflight[item.id] = item
+            return item
+
+    def ack(self, item_id: int):
+        """
+        Marks a frame as transmitted. Not fsynced: losing an ack on power
+        loss only means the frame is sent once more.
+        """
+        with self.lock:
+            item = self.inflight.pop(item_id, None)
+            if item is None or not (self._journal and item.durable):
+                return
+            self._append(self._record(RECORD_ACK, item_id), fsync=False)
+            if self._journal.tell() > self._compact_at:
+                self._compact()
+
+    def release(self, item_id: int):
+        """
+        Puts an in-flight frame back at the head of its class.
+        """
+        with self.lock:
+            item = self.inflight.pop(item_id, None)
+            if item is None:
+                return
+            heapq.heappush(self.heap, (item.priority, item.id, item))
+        self._notify()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.heap)
+
+    def __contains__(self, item_id: int) -> bool:
+        """
+        True while the frame is queued or in flight.
+        """
+        with self.lock:
+            return item_id in self.inflight or any(i == item_id for _, i, _ in self.heap)
+
+    def depth(self) -> dict:
+        """
+        Pending frames per priority class name.
+        """
+        counts = dict.fromkeys(PRIORITY_NAMES.values(), 0)
+        with self.lock:
+            for priority, _, _ in self.heap:
+                counts[PRIORITY_NAMES.get(priority, "broadcast")] += 1
+        return counts
+
+    def frames(self) -> list:
+        """
+        Pending frames in transmission order.
+        """
+        with self.lock:
+            return [item.frame for _, _, item in sorted(self.heap)]
+
+    def close(self):
+        with self.lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+
+
+class DutyCycleScheduler:
+    def __init__(self, duty_cycle: float = 0.01, window: float = 3600.0, clock=time.monotonic):
+        """
+        Token bucket of airtime seconds: refills at duty_cycle seconds per
+        second and holds at most duty_cycle * window, so frames go out
+        back-to-back while budget remains and the long-run airtime never
+        exceeds the regional duty cycle (1% in EU868 / AS923 sub-bands).
+        """
+        self.duty_cycle = duty_cycle
+        self.capacity = duty_cycle * window
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.duty_cycle)
+        self.updated = now
+
+    def available(self) -> float:
+        with self.lock:
+            self._refill(self.clock())
+            return self.tokens
+
+    def delay(self, airtime: float) -> float:
+        """
+        Seconds until a frame of this airtime may be sent (0 = now).
+        """
+        with self.lock:
+            self._refill(self.clock())
+            missing = min(airtime, self.capacity) - self.tokens
+            return max(0.0, missing / self.duty_cycle)
+
+    def consume(self, airtime: float):
+        with self.lock:
+            self._refill(self.clock())
+            self.tokens -= airtime
+
+    def drain_time(self, airtime: float) -> float:
+        """
+        Estimated seconds to put `airtime` seconds of frames on air.
+        """
+        with self.lock:
+            self._refill(self.clock())
+            return airtime + max(0.0, airtime - self.tokens) / self.duty_cycle
@@ -1,131 +1,247 @@
 # parser.py
 
-import hashlib, json, re, os
+import hashlib, json, os, zlib
 from pathlib import Path
 from datetime import datetime, time
+from threading import Lock
+from id_allocator import IdAllocator
+from frame_codec import (Frame, FrameCodec, FrameError, ChecksumError, MAX_FRAME_SIZE, MAX_CHUNKS, FLAG_COMPRESSED,
+                         FLAG_FEC)
+import compression
+import fec
+import metrics
 
 DATA_DIR = Path("messages")
 SAVE_DIR = os.path.join("messages", "saves")
-os.makedirs(SAVE_DIR, exist_ok=True)
 TO_SEND_PATH = DATA_DIR / "to_send.json"
 CHUNK_DATA_PATH = DATA_DIR / "chunk_data.json"
+IDS_PATH = DATA_DIR / "ids.json"
+MAX_BATCH_ID = 0xFFFF  # batch ids travel as 16 bits in binary frames
+
+_id_allocator = None
+_id_allocator_lock = Lock()
+
+# file_crc32 cache: path -> (size, mtime_ns, inode, crc, tail bytes)
+_CRC_CACHE = {}
+_CRC_TAIL = 64
+
+# Parser.parse_message outcomes
+_PARSED_FRAMES = metrics.counter("hde_parsed_frames_total", "Frames that passed Parser.parse_message")
+_PARSE_CRC_ERRORS = metrics.counter("hde_parse_errors_total", "Frames rejected by Parser.parse_message",
+                                    {"reason": "crc"})
+_PARSE_MALFORMED = metrics.counter("hde_parse_errors_total", "Frames rejected by Parser.parse_message",
+                                   {"reason": "malformed"})
+_PARSE_DECOMPRESS_ERRORS = metrics.counter("hde_parse_errors_total", "Frames rejected by Parser.parse_message",
+                                           {"reason": "decompress"})
+_PARSE_MISSING_FIELDS = metrics.counter("hde_parse_errors_total", "Frames rejected by Parser.parse_message",
+                                        {"reason": "fields"})
+
+
+class ParsedFrame:
+    __slots__ = ("valid", "error", "sender", "timestamp", "batch", "chunk_id", "chunk_count",
+                 "payload", "compressed", "fec", "parity")
+
+    def __init__(self, error: str = None):
+        """
+        One frame as Parser.parse_message read it. `payload` may be a
+        memoryview of the radio's receive buffer: it is only valid while
+        the frame is being handled, so copy it (bytes()) to keep it, and
+        it is only decoded when `text` is read. Slices of a compressed or
+        FEC batch stay opaque bytes until the batch is reassembled;
+        `parity` is (parity count, message length) on FEC parity chunks.
+        """
+        self.valid = False
+        self.error = error
+        self.sender = None
+        self.timestamp = None
+        self.batch = None
+        self.chunk_id = 1
+        self.chunk_count = 1
+        self.payload = b""
+        self.compressed = False
+        self.fec = False
+        self.parity = None
+
+    @property
+    def text(self) -> str:
+        return str(self.payload, "utf-8", "replace")
+
+    def __repr__(self):
+        if not self.valid:
+            return f"ParsedFrame(error={self.error!r})"
+        return (f"ParsedFrame(sender={self.sender!r}, batch={self.batch}, chunk={self.chunk_id}/"
+                f"{self.chunk_count}, payload={len(self.payload)}B)")
+
 
 class Parser:
     def __init__(self):
-        self.max_chunk_size = 240  # Maximum chunk size in bytes
+        self.max_chunk_size = MAX_FRAME_SIZE  # Maximum chunk size in bytes
 
     @staticmethod
     def calculate_crc(payload: str) -> str:
         """Simple XOR-based checksum"""
-        crc = 0
-        for char in payload:
-            crc ^= ord(char)
-        return format(crc, "02X")
-    
+        return FrameCodec.xor_crc(payload)
+
+    @staticmethod
+    def to_frame(data: dict) -> Frame:
+        """
+        Builds a Frame from a send dict (from, message, chunk_id, ...).
+        """
+        return Frame(
+            sender=data['from'],
+            batch=int(data['chunk_batch']),
+            chunk_id=int(data['chunk_id']),
+            chunk_count=int(data.get('chunk_count', 1)),
+            timestamp=int(data['timestamp']),
+            payload=data['message'].encode("utf-8"),
+            checksum=data.get('checksum')
+        )
+
     @staticmethod
-    def prepare(data: dict) -> str:
+    def prepare(data: dict, binary: bool = False):
         """
         Prepares a structured LoRa message with CRC.
         Example: "from:node1|message:Hello|chunk_id:1|chunk_batch:3|timestamp:1722250340*AB"
+        With binary=True returns a compact struct-packed frame (bytes) instead.
         """
-        fields = [
-            f"from:{data['from']}",
-            f"message:{data['message']}",
-            f"checksum:{data['checksum']}",
-            f"chunk_id:{data['chunk_id']}",
-            f"chunk_batch:{data['chunk_batch']}",
-            f"timestamp:{data['timestamp']}"
-        ]
-        payload = "|".join(fields)
-        crc = Parser.calculate_crc(payload)
-        return f"{payload}*{crc}"
+        frame = Parser.to_frame(data)
+        if binary:
+            return FrameCodec.encode_binary(frame)
+        return FrameCodec.encode_text(frame).decode("utf-8")
+
+    @staticmethod
+    def prepare_frames(data: dict, binary: bool = False, compress: bool = True, parity=None,
+                       max_size: int = MAX_FRAME_SIZE) -> list:
+        """
+        Like prepare, but splits a long message over as many frames as
+        needed, each within max_size (MESH_FRAME_SIZE for relaying nodes,
+        whose frames get a mesh envelope). Always returns a list of bytes.
+        Binary frames are deflated with the shared preset dictionary first
+        when that makes the message smaller.
+        parity(chunk count) -> K adds K Reed-Solomon parity frames to a
+        binary multi-frame batch (fec.py); any chunk_count of the frames
+        then rebuild the message.
+        """
+        frame = Parser.to_frame(data)
+        payload = frame.payload
+        if binary and compress:
+            packed = compression.compress(payload)
+            if packed is not None:
+                payload = packed
+                frame.flags |= FLAG_COMPRESSED
+        chunks = Parser.frame_chunks(payload, frame.sender, binary, frame.checksum or "",
+                                     utf8=not frame.flags & FLAG_COMPRESSED, max_size=max_size)
+        if binary and parity is not None and len(chunks) > 1:
+            frames = Parser.fec_frames(frame, payload, parity, max_size)
+            if frames is not None:
+                return frames
+        frame.chunk_count = len(chunks)
+        frames = []
+        for chunk_id, chunk in enumerate(chunks, start=1):
+            frame.chunk_id = chunk_id
+            frame.payload = chunk
+            frames.append(FrameCodec.encode(frame, binary))
+        return frames
+
+    @staticmethod
+    def fec_frames(frame: Frame, payload, parity, max_size: int = MAX_FRAME_SIZE) -> list:
+        """
+        Splits payload into equal blocks (opaque bytes, room left for the
+        parity header) and appends parity(block count) parity frames.
+        Returns None when no parity is wanted.
+        """
+        reserve = MAX_FRAME_SIZE - FrameCodec.capacity(frame.sender, max_size=max_size) + fec.FEC_HEADER.size
+        data = payload.encode("utf-8") if isinstance(payload, str) else bytes(payload)
+        chunks = list(Parser.iter_chunks(data, reserve=reserve, utf8=False))
+        parity_count = min(parity(len(chunks)), fec.MAX_BLOCKS - len(chunks)) if len(chunks) <= MAX_CHUNKS else 0
+        if parity_count <= 0:
+            return None
+        size = len(chunks[0])
+        blocks = [bytes(chunk).ljust(size, b"\0") for chunk in chunks]
+        header = fec.FEC_HEADER.pack(parity_count, len(data))
+        frame.flags |= FLAG_FEC
+        frame.chunk_count = len(chunks)
+        frames = []
+        for chunk_id, chunk in enumerate(chunks + [header + block for block in fec.encode(blocks, parity_count)],
+                                         start=1):
+            frame.chunk_id = chunk_id
+            frame.payload = chunk
+            frames.append(FrameCodec.encode_binary(frame))
+        return frames
 
     @staticmethod
-    def parse_message(raw: str) -> dict:
+    def parse_message(raw) -> "ParsedFrame":
         """
         Parses structured LoRa message with CRC validation.
+        Accepts text frames (str or bytes) and binary frames (bytes or a
+        memoryview of the receive buffer, which is not copied).
         Example: "from:node1|message:Hello|chunk_id:1|chunk_batch:3|timestamp:1722250340*AB"
         """
-        result = {
-            "from": None,
-            "timestamp": None,
-            "batch": None,
-            "chunk": [],
-            "valid": False,
-            "error": None
-        }
-
         try:
-            if "*" not in raw:
-                result["error"] = "CRC delimiter not found."
-                return result
-
-            payload, crc = raw.rsplit("*", 1)
-            expected_crc = Parser.calculate_crc(payload)
-
-            if crc.upper() != expected_crc:
-                result["error"] = f"CRC mismatch (expected {expected_crc}, got {crc.upper()})"
-                return result
-
-            # Split fields by |
-            fields = payload.split("|")
-            for field in fields:
-                if ":" not in field:
-                    continue
-                key, value = field.split(":", 1)
-                if key == "from":
-                    result["from"] = value
-                elif key == "timestamp":
-                    try:
-                        result["timestamp"] = int(value)
-                    except ValueError:
-                        result["error"] = "Invalid timestamp format."
-                        return result
-                elif key == "chunk_batch":
-                    try:
-                        result["batch"] = int(value)
-                    except ValueError:
-                        result["error"] = "Invalid chunk batch format."
-                        return result
-                elif key == "message":
-                    # If message contains multiple chunks
-                    if "|c" in value:
-                        chunks = re.findall(r"\|c(\d+)\|([^|]+)", value)
-                        for cid, msg in chunks:
-                            result["chunk"].append({"id": int(cid), "message": msg})
-                    else:
-                        result["chunk"].append({"id": 1, "message": value})
-
-            # Basic validation
-            if not result["from"] or not result["timestamp"] or not result["batch"]:
-                result["error"] = "Missing required fields."
-                return result
-
-            result["valid"] = True
-            return result
-
-        except Exception as e:
-            result["error"] = str(e)
+            frame = FrameCodec.decode(raw)
+        except ChecksumError as e:
+            _PARSE_CRC_ERRORS.inc()
+            return ParsedFrame(str(e))
+        except FrameError as e:
+            _PARSE_MALFORMED.inc()
+            return ParsedFrame(str(e))
+
+        result = ParsedFrame()
+        result.sender = frame.sender
+        result.timestamp = frame.timestamp
+        result.batch = frame.batch
+        result.chunk_id = frame.chunk_id
+        result.chunk_count = frame.chunk_count
+        payload = frame.payload
+        if frame.flags & FLAG_FEC and frame.chunk_count > 1:
+            # Opaque block of an FEC batch
+            result.fec = True
+            result.compressed = bool(frame.flags & FLAG_COMPRESSED)
+            if frame.chunk_id > frame.chunk_count:
+                if len(payload) <= fec.FEC_HEADER.size:
+                    _PARSE_MALFORMED.inc()
+                    result.error = "Parity frame too short."
+                    return result
+                result.parity = fec.FEC_HEADER.unpack_from(payload)
+                payload = payload[fec.FEC_HEADER.size:]
+        elif frame.flags & FLAG_COMPRESSED:
+            if frame.chunk_count == 1:
+                try:
+                    payload = compression.decompress(payload)
+                except ValueError as e:
+                    _PARSE_DECOMPRESS_ERRORS.inc()
+                    result.error = str(e)
+                    return result
+            else:
+                # Opaque slice of a compressed batch, inflated once reassembled
+                result.compressed = True
+        result.payload = payload
+
+        # Basic validation
+        if not result.sender or not result.timestamp or not result.batch:
+            _PARSE_MISSING_FIELDS.inc()
+            result.error = "Missing required fields."
             return result
 
+        _PARSED_FRAMES.inc()
+        result.valid = True
+        return result
 
     @staticmethod
-    def format_message(self, parsed: dict, is_chunked: bool) -> str:
+    def format_message(self, parsed: ParsedFrame, is_chunked: bool) -> str:
         """
         Formats a parsed message back to a string.
         """
-        if not parsed["valid"]:
+        if not parsed.valid:
             return None
 
         fields = [
-            f"from:{parsed['from']}",
-            f"timestamp:{parsed['timestamp']}",
-            f"chunk_batch:{parsed['batch']}"
+            f"from:{parsed.sender}",
+            f"timestamp:{parsed.timestamp}",
+            f"chunk_batch:{parsed.batch}",
+            f"chunk_id:{parsed.chunk_id}|message:{parsed.text}"
         ]
 
-        for chunk in parsed["chunk"]:
-            fields.append(f"chunk_id:{chunk['id']}|message:{chunk['message']}")
-
         return "|".join(fields)
     
     @staticmethod
@@ -157,26 +273,55 @@ class Parser:
             return "FILE_NOT_FOUND"
         return Parser.file_crc32(path)
 
+    @staticmethod
+    def crc32_update(crc: int, data: bytes) -> int:
+        """
+        Continues the file_crc32 checksum (reflected 0xEDB88320, zero initial
+        value, no final XOR) over more bytes, using zlib's table engine.
+        zlib pre- and post-inverts the register, so we invert around it.
+        """
+        return zlib.crc32(data, crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
     @staticmethod
     def file_crc32(path: Path) -> str:
         """
         Calculates CRC32 of a file. Returns hex string (e.g. 'A1B2C3D4').
+        Results are cached by (path, size, mtime_ns, inode); when the same
+        file has only grown and its cached tail is unchanged, just the
+        appended bytes are read. Anything else rehashes the whole file.
         """
-        crc = 0
+        key = str(path)
         try:
-            with path.open("rb") as f:
-                while chunk := f.read(4096):
-                    for byte in chunk:
-                        crc ^= byte
-                        for _ in range(8):
-                            if crc & 1:
-                                crc = (crc >> 1) ^ 0xEDB88320
-                            else:
-                                crc >>= 1
-            return format(crc & 0xFFFFFFFF, '08X')
+            st = os.stat(path)
+        except FileNotFoundError:
+            _CRC_CACHE.pop(key, None)
+            return "FILE_NOT_FOUND"
+
+        cached = _CRC_CACHE.get(key)
+        if cached and cached[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+            return format(cached[3], '08X')
+
+        crc, start, tail = 0, 0, b""
+        try:
+            with open(path, "rb") as f:
+                if cached and cached[2] == st.st_ino and cached[0] < st.st_size:
+                    # Only trust the cached prefix if its last bytes are unchanged
+                    size, _, _, old_crc, old_tail = cached
+                    f.seek(size - len(old_tail))
+                    if f.read(len(old_tail)) == old_tail:
+                        crc, start, tail = old_crc, size, old_tail
+                f.seek(start)
+                end = start
+                while chunk := f.read(1 << 16):
+                    crc = Parser.crc32_update(crc, chunk)
+                    tail = (tail + chunk)[-_CRC_TAIL:]
+                    end += len(chunk)
         except FileNotFoundError:
             return "FILE_NOT_FOUND"
 
+        _CRC_CACHE[key] = (end, st.st_mtime_ns, st.st_ino, crc & 0xFFFFFFFF, tail)
+        return format(crc & 0xFFFFFFFF, '08X')
+
     @staticmethod
     def file_md5(path: Path) -> str:
         """
@@ -208,54 +353,67 @@ class Parser:
     def is_messages_dir(path: Path) -> bool:
         """
         Checks if a directory is a valid messages directory.
-        It should contain 'messages.json' and 'to_send.json'.
+        It should contain 'messages.json' and an outbox: 'outbox.journal',
+        or the legacy 'to_send.json'.
         """
         if not path.is_dir():
             return False
-        if not (path / "messages.json").exists() or not (path / "to_send.json").exists():
+        if not (path / "messages.json").exists():
             return False
-        return True
+        return (path / "outbox.journal").exists() or (path / "to_send.json").exists()
+
+    @staticmethod
+    def iter_chunks(message, max_size: int = MAX_FRAME_SIZE, reserve: int = 0, utf8: bool = True):
+        """
+        Lazily splits a message into UTF-8 safe pieces of at most
+        `max_size - reserve` bytes. The message is encoded once and each
+        piece is a memoryview slice ending on a code point boundary.
+        """
+        data = message.encode("utf-8") if isinstance(message, str) else message
+        limit = max_size - reserve
+        if limit < 4:
+            raise ValueError(f"Chunk size {limit} cannot hold a UTF-8 code point")
+        view = memoryview(data)
+        pos, total = 0, len(data)
+        while pos < total:
+            end = min(pos + limit, total)
+            # Back off continuation bytes (10xxxxxx) so no code point is cut
+            while utf8 and end < total and data[end] & 0xC0 == 0x80:
+                end -= 1
+            yield view[pos:end]
+            pos = end
 
     @staticmethod
-    def should_it_be_in_batches(batch: dict, max_chunk_size: int = 240) -> bool:
+    def frame_chunks(message, sender: str, binary: bool = True, checksum: str = "", utf8: bool = True,
+                     max_size: int = MAX_FRAME_SIZE) -> list:
         """
-        Determines if the data should be sent in batches based on size.
+        Splits a message into payloads that each fit a whole frame of
+        max_size, header included. Raises ValueError past MAX_CHUNKS pieces.
+        utf8=False splits opaque bytes (e.g. compressed) at any offset.
         """
-        chunks = batch.get("chunks", [])
-        chunk_size = sum(len(chunk.encode('utf-8')) for chunk in chunks)
-        total_size = len(batch.get("message", "").encode('utf-8'))
+        reserve = MAX_FRAME_SIZE - FrameCodec.capacity(sender, binary, checksum, max_size)
+        chunks = list(Parser.iter_chunks(message, reserve=reserve, utf8=utf8))
+        if len(chunks) > MAX_CHUNKS:
+            raise ValueError(f"Message needs {len(chunks)} frames, limit is {MAX_CHUNKS}")
+        return chunks
 
-        if chunk_size <= 0 or total_size <= 0:
+    @staticmethod
+    def should_it_be_in_batches(batch: dict, max_chunk_size: int = MAX_FRAME_SIZE) -> bool:
+        """
+        Determines if the data should be sent in batches based on size.
+        """
+        if not batch.get("chunks"):
             return False
+        return len(batch.get("message", "").encode('utf-8')) > max_chunk_size
 
-        if total_size > max_chunk_size:
-            return True
-
-        return False
-    
     @staticmethod
-    def split_into_chunks(message: str, max_size: int = 240) -> list:
+    def split_into_chunks(message: str, max_size: int = MAX_FRAME_SIZE) -> list:
         """
         Splits the message into UTF-8 safe chunks not exceeding `max_size` bytes.
         Adds a marshal to identify if data is a split chunk with chunk identifiers.
         """
-        chunks = []
-        current_chunk = ""
-        chunk_id = 1
-
-        for char in message:
-            # Check if adding the char exceeds the byte limit
-            if len((current_chunk + char).encode('utf-8')) > max_size:
-                chunks.append(f"|c{chunk_id}|{current_chunk}")
-                current_chunk = char
-                chunk_id += 1
-            else:
-                current_chunk += char
-
-        if current_chunk:
-            chunks.append(f"|c{chunk_id}|{current_chunk}")
-
-        return chunks
+        return [f"|c{chunk_id}|{str(chunk, 'utf-8')}"
+                for chunk_id, chunk in enumerate(Parser.iter_chunks(message, max_size), start=1)]
 
     @staticmethod
     def is_it_in_batches(message: str, max_size: int = 240) -> bool:
@@ -315,18 +473,45 @@ class Parser:
         return max((int(v.get("chunk_batch", 0)) for v in chunks.values()), default=0)
 
     @staticmethod
-    def generate_batch_id() -> int:
+    def open_id_allocator(path: Path = IDS_PATH, to_send: Path = TO_SEND_PATH, last_batch=None) -> IdAllocator:
+        """
+        Batch/chunk id allocator kept in `path`. Only when that file is
+        missing or damaged is it seeded from `to_send` and `last_batch()`
+        (e.g. the highest batch in the message log), whichever is higher.
+        """
+        def seed():
+            batch = Parser.last_batch_id(to_send)
+            if last_batch is not None:
+                batch = max(batch, last_batch())
+            return {"batch": batch, "chunk": Parser.last_chunk_id(to_send)}
+        return IdAllocator(path, seed=seed)
+
+    @staticmethod
+    def id_allocator() -> IdAllocator:
         """
-        Generates a new batch ID based on the last one.
+        Shared allocator under ./messages, for callers without their own
+        (a Gateway keeps one in its messages directory).
         """
-        return Parser.last_batch_id() + 1   
+        global _id_allocator
+        with _id_allocator_lock:
+            if _id_allocator is None:
+                _id_allocator = Parser.open_id_allocator()
+            return _id_allocator
+
+    @staticmethod
+    def generate_batch_id(allocator: IdAllocator = None) -> int:
+        """
+        Generates a new batch ID, cycling through 1..MAX_BATCH_ID.
+        """
+        allocator = allocator or Parser.id_allocator()
+        return (allocator.reserve("batch") - 1) % MAX_BATCH_ID + 1
 
     @staticmethod
     def batch_chunks(chunks: list, batch_size: int, sender: str) -> dict:
         """
         Groups chunks into batches with specified size and includes metadata.
         """
-        batch_id = Parser.last_batch_id() + 1
+        batch_id = Parser.generate_batch_id()
         batch = {}
         timestamp = int(datetime.now().timestamp())
 
@@ -356,14 +541,16 @@ class Parser:
         return {k: v for k, v in chunks.items() if int(k) <= batch}
 
     @staticmethod
-    def generate_chunk_id() -> int:
+    def generate_chunk_id(count: int = 1, allocator: IdAllocator = None) -> int:
         """
-        Generates a unique chunk ID based on last_chunk_id.
+        Generates a unique chunk ID; with count > 1 reserves a block of
+        consecutive IDs and returns the first.
         """
-        return Parser.last_chunk_id() + 1
+        return (allocator or Parser.id_allocator()).reserve("chunk", count)
 
     @staticmethod
     def save_chunk_data(sender, timestamp, batch, chunk_id, message):
+        os.makedirs(SAVE_DIR, exist_ok=True)
         file_path = os.path.join(SAVE_DIR, f"{sender}_{timestamp}_{batch}.json")
 
         # If file exists, load and append. Otherwise, start new dict.
@@ -387,12 +574,11 @@ class Parser:
 
     @staticmethod
     def chunk_message(message, max_length=220):
-        chunks = []
-        for i in range(0, len(message), max_length):
-            chunks.append({"id": (i // max_length) + 1, "text": message[i:i + max_length]})
-        return chunks
-
-
+        """
+        Splits a message into {"id", "text"} pieces of at most max_length bytes.
+        """
+        return [{"id": chunk_id, "text": str(chunk, "utf-8")}
+                for chunk_id, chunk in enumerate(Parser.iter_chunks(message, max_length), start=1)]
 
     @staticmethod
     def reassemble_chunks(sender, timestamp, batch):
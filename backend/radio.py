@@ -0,0 +1,97 @@
+# radio.py
+
+import math
+import os
+from abc import ABC, abstractmethod
+
+# Demodulation floor (minimum SNR in dB) per spreading factor, SX127x datasheet
+SNR_LIMIT = {6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+
+
+def airtime(payload_len: int, sf: int = 7, bw: int = 125000, cr: int = 5,
+            preamble: int = 8, explicit_header: bool = True, crc: bool = True) -> float:
+    """
+    Time on air in seconds of one LoRa packet (Semtech AN1200.13).
+    `cr` is the coding rate denominator, 5..8 for 4/5..4/8.
+    """
+    t_sym = (2 ** sf) / bw
+    low_dr_optimize = 1 if t_sym > 0.016 else 0
+    t_preamble = (preamble + 4.25) * t_sym
+    numerator = 8 * payload_len - 4 * sf + 28 + 16 * int(crc) - 20 * int(not explicit_header)
+    payload_symbols = 8 + max(math.ceil(numerator / (4 * (sf - 2 * low_dr_optimize))) * cr, 0)
+    return t_preamble + payload_symbols * t_sym
+
+
+class Radio(ABC):
+    """
+    The radio interface LoRaEngine relies on. It matches the methods of
+    pyLoRa.lora_module.LoRa so the hardware driver can be used as-is;
+    sim_radio.SimRadio implements the same interface in-process.
+    """
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+    @abstractmethod
+    def set_frequency(self, mhz: float):
+        ...
+
+    @abstractmethod
+    def set_tx_power(self, dbm: int):
+        ...
+
+    @abstractmethod
+    def set_spreading_factor(self, sf: int):
+        ...
+
+    @abstractmethod
+    def set_bandwidth(self, hz: int):
+        ...
+
+    @abstractmethod
+    def set_mode_rx(self):
+        ...
+
+    @abstractmethod
+    def set_mode_tx(self):
+        ...
+
+    @abstractmethod
+    def send(self, data: bytes):
+        ...
+
+    @abstractmethod
+    def receive(self) -> bool:
+        """
+        True when a received packet is waiting to be read.
+        """
+
+    @abstractmethod
+    def read(self) -> bytes:
+        ...
+
+    # Optional: read_into(buffer) -> int copies the next packet into a
+    # writable buffer and returns its length, which exceeds len(buffer)
+    # when the packet was truncated. LoRaEngine then receives through a
+    # frame_ring.FrameRing instead of allocating per packet.
+
+    @abstractmethod
+    def close(self):
+        ...
+
+
+def open_radio(kind: str = None, **kwargs):
+    """
+    Returns the radio selected by `kind` or the HDE_RADIO environment
+    variable: "pylora" (default) for the SX127x hardware driver, "sim" for
+    a standalone simulated radio.
+    """
+    kind = kind or os.environ.get("HDE_RADIO", "pylora")
+    if kind == "sim":
+        from sim_radio import SimChannel
+        return SimChannel(**kwargs).add_node()
+    if kind == "pylora":
+        from pyLoRa.lora_module import LoRa
+        return LoRa(**kwargs)
+    raise ValueError(f"Unknown radio kind: {kind}")
@@ -0,0 +1,217 @@
+# radio_pool.py
+
+import threading
+from collections import deque
+
+from dedup import DedupCache
+from logs import get_logger
+from lora_engine import LISTENER_ERRORS, SETTERS, LoRaEngine, register_transmitter, unregister_transmitter
+from outbox import DutyCycleScheduler, Outbox, PRIORITY_DIRECT
+from radio import open_radio
+
+log = get_logger("radio_pool")
+
+ROLES = ("rx", "tx", "both")
+
+
+class RadioPool:
+    def __init__(self, radios: list, roles: list = None, outbox: Outbox = None, duty_cycle: float = 1.0,
+                 dedup: DedupCache = None, relay=None, irq_driven: bool = None, pinned: list = None,
+                 **engine_kwargs):
+        """
+        Several radios behind the LoRaEngine interface: one keeps listening
+        while another transmits, each on its own frequency/SF.
+        roles[i] is "rx", "tx" or "both"; by default the first radio only
+        listens and the others only transmit (a single radio does both).
+        The engines share `outbox`, so whichever TX radio is free takes the
+        next frame. With duty_cycle < 1 every frequency gets its own
+        DutyCycleScheduler (radios on the same sub-band share its budget).
+        Frames received by any radio go through one `dedup` cache and reach
+        the listeners one at a time, as a single stream.
+        pinned[i] names the settings that make up radio i's channel: a
+        pool-wide configure() (e.g. from ADR) leaves them alone. Frequency
+        is always pinned.
+        """
+        if not radios:
+            raise ValueError("RadioPool needs at least one radio")
+        roles = list(roles or [])
+        roles += [None] * (len(radios) - len(roles))
+        default = ["both"] if len(radios) == 1 else ["rx"] + ["tx"] * (len(radios) - 1)
+        roles = [role or default[i] for i, role in enumerate(roles)]
+        for role in roles:
+            if role not in ROLES:
+                raise ValueError(f"Unknown radio role: {role}")
+        if all(role == "tx" for role in roles) or all(role == "rx" for role in roles):
+            raise ValueError("RadioPool needs both a receiving and a transmitting radio")
+
+        self.outbox = outbox if outbox is not None else Outbox()
+        self.dedup = dedup if dedup is not None else DedupCache("frame")
+        self.relay = relay
+        self.roles = roles
+        pinned = list(pinned or [])
+        pinned += [()] * (len(radios) - len(pinned))
+        self.pinned = [set(keys) | {"frequency"} for keys in pinned]
+        self.listeners = []
+        self.inbox = deque(maxlen=256)  # received frames when nobody listens
+        self.dispatch_lock = threading.Lock()
+        self.last_engine = None
+        if relay is not None:
+            # Rebroadcasts go through the pool, not one engine
+            relay.attach(self)
+
+        schedulers = {}
+        self.engines = []
+        for radio, role in zip(radios, roles):
+            scheduler = None
+            if role != "rx" and 0 < duty_cycle < 1:
+                frequency = getattr(radio, "frequency", None)
+                scheduler = schedulers.setdefault(frequency, DutyCycleScheduler(duty_cycle))
+            engine = LoRaEngine(radio=radio, irq_driven=irq_driven, outbox=self.outbox, scheduler=scheduler,
+                                dedup=self.dedup, relay=relay, rx=role != "tx", tx=role != "rx", **engine_kwargs)
+            engine.add_listener(lambda raw, engine=engine: self._receive(engine, raw))
+            self.engines.append(engine)
+        self.rx_engines = [e for e in self.engines if e.rx]
+        self.tx_engines = [e for e in self.engines if e.tx]
+
+        # The TX gauges count the shared outbox once, through the pool
+        for engine in self.tx_engines:
+            unregister_transmitter(engine)
+        register_transmitter(self)
+        log.info("Radio pool: %s", ", ".join(f"{r['role']}@{r['frequency']}MHz/SF{r['spreading_factor']}"
+                                              for r in self.radios()))
+
+    @classmethod
+    def from_specs(cls, specs: list, **kwargs) -> "RadioPool":
+        """
+        Opens one radio per spec, e.g. the HDE_RADIOS list
+        [{"role": "rx", "frequency": 433.175}, {"frequency": 434.665, "spreading_factor": 9}].
+        "kind" and "driver" (keyword arguments) go to radio.open_radio.
+        """
+        radios = []
+        for spec in specs:
+            radio = open_radio(spec.get("kind"), **spec.get("driver", {}))
+            if "frequency" in spec:
+                radio.set_frequency(spec["frequency"])
+            if "spreading_factor" in spec:
+                radio.set_spreading_factor(spec["spreading_factor"])
+            if "bandwidth" in spec:
+                radio.set_bandwidth(spec["bandwidth"])
+            radios.append(radio)
+        pinned = [[key for key in ("frequency", "spreading_factor", "bandwidth") if key in spec] for spec in specs]
+        return cls(radios, [spec.get("role") for spec in specs], pinned=pinned, **kwargs)
+
+    @property
+    def lora(self):
+        """
+        The radio whose settings describe what this node hears.
+        """
+        return self.rx_engines[0].lora
+
+    @property
+    def settings(self) -> dict:
+        return self.tx_engines[0].settings
+
+    @property
+    def last_rssi(self):
+        return self.last_engine.last_rssi if self.last_engine else None
+
+    @property
+    def last_snr(self):
+        return self.last_engine.last_snr if self.last_engine else None
+
+    def airtime(self, payload_len: int) -> float:
+        return self.tx_engines[0].airtime(payload_len)
+
+    def _receive(self, engine: LoRaEngine, raw):
+        # Engine threads run concurrently; listeners see one frame at a time
+        with self.dispatch_lock:
+            self.last_engine = engine
+            if not self.listeners:
+                self.inbox.append(bytes(raw))
+                return
+            for listener in self.listeners:
+                try:
+                    listener(raw)
+                except Exception as e:
+                    LISTENER_ERRORS.inc()
+                    log.error("Listener failed: %s", e)
+
+    def add_listener(self, callback):
+        """
+        Registers callback(raw: bytes) for frames received by any radio.
+        Calls are serialized; callbacks must not block.
+        """
+        self.listeners.append(callback)
+
+    def notify_irq(self, *_):
+        for engine in self.engines:
+            engine.notify_irq()
+
+    def configure(self, radio: int = None, **settings):
+        """
+        Changes the settings of radio index `radio`, or of every radio but
+        for the settings each has pinned (its own channel).
+        """
+        for key in settings:
+            if key not in SETTERS:
+                raise ValueError(f"Unknown radio setting: {key}")
+        if radio is not None:
+            self.engines[radio].configure(**settings)
+            return
+        for engine, pinned in zip(self.engines, self.pinned):
+            shared = {key: value for key, value in settings.items() if key not in pinned}
+            if shared:
+                engine.configure(**shared)
+
+    def set_state(self, new_state):
+        for engine in self.engines:
+            engine.set_state(new_state)
+
+    def get_state(self):
+        states = [engine.get_state() for engine in self.engines]
+        return "transmit" if "transmit" in states else states[0]
+
+    def queue_message(self, msg, priority: int = PRIORITY_DIRECT, durable: bool = True):
+        return self.queue_frames([msg], priority, durable)[0]
+
+    def queue_frames(self, frames: list, priority: int = PRIORITY_DIRECT, durable: bool = True) -> list:
+        """
+        Queues the frames of one message; the first free TX radio sends each.
+        """
+        ids = self.outbox.put_many(frames, priority, durable)
+        log.debug("Queued %d frame(s) at priority %d", len(frames), priority)
+        return [{"status": "queued", "id": i, "message": frame} for i, frame in zip(ids, frames)]
+
+    def tx_queue_depth(self) -> int:
+        return len(self.outbox)
+
+    def drain_time(self) -> float:
+        """
+        Estimated seconds until every queued frame is on air, assuming the
+        backlog splits evenly across the TX radios.
+        """
+        share = sum(self.airtime(len(frame)) for frame in self.outbox.frames()) / len(self.tx_engines)
+        return max(e.scheduler.drain_time(share) if e.scheduler else share for e in self.tx_engines)
+
+    def get_messages(self):
+        items = []
+        with self.dispatch_lock:
+            while self.inbox:
+                items.append(self.inbox.popleft())
+        return items
+
+    def radios(self) -> list:
+        return [{
+            "role": role,
+            "state": engine.get_state(),
+            "frequency": getattr(engine.lora, "frequency", None),
+            "spreading_factor": getattr(engine.lora, "spreading_factor", None),
+        } for engine, role in zip(self.engines, self.roles)]
+
+    def shutdown(self):
+        unregister_transmitter(self)
+        if self.relay is not None:
+            self.relay.stop()
+        for engine in self.engines:
+            engine.shutdown(close_outbox=False)
+        self.outbox.close()
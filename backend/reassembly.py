@@ -0,0 +1,308 @@
+# reassembly.py
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import fec
+import metrics
+from logs import get_logger
+
+log = get_logger("reassembly")
+
+SNAPSHOT_VERSION = 1  # partials.json layout: chunks as latin-1 strings of their bytes
+
+REASSEMBLY_TIME = metrics.histogram("hde_reassembly_seconds",
+                                    "First to last chunk of a completed multi-chunk message")
+REASSEMBLY_EXPIRED = metrics.counter("hde_reassembly_expired_total", "Partial messages dropped after the timeout")
+
+
+class TimerWheel:
+    def __init__(self, timeout: float, tick: float = 1.0):
+        """
+        Hashed timer wheel with a single fixed timeout. Scheduling, touching
+        and cancelling a key are O(1); advance() only visits slots whose
+        time has passed instead of every pending key.
+        """
+        self.tick = tick
+        self.timeout = timeout
+        self.slots = [set() for _ in range(int(timeout / tick) + 2)]
+        self.slot_of = {}   # key -> (slot index, deadline)
+        self.cursor = None  # last processed tick number
+
+    def _tick_number(self, now: float) -> int:
+        return int(now / self.tick)
+
+    def schedule(self, key, now: float):
+        self.cancel(key)
+        deadline = now + self.timeout
+        index = self._tick_number(deadline) % len(self.slots)
+        self.slots[index].add(key)
+        self.slot_of[key] = (index, deadline)
+        if self.cursor is None:
+            self.cursor = self._tick_number(now)
+
+    def cancel(self, key):
+        entry = self.slot_of.pop(key, None)
+        if entry is not None:
+            self.slots[entry[0]].discard(key)
+
+    def advance(self, now: float) -> list:
+        """
+        Returns the keys whose deadline has passed.
+        """
+        if self.cursor is None:
+            return []
+        target = self._tick_number(now)
+        expired = []
+        # A full turn visits every slot, so never walk more than that
+        start = max(self.cursor, target - len(self.slots) + 1)
+        for tick in range(start, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            for key in [k for k in slot if self.slot_of[k][1] <= now]:
+                slot.discard(key)
+                del self.slot_of[key]
+                expired.append(key)
+        self.cursor = target
+        return expired
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+
+class PartialMessage:
+    __slots__ = ("count", "chunks", "mask", "received", "timestamp", "started", "updated",
+                 "parity", "parity_count", "length")
+
+    def __init__(self, count: int, timestamp: int, started: float):
+        self.count = count
+        self.chunks = [None] * count
+        self.mask = 0        # bit i set when chunk i+1 has arrived
+        self.received = 0
+        self.timestamp = timestamp
+        self.started = started
+        self.updated = started
+        self.parity = {}     # FEC batches: parity index -> block
+        self.parity_count = 0
+        self.length = None
+
+    def add(self, chunk_id: int, data: bytes) -> bool:
+        """
+        Stores one chunk (bytes, owned by the message); returns True when
+        it was new.
+        """
+        bit = 1 << (chunk_id - 1)
+        if self.mask & bit:
+            return False
+        self.mask |= bit
+        self.received += 1
+        self.chunks[chunk_id - 1] = data
+        return True
+
+    def add_parity(self, index: int, parity_count: int, length: int, block: bytes) -> bool:
+        if index in self.parity:
+            return False
+        self.parity[index] = block
+        self.parity_count = parity_count
+        self.length = length
+        return True
+
+    def complete(self) -> bool:
+        """
+        True once every chunk arrived, or enough parity to rebuild the rest.
+        """
+        return self.received + len(self.parity) >= self.count
+
+    def missing(self) -> list:
+        return [i + 1 for i in range(self.count) if not self.mask >> i & 1]
+
+    def payload(self) -> bytes:
+        """
+        The reassembled message bytes, rebuilt from FEC parity if needed.
+        """
+        if self.received == self.count:
+            return b"".join(self.chunks)
+        size = len(next(iter(self.parity.values())))
+        data = {i: chunk.ljust(size, b"\0") for i, chunk in enumerate(self.chunks) if chunk is not None}
+        blocks = fec.decode(data, self.parity, self.count, self.parity_count, size)
+        return b"".join(blocks)[:self.length]
+
+
+class Reassembler:
+    def __init__(self, timeout: float = 60, tick: float = 1.0, persist_path: Path = None,
+                 flush_interval: float = 5.0, on_expire=None):
+        """
+        In-memory reassembly of multi-chunk messages keyed by (sender, batch).
+        Completion is an O(1) counter check and expiry runs on a timer wheel.
+        With persist_path set, partial messages are snapshotted to disk at
+        most every flush_interval seconds and reloaded on start; start()
+        runs tick() on a thread so a quiet channel still gets its snapshot.
+        """
+        self.timeout = timeout
+        self.wheel = TimerWheel(timeout, tick)
+        self.partials = {}
+        self.persist_path = Path(persist_path) if persist_path else None
+        self.flush_interval = flush_interval
+        self.on_expire = on_expire
+        self._dirty = False
+        self._last_flush = None
+        self.lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.persist_path:
+            self._load()
+
+    def add(self, sender: str, batch: int, chunk_id: int, chunk_count: int, data: bytes,
+            timestamp: int, now: float = None, parity: tuple = None):
+        """
+        Adds a chunk. Returns the PartialMessage once every chunk of its
+        (sender, batch) has arrived (or can be rebuilt from FEC parity),
+        otherwise None. Parity chunks (ids past chunk_count) come with
+        parity=(parity count, message length) from Parser.parse_message.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            return self._add(sender, batch, chunk_id, chunk_count, data, timestamp, now, parity)
+
+    def _add(self, sender, batch, chunk_id, chunk_count, data, timestamp, now, parity):
+        self.expire(now)
+
+        if not 1 <= chunk_id <= chunk_count + (parity[0] if parity else 0):
+            return None
+        key = (sender, batch)
+        partial = self.partials.get(key)
+        if partial is None or partial.count != chunk_count:
+            partial = self.partials[key] = PartialMessage(chunk_count, timestamp, now)
+
+        if chunk_id > chunk_count:
+            added = partial.add_parity(chunk_id - chunk_count - 1, parity[0], parity[1], data)
+        else:
+            added = partial.add(chunk_id, data)
+        if added:
+            partial.updated = now
+            self._dirty = True
+        if partial.complete():
+            del self.partials[key]
+            self.wheel.cancel(key)
+            REASSEMBLY_TIME.observe(now - partial.started)
+            self._maybe_flush(now)
+            return partial
+
+        self.wheel.schedule(key, now)
+        self._maybe_flush(now)
+        return None
+
+    def expire(self, now: float = None) -> list:
+        """
+        Drops partial messages idle for longer than the timeout.
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            keys = self.wheel.advance(now)
+            for key in keys:
+                partial = self.partials.pop(key, None)
+                if partial is None:
+                    continue
+                expired.append((key, partial))
+                REASSEMBLY_EXPIRED.inc()
+                self._dirty = True
+                if self.on_expire:
+                    self.on_expire(key, partial)
+        return expired
+
+    def tick(self, now: float = None):
+        """
+        Expires idle partials and writes the snapshot once it is due, so
+        the last chunks of a burst reach disk without waiting for another.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.expire(now)
+            self._maybe_flush(now)
+
+    def _run(self):
+        while not self._stop.wait(self.wheel.tick):
+            try:
+                self.tick()
+            except Exception as e:
+                log.error("Tick failed: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="reassembly", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the tick thread and writes any pending snapshot.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        with self.lock:
+            if self._dirty:
+                self.flush()
+
+    def __len__(self) -> int:
+        return len(self.partials)
+
+    # ------------------------------------------------------------ persistence
+
+    def _maybe_flush(self, now: float):
+        if not (self.persist_path and self._dirty):
+            return
+        if self._last_flush is None:
+            self._last_flush = now
+        elif now - self._last_flush >= self.flush_interval:
+            self.flush()
+            self._last_flush = now
+
+    def flush(self):
+        """
+        Atomically writes all partial messages to persist_path. Chunks are
+        bytes, stored as latin-1 strings (one character per byte).
+        """
+        if not self.persist_path:
+            return
+        with self.lock:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        partials = {
+            f"{batch}|{sender}": {
+                "count": p.count, "timestamp": p.timestamp,
+                "chunks": [str(chunk, "latin-1") if chunk is not None else None for chunk in p.chunks],
+                "parity": {index: str(block, "latin-1") for index, block in p.parity.items()},
+                "parity_count": p.parity_count, "length": p.length}
+            for (sender, batch), p in self.partials.items()
+        }
+        snapshot = {"version": SNAPSHOT_VERSION, "partials": partials}
+        self.persist_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.persist_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self.persist_path)
+        self._dirty = False
+
+    def _load(self):
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+            log.warning("Ignoring %s: not a version %d snapshot", self.persist_path, SNAPSHOT_VERSION)
+            return
+        now = time.monotonic()
+        for key, value in snapshot["partials"].items():
+            batch, sender = key.split("|", 1)
+            partial = PartialMessage(value["count"], value["timestamp"], now)
+            for chunk_id, chunk in enumerate(value["chunks"], start=1):
+                if chunk is not None:
+                    partial.add(chunk_id, chunk.encode("latin-1"))
+            for index, block in value.get("parity", {}).items():
+                partial.add_parity(int(index), value["parity_count"], value["length"], block.encode("latin-1"))
+            self.partials[(sender, int(batch))] = partial
+            self.wheel.schedule((sender, int(batch)), now)
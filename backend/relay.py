@@ -0,0 +1,224 @@
+# relay.py
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+import metrics
+from dedup import DedupCache
+from frame_codec import FrameCodec, FrameError, MeshHeader, node_id
+from logs import get_logger
+from outbox import PRIORITY_DIRECT
+from radio import SNR_LIMIT
+
+log = get_logger("relay")
+
+RELAYED = metrics.counter("hde_relay_forwarded_total", "Frames rebroadcast for other nodes")
+SUPPRESSED = metrics.counter("hde_relay_suppressed_total", "Rebroadcasts cancelled after hearing other relays")
+
+
+class NeighborTable:
+    def __init__(self, ttl: float = 600.0, alpha: float = 0.3):
+        """
+        Link quality of nodes heard directly (by their last-hop id): RSSI
+        and SNR smoothed with an EWMA of weight alpha. Neighbors silent for
+        ttl seconds are forgotten.
+        """
+        self.ttl = ttl
+        self.alpha = alpha
+        self.started = time.monotonic()
+        self.entries = {}  # node id -> [rssi, snr, last seen, frames]
+        self.lock = threading.Lock()
+
+    def update(self, node: int, rssi: float = None, snr: float = None, now: float = None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            entry = self.entries.get(node)
+            if entry is None:
+                self.entries[node] = [rssi, snr, now, 1]
+                return
+            if rssi is not None:
+                entry[0] = rssi if entry[0] is None else entry[0] + self.alpha * (rssi - entry[0])
+            if snr is not None:
+                entry[1] = snr if entry[1] is None else entry[1] + self.alpha * (snr - entry[1])
+            entry[2] = now
+            entry[3] += 1
+
+    def recent(self, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for node in [n for n, e in self.entries.items() if now - e[2] > self.ttl]:
+                del self.entries[node]
+            return {node: {"rssi": e[0], "snr": e[1], "age": round(now - e[2], 1), "frames": e[3]}
+                    for node, e in self.entries.items()}
+
+    def warm(self, now: float = None) -> bool:
+        """
+        True once the table has listened for a full ttl, i.e. a missing
+        neighbor is really absent rather than not heard yet.
+        """
+        now = time.monotonic() if now is None else now
+        return now - self.started >= self.ttl
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Relay:
+    def __init__(self, node: str, hop_limit: int = 3, suppress_after: int = 2, contention: float = 4.0,
+                 jitter: float = 2.0, backoff_scale: float = 1.0, seen: DedupCache = None,
+                 neighbors: NeighborTable = None, seed: int = None):
+        """
+        Managed flood for LoRaEngine (pass it as `relay`).
+        Outgoing frames get a mesh envelope with hop_limit hops to live.
+        A node hearing an enveloped frame for the first time (seen cache
+        keyed by origin and packet id) delivers the inner frame locally and
+        schedules a rebroadcast after a random backoff measured in frame
+        airtimes: nodes that heard the last hop weakly (far away, so more
+        new coverage) draw from an earlier contention window. Hearing
+        suppress_after other copies before the backoff ends cancels the
+        rebroadcast. Once the neighbor table is warm, a node whose only
+        neighbors are the last hop and the origin does not forward at all.
+        backoff_scale shrinks the waits for simulations.
+        """
+        self.node = node
+        self.node_id = node_id(node)
+        self.hop_limit = hop_limit
+        self.suppress_after = suppress_after
+        self.contention = contention
+        self.jitter = jitter
+        self.backoff_scale = backoff_scale
+        self.seen = seen if seen is not None else DedupCache("relay")
+        self.neighbors = neighbors if neighbors is not None else NeighborTable()
+        self.random = random.Random(seed)
+        self._packet_ids = itertools.count(self.random.randrange(1 << 16))
+        self.engine = None
+        self.pending = {}  # (origin, packet id) -> [due, frame, last hops heard]
+        self.heap = []  # (due, key)
+        self.wakeup = threading.Condition()
+        self.running = False
+        self._thread = None
+        self.stats = {"originated": 0, "delivered": 0, "duplicates": 0, "forwarded": 0,
+                      "suppressed": 0, "ttl_expired": 0, "leaf_skipped": 0}
+
+    def attach(self, engine):
+        """
+        Called by LoRaEngine (or radio_pool.RadioPool): rebroadcasts are
+        queued on its outbox.
+        """
+        self.engine = engine
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    # ---------------------------------------------------------------- sending
+
+    def outgoing(self, frame) -> bytes:
+        """
+        Wraps a frame this node originates; rebroadcasts pass unchanged.
+        """
+        if FrameCodec.is_mesh(frame):
+            return frame
+        packet_id = next(self._packet_ids) & 0xFFFF
+        self.seen.seen((self.node_id, packet_id))
+        self.stats["originated"] += 1
+        header = MeshHeader(self.hop_limit, 0, self.node_id, packet_id, self.node_id)
+        return FrameCodec.encode_mesh(header, frame)
+
+    # -------------------------------------------------------------- receiving
+
+    def incoming(self, raw, rssi: float = None, snr: float = None, now: float = None):
+        """
+        Returns the inner frame to deliver locally, or None for a repeat.
+        Frames without an envelope (single-hop nodes) pass unchanged.
+        """
+        if not FrameCodec.is_mesh(raw):
+            return raw
+        try:
+            header, inner = FrameCodec.decode_mesh(raw)
+        except FrameError:
+            return None
+        now = time.monotonic() if now is None else now
+        self.neighbors.update(header.last_hop, rssi, snr, now)
+        key = (header.origin, header.packet_id)
+
+        with self.wakeup:
+            if self.seen.seen(key, now):
+                self.stats["duplicates"] += 1
+                pending = self.pending.get(key)
+                # One copy per relaying node: several radios of a
+                # radio_pool.RadioPool hear the same transmission
+                if pending is not None and header.last_hop not in pending[2]:
+                    pending[2].add(header.last_hop)
+                    if len(pending[2]) > self.suppress_after:
+                        del self.pending[key]
+                        self.stats["suppressed"] += 1
+                        SUPPRESSED.inc()
+                return None
+            self.stats["delivered"] += 1
+            if header.ttl <= 1:
+                self.stats["ttl_expired"] += 1
+            elif self._is_leaf(header, now):
+                self.stats["leaf_skipped"] += 1
+            else:
+                forward = MeshHeader(header.ttl - 1, header.hops + 1, header.origin, header.packet_id, self.node_id)
+                frame = FrameCodec.encode_mesh(forward, inner)
+                due = now + self._backoff(len(frame), snr)
+                self.pending[key] = [due, frame, {header.last_hop}]
+                heapq.heappush(self.heap, (due, key))
+                self.wakeup.notify()
+        return inner
+
+    def _is_leaf(self, header: MeshHeader, now: float) -> bool:
+        if not self.neighbors.warm(now):
+            return False
+        return not set(self.neighbors.recent(now)) - {header.last_hop, header.origin}
+
+    def _backoff(self, frame_len: int, snr: float) -> float:
+        """
+        Seconds to wait before rebroadcasting: a strong (close) link puts
+        the node later in the contention window than a weak one.
+        """
+        slot = self.engine.airtime(frame_len) if self.engine is not None else 0.1
+        if snr is None:
+            closeness = 0.5
+        else:
+            floor = SNR_LIMIT.get(getattr(self.engine.lora, "spreading_factor", 7), -7.5) if self.engine else -7.5
+            closeness = min(max((snr - floor) / 30.0, 0.0), 1.0)
+        slots = 1.0 + self.contention * closeness + self.jitter * self.random.random()
+        return slot * slots * self.backoff_scale
+
+    def _run(self):
+        while True:
+            with self.wakeup:
+                while self.running and not (self.heap and self.heap[0][0] <= time.monotonic()):
+                    self.wakeup.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                if not self.running:
+                    return
+                due, key = heapq.heappop(self.heap)
+                pending = self.pending.get(key)
+                if pending is None or pending[0] != due:
+                    continue
+                del self.pending[key]
+                self.stats["forwarded"] += 1
+            RELAYED.inc()
+            log.debug("Relaying packet %04X:%d", key[0], key[1])
+            self.engine.queue_message(pending[1], PRIORITY_DIRECT, durable=False)
+
+    def status(self) -> dict:
+        return {
+            "node_id": self.node_id,
+            "hop_limit": self.hop_limit,
+            "pending": len(self.pending),
+            "stats": dict(self.stats),
+            "neighbors": {f"{node:04X}": n for node, n in self.neighbors.recent().items()},
+        }
+
+    def stop(self):
+        with self.wakeup:
+            self.running = False
+            self.wakeup.notify()
+        if self._thread:
+            self._thread.join()
@@ -0,0 +1,200 @@
+# sim_radio.py
+
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from radio import SNR_LIMIT, Radio, airtime
+
+NOISE_FIGURE_DB = 6.0
+
+
+class SimChannel:
+    def __init__(self, loss: float = 0.0, path_loss_exponent: float = 2.7, reference_loss_db: float = 40.0,
+                 shadowing_db: float = 0.0, duty_cycle: float = 0.01, duty_window: float = 3600.0,
+                 time_scale: float = 0.0, seed: int = None):
+        """
+        Shared medium for simulated radios.
+        Each transmission is heard by every other node in RX mode on the same
+        frequency/SF/bandwidth whose SNR, from a log-distance path-loss model,
+        clears the SF's demodulation floor, minus a random `loss` fraction.
+        Airtime and duty-cycle waits run on a virtual clock per node and are
+        slept for real only when time_scale > 0 (1.0 = real time).
+        """
+        self.loss = loss
+        self.path_loss_exponent = path_loss_exponent
+        self.reference_loss_db = reference_loss_db
+        self.shadowing_db = shadowing_db
+        self.duty_cycle = duty_cycle
+        self.duty_window = duty_window
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.nodes = []
+        self.lock = threading.Lock()
+        self.stats = {"sent": 0, "delivered": 0, "lost": 0, "airtime": 0.0}
+
+    def add_node(self, position: tuple = (0.0, 0.0), **kwargs) -> "SimRadio":
+        radio = SimRadio(self, len(self.nodes), position, **kwargs)
+        with self.lock:
+            self.nodes.append(radio)
+        return radio
+
+    def link(self, sender: "SimRadio", receiver: "SimRadio") -> tuple:
+        """
+        Returns (rssi, snr) in dB for one packet from sender to receiver.
+        """
+        distance = max(math.dist(sender.position, receiver.position), 1.0)
+        path_loss = self.reference_loss_db + 10 * self.path_loss_exponent * math.log10(distance)
+        if self.shadowing_db:
+            path_loss += self.random.gauss(0.0, self.shadowing_db)
+        rssi = sender.tx_power - path_loss
+        noise_floor = -174 + 10 * math.log10(receiver.bandwidth) + NOISE_FIGURE_DB
+        return rssi, rssi - noise_floor
+
+    def transmit(self, sender: "SimRadio", data: bytes, arrival: float):
+        with self.lock:
+            receivers = [n for n in self.nodes if n is not sender]
+            self.stats["sent"] += 1
+        for node in receivers:
+            if (node.mode != "rx" or node.frequency != sender.frequency
+                    or node.spreading_factor != sender.spreading_factor
+                    or node.bandwidth != sender.bandwidth):
+                continue
+            rssi, snr = self.link(sender, node)
+            with self.lock:
+                dropped = snr < SNR_LIMIT.get(node.spreading_factor, -20.0) or self.random.random() < self.loss
+                self.stats["lost" if dropped else "delivered"] += 1
+            if not dropped:
+                node._deliver(bytes(data), rssi, snr, arrival)
+
+
+def mesh(nodes: int, spacing: float = 50.0, **channel_kwargs) -> tuple:
+    """
+    Builds a loopback mesh of `nodes` simulated radios placed on a line
+    `spacing` metres apart. Returns (channel, radios).
+    """
+    channel = SimChannel(**channel_kwargs)
+    radios = [channel.add_node((i * spacing, 0.0)) for i in range(nodes)]
+    return channel, radios
+
+
+class SimRadio(Radio):
+    def __init__(self, channel: SimChannel, node_id: int, position: tuple = (0.0, 0.0),
+                 frequency: float = 433, spreading_factor: int = 7, bandwidth: int = 125000,
+                 coding_rate: int = 5, tx_power: int = 14):
+        """
+        One simulated SX127x. Implements the pyLoRa interface plus the
+        parameter setters and packet RSSI/SNR getters the hardware exposes.
+        """
+        self.channel = channel
+        self.node_id = node_id
+        self.position = position
+        self.frequency = frequency
+        self.spreading_factor = spreading_factor
+        self.bandwidth = bandwidth
+        self.coding_rate = coding_rate
+        self.tx_power = tx_power
+        self.mode = "standby"
+        self.clock = 0.0             # virtual time this node is busy until
+        self.airtime_used = deque()  # (virtual start, airtime) inside duty window
+        self.rx_buffer = deque()
+        self.last_rssi = None
+        self.last_snr = None
+        self.irq = None
+
+    # pyLoRa interface
+
+    def reset(self):
+        self.mode = "standby"
+        self.rx_buffer.clear()
+
+    def set_frequency(self, mhz: float):
+        self.frequency = mhz
+
+    def set_tx_power(self, dbm: int):
+        self.tx_power = dbm
+
+    def set_spreading_factor(self, sf: int):
+        self.spreading_factor = sf
+
+    def set_bandwidth(self, hz: int):
+        self.bandwidth = hz
+
+    def set_coding_rate(self, denominator: int):
+        self.coding_rate = denominator
+
+    def set_mode_rx(self):
+        self.mode = "rx"
+
+    def set_mode_tx(self):
+        self.mode = "tx"
+
+    def attach_irq(self, callback):
+        """
+        Calls callback() on RX-done and TX-done, like a DIO0 edge.
+        """
+        self.irq = callback
+
+    def airtime(self, payload_len: int) -> float:
+        return airtime(payload_len, self.spreading_factor, self.bandwidth, self.coding_rate)
+
+    def duty_wait(self, duration: float) -> float:
+        """
+        Virtual seconds to wait before `duration` of airtime fits into the
+        duty-cycle budget of the sliding window.
+        """
+        budget = self.channel.duty_cycle * self.channel.duty_window
+        start = self.clock
+        while self.airtime_used and self.airtime_used[0][0] + self.channel.duty_window <= start:
+            self.airtime_used.popleft()
+        used = sum(t for _, t in self.airtime_used)
+        for window_start, t in self.airtime_used:
+            if used + duration <= budget:
+                break
+            used -= t
+            start = window_start + self.channel.duty_window
+        return start - self.clock
+
+    def send(self, data: bytes):
+        duration = self.airtime(len(data))
+        wait = self.duty_wait(duration) if self.channel.duty_cycle < 1.0 else 0.0
+        start = self.clock + wait
+        self.clock = start + duration
+        self.airtime_used.append((start, duration))
+        with self.channel.lock:
+            self.channel.stats["airtime"] += duration
+        if self.channel.time_scale:
+            time.sleep((wait + duration) * self.channel.time_scale)
+        self.channel.transmit(self, data, self.clock)
+        if self.irq:
+            self.irq()
+
+    def receive(self) -> bool:
+        return bool(self.rx_buffer)
+
+    def read(self) -> bytes:
+        data, self.last_rssi, self.last_snr = self.rx_buffer.popleft()
+        return data
+
+    def read_into(self, buffer) -> int:
+        data, self.last_rssi, self.last_snr = self.rx_buffer.popleft()
+        length = min(len(data), len(buffer))
+        buffer[:length] = data[:length]
+        return len(data)
+
+    def packet_rssi(self):
+        return self.last_rssi
+
+    def packet_snr(self):
+        return self.last_snr
+
+    def close(self):
+        self.mode = "sleep"
+
+    def _deliver(self, data: bytes, rssi: float, snr: float, arrival: float):
+        self.clock = max(self.clock, arrival)
+        self.rx_buffer.append((data, rssi, snr))
+        if self.irq:
+            self.irq()
@@ -1,116 +1,132 @@
 import time
-import json
 from pathlib import Path
-from parser import Parser
+from message_log import MessageLog
+from reassembly import Reassembler
+from dedup import DedupCache
+import compression
+import metrics
+from logs import get_logger
 
-try:
-    import aiofiles
-except ImportError:
-    aiofiles = None  # Fallback if async isn't required
+log = get_logger("stream")
 
 
 class MessageStream:
-    def __init__(self, timeout=60):
+    def __init__(self, timeout=60, log: MessageLog = None, persist_path: Path = None):
         """
         Handles chunked LoRa message reassembly and storage.
+        Completed messages are appended to the shared MessageLog.
+        Partial messages live in memory; pass persist_path to snapshot them
+        to disk (batched) so they survive a restart. Recently stored
+        messages are remembered so a repeat is never stored twice; older
+        ones are checked with `known(key)` when set (history sync re-sends
+        messages long after they were first heard).
         """
         self._path = Path("backend/messages/messages.json")
-        self.buffers = {}  # {sender: {"timestamp": last_updated, "chunks": {id: message}, "batch": total}}
+        self.log = log if log is not None else MessageLog(self._path.parent / "log", legacy_path=self._path)
         self.timeout = timeout  # Timeout in seconds for incomplete messages
+        self.reassembler = Reassembler(timeout=timeout, persist_path=persist_path)
+        self.completed = DedupCache("message")
+        self.known = None
+        metrics.gauge("hde_partial_messages", "Messages waiting for missing chunks",
+                      fn=lambda: len(self.reassembler))
+
+    @property
+    def buffers(self) -> dict:
+        """
+        Partial messages keyed by (sender, batch).
+        """
+        return self.reassembler.partials
 
-    def add_chunk(self, sender: str, chunk_id: int, chunk_batch: int, message: str, timestamp: int):
+    def add_chunk(self, sender: str, chunk_id: int, chunk_batch: int, data: bytes, timestamp: int,
+                  chunk_count: int = 1, parity: tuple = None):
         """
         Adds a chunk to the buffer and attempts reassembly.
         Returns:
             - None if still incomplete
-            - Assembled message (string) if complete
-        """
-        if sender not in self.buffers:
-            self.buffers[sender] = {
-                "timestamp": time.time(),
-                "chunks": {},
-                "batch": chunk_batch
-            }
-
-        buf = self.buffers[sender]
-        buf["chunks"][chunk_id] = message
-        buf["timestamp"] = time.time()
-
-        if Parser.is_message_complete(buf["chunks"], buf["batch"]):
-            full_message = Parser.reassemble_chunks(buf["chunks"], buf["batch"])
-            del self.buffers[sender]
-            return full_message
-
-        return None
+            - Assembled message bytes if complete
+        """
+        partial = self.reassembler.add(sender, chunk_batch, chunk_id, chunk_count, data, timestamp,
+                                       parity=parity)
+        return partial.payload() if partial is not None else None
 
     def cleanup(self):
         """
         Removes old/incomplete messages past timeout threshold.
-        Should be called periodically.
+        Called on every chunk; may also be called periodically.
         """
-        now = time.time()
-        expired = [k for k, v in self.buffers.items() if now - v["timestamp"] > self.timeout]
-        for key in expired:
-            del self.buffers[key]
+        self.reassembler.expire()
 
-    def load_messages(self):
+    def receive_frame(self, parsed):
         """
-        Loads messages synchronously.
+        Stores a frame decoded by Parser.parse_message (a ParsedFrame).
+        Returns (seq, entry) once the frame yields a complete message,
+        otherwise None. Text is decoded here, once per stored message.
         """
-        if not self._path.is_file():
-            return []
-        with self._path.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        if not parsed.valid:
+            return None
+
+        # Batch ids wrap, so the send timestamp is part of a message's identity
+        key = (parsed.sender, parsed.batch, parsed.timestamp)
+        if parsed.chunk_count > 1:
+            if self.completed.contains(key) or (self.known is not None and self.known(key)):
+                # Late retransmission of a message already stored
+                return None
+            # The payload may be a view of the radio buffer; the chunk is kept
+            data = self.add_chunk(parsed.sender, parsed.chunk_id, parsed.batch, bytes(parsed.payload),
+                                  parsed.timestamp, parsed.chunk_count, parsed.parity)
+            if data is None:
+                return None
+            if parsed.compressed:
+                try:
+                    data = compression.decompress(data)
+                except ValueError as e:
+                    log.warning("Dropping batch %s from %s: %s", parsed.batch, parsed.sender, e)
+                    return None
+            chunk_id = 1
+        else:
+            data = parsed.payload
+            chunk_id = parsed.chunk_id
+
+        if self.completed.seen(key) or (self.known is not None and self.known(key)):
+            return None
+        entry = {
+            "from": parsed.sender,
+            "timestamp": parsed.timestamp,
+            "chunk_batch": parsed.batch,
+            "chunk": [{"id": chunk_id, "message": str(data, "utf-8", "replace")}]
+        }
+        return self.log.append(entry), entry
 
-    def save_message(self, sender: str, message: str, timestamp: int):
+    def load_messages(self):
         """
-        Saves a fully reassembled message synchronously.
+        Loads messages synchronously.
         """
-        self._path.parent.mkdir(parents=True, exist_ok=True)
+        return self.log.read()
 
-        new_entry = {
+    @staticmethod
+    def _entry(sender: str, message: str, timestamp: int) -> dict:
+        return {
             "from": sender,
             "message": message,
             "timestamp": timestamp,
             "timestamp_human": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp))
         }
 
-        messages = self.load_messages()
-        messages.append(new_entry)
-
-        with self._path.open("w", encoding="utf-8") as f:
-            json.dump(messages, f, indent=2)
-
+    def save_message(self, sender: str, message: str, timestamp: int):
+        """
+        Saves a fully reassembled message synchronously.
+        """
+        new_entry = self._entry(sender, message, timestamp)
+        self.log.append(new_entry)
         return new_entry
 
-    # Optional async versions if aiofiles is available
     async def load_messages_async(self):
-        if not aiofiles or not self._path.is_file():
-            return []
-        async with aiofiles.open(self._path, "r", encoding="utf-8") as f:
-            content = await f.read()
-            return json.loads(content)
+        return await self.log.read_async()
 
     async def save_message_async(self, sender: str, message: str, timestamp: int):
         """
-        Saves a fully reassembled message asynchronously using aiofiles.
+        Saves a fully reassembled message without blocking the event loop.
         """
-        if not aiofiles:
-            raise RuntimeError("aiofiles is not available")
-
-        self._path.parent.mkdir(parents=True, exist_ok=True)
-
-        new_entry = {
-            "from": sender,
-            "message": message,
-            "timestamp": timestamp,
-            "timestamp_human": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(timestamp))
-        }
-
-        messages = await self.load_messages_async()
-        messages.append(new_entry)
-
-        async with aiofiles.open(self._path, "w", encoding="utf-8") as f:
-            await f.write(json.dumps(messages, indent=2))
-
+        new_entry = self._entry(sender, message, timestamp)
+        await self.log.append_async(new_entry)
         return new_entry
@@ -0,0 +1,561 @@
+# sync.py
+
+import hashlib
+import hmac
+import json
+import random
+import struct
+import threading
+import socket
+import time
+import urllib.parse
+import urllib.request
+from array import array
+from bisect import bisect_left, bisect_right
+
+import metrics
+from dedup import DedupCache
+from frame_codec import Frame, FrameCodec, FrameError, FLAG_SYNC, MAX_FRAME_SIZE
+from logs import get_logger
+from outbox import PRIORITY_BROADCAST
+
+log = get_logger("sync")
+
+# Summary tree over unix timestamps: the root spans 2^32 seconds and every
+# bucket splits into FANOUT equal buckets, down to one-second buckets.
+# A range is named by (start, shift): its children are 1 << shift wide.
+FANOUT_BITS = 4
+FANOUT = 1 << FANOUT_BITS
+ROOT = (0, 32 - FANOUT_BITS)
+ID_MASK = (1 << 64) - 1
+RADIO_MASK = (1 << 32) - 1  # radio frames carry the low 32 bits of ids and fingerprints
+
+# Limits on one HTTP request, so a peer cannot ask for unbounded work
+MAX_RANGES = 256
+MAX_FETCH = 500
+
+# Radio payloads: kind, then a SUMMARY (header and buckets) or a HAVE (header and ids)
+SYNC_KIND = struct.Struct("!B")
+SUMMARY_HEADER = struct.Struct("!BI")  # child shift, range start
+SUMMARY_BUCKET = struct.Struct("!BHI")  # child index, message count, fingerprint
+HAVE_HEADER = struct.Struct("!BII")  # flags, range start, range end
+HAVE_ID = struct.Struct("!I")
+KIND_SUMMARY = 1
+KIND_HAVE = 2
+HAVE_REPLY = 0x01  # answers a HAVE; never answered itself
+HAVE_PARTIAL = 0x02  # more ids than fit one frame: the list is not complete
+
+SYNCED = {direction: metrics.counter("hde_sync_messages_total", "Messages exchanged by history sync",
+                                     {"direction": direction})
+          for direction in ("sent", "received")}
+
+
+def message_key(entry) -> tuple:
+    """
+    (sender, batch, timestamp): what identifies a message on every node,
+    as in stream.MessageStream. None for entries that are not messages.
+    """
+    if not isinstance(entry, dict):
+        return None
+    try:
+        timestamp = int(entry.get("timestamp") or 0)
+        batch = int(entry.get("chunk_batch") or entry.get("batch") or 0)
+    except (TypeError, ValueError):
+        return None
+    return entry.get("from"), batch, timestamp
+
+
+def message_id(sender, batch: int, timestamp: int) -> int:
+    """
+    64-bit id of a message, the same on every node.
+    """
+    digest = hashlib.blake2b(f"{sender}\x00{batch}\x00{timestamp}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class SyncIndex:
+    def __init__(self):
+        """
+        Message ids of the log in timestamp order, for range fingerprints:
+        the count and the sum (mod 2^64) of the ids in a time range. Sums
+        do not depend on order, so two nodes holding the same messages
+        agree however they got them, and ids arriving late (from a sync)
+        just slot in. Built by catch_up() and kept current with add().
+        """
+        self.lock = threading.Lock()
+        self._stamps = array("q")
+        self._ids = array("Q")
+        self._seqs = {}  # id -> log seq
+        self.next_seq = 0
+
+    def __len__(self) -> int:
+        return len(self._seqs)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._seqs
+
+    def knows(self, key: tuple) -> bool:
+        """
+        True if the message with this message_key is in the log.
+        """
+        return message_id(*key) in self._seqs
+
+    def add(self, seq: int, entry) -> bool:
+        """
+        Adds a log entry; False if it is not a message or already known.
+        """
+        key = message_key(entry)
+        with self.lock:
+            self.next_seq = max(self.next_seq, seq + 1)
+            if key is None:
+                return False
+            mid = message_id(*key)
+            if mid in self._seqs:
+                return False
+            self._seqs[mid] = seq
+            timestamp = key[2]
+            if not self._stamps or timestamp >= self._stamps[-1]:
+                self._stamps.append(timestamp)
+                self._ids.append(mid)
+            else:
+                i = bisect_right(self._stamps, timestamp)
+                self._stamps.insert(i, timestamp)
+                self._ids.insert(i, mid)
+            return True
+
+    def catch_up(self, message_log, batch: int = 1000) -> int:
+        """
+        Adds whatever the log holds beyond the index. Cheap when the two
+        are in sync. Returns the number of entries read.
+        """
+        read = 0
+        while self.next_seq < message_log.generation:
+            start = self.next_seq
+            entries, _ = message_log.read_cursor(start, batch)
+            if not entries:
+                break
+            for seq, entry in enumerate(entries, start=start):
+                self.add(seq, entry)
+            read += len(entries)
+        return read
+
+    def _span(self, lo: int, hi: int) -> tuple:
+        return bisect_left(self._stamps, lo), bisect_left(self._stamps, hi)
+
+    def buckets(self, start: int, shift: int) -> dict:
+        """
+        {child index: (count, fingerprint)} for the non-empty children of
+        the range (start, shift).
+        """
+        result = {}
+        width = 1 << shift
+        with self.lock:
+            i = bisect_left(self._stamps, start)
+            for child in range(FANOUT):
+                if i == len(self._stamps):
+                    break
+                j = bisect_left(self._stamps, start + (child + 1) * width, i)
+                if j > i:
+                    result[child] = (j - i, sum(self._ids[i:j]) & ID_MASK)
+                i = j
+        return result
+
+    def ids(self, lo: int, hi: int) -> list:
+        with self.lock:
+            i, j = self._span(lo, hi)
+            return list(self._ids[i:j])
+
+    def seqs(self, ids) -> list:
+        """
+        Log sequence numbers of the known ids among `ids`.
+        """
+        return [self._seqs[mid] for mid in ids if mid in self._seqs]
+
+
+# ------------------------------------------------------------------- HTTP
+
+def _ranges(body) -> list:
+    """
+    The validated integer pairs of a request's "ranges".
+    Raises ValueError for a malformed one.
+    """
+    ranges = body.get("ranges") if isinstance(body, dict) else None
+    if not isinstance(ranges, list) or len(ranges) > MAX_RANGES:
+        raise ValueError(f"`ranges` must be a list of at most {MAX_RANGES} pairs")
+    result = []
+    for item in ranges:
+        if not isinstance(item, list) or len(item) != 2 or not all(isinstance(v, int) for v in item):
+            raise ValueError(f"Malformed range: {item!r}")
+        result.append(tuple(item))
+    return result
+
+
+def summary_body(index: SyncIndex, body: dict) -> dict:
+    """
+    Answers a summary request {"ranges": [[start, shift], ...]} with the
+    non-empty child buckets of each range as [index, count, fingerprint].
+    """
+    result = []
+    for start, shift in _ranges(body):
+        if not 0 <= shift <= ROOT[1] or not 0 <= start < 1 << 32:
+            raise ValueError(f"Range out of bounds: {start}/{shift}")
+        result.append([[child, count, f"{fp:016x}"] for child, (count, fp) in index.buckets(start, shift).items()])
+    return {"buckets": result}
+
+
+def ids_body(index: SyncIndex, body: dict) -> dict:
+    """
+    Answers an ids request {"ranges": [[lo, hi], ...]} with the message
+    ids in each time range.
+    """
+    return {"ids": [[f"{mid:016x}" for mid in index.ids(lo, hi)] for lo, hi in _ranges(body)]}
+
+
+def parse_ids(values) -> list:
+    """
+    Raises ValueError for anything but a list of hex ids.
+    """
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError("`ids` must be a list of hex strings")
+    return [int(v, 16) for v in values]
+
+
+def peer_origin(url: str) -> str:
+    """
+    "scheme://host:port" of a peer URL, lowercased. Raises ValueError for
+    anything but an http(s) URL with a host.
+    """
+    parts = urllib.parse.urlsplit(str(url).strip())
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ValueError("Sync peers must be http(s) URLs")
+    port = parts.port or (443 if parts.scheme.lower() == "https" else 80)
+    return f"{parts.scheme.lower()}://{parts.hostname.lower()}:{port}"
+
+
+def peer_addresses(urls) -> set:
+    """
+    IP addresses the hosts of the given peer URLs resolve to; hosts that
+    do not resolve are left out.
+    """
+    addresses = set()
+    for url in urls:
+        host = urllib.parse.urlsplit(url).hostname
+        try:
+            addresses.update(info[4][0] for info in socket.getaddrinfo(host, None))
+        except OSError:
+            continue
+    return addresses
+
+
+def token_matches(token: str, authorization: str) -> bool:
+    """
+    Whether an Authorization header carries `token` as a bearer token.
+    """
+    return bool(token) and hmac.compare_digest((authorization or "").encode("utf-8"),
+                                               f"Bearer {token}".encode("utf-8"))
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None  # a redirect could point anywhere; fail the request instead
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+class HttpPeer:
+    def __init__(self, url: str, timeout: float = 10.0, token: str = None):
+        """
+        Another gateway's /api/sync endpoints, for reconcile() and
+        exchange() over a LAN. Only http(s) URLs are accepted and
+        redirects are not followed; `token` is sent as a bearer token.
+        """
+        peer_origin(url)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.token = token
+        self.stats = {"requests": 0, "bytes_sent": 0, "bytes_received": 0}
+
+    def _post(self, path: str, body: dict) -> dict:
+        data = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        request = urllib.request.Request(self.url + path, data=data, headers=headers)
+        with _opener.open(request, timeout=self.timeout) as response:
+            raw = response.read()
+        self.stats["requests"] += 1
+        self.stats["bytes_sent"] += len(data)
+        self.stats["bytes_received"] += len(raw)
+        return json.loads(raw)
+
+    def summary(self, ranges: list) -> list:
+        body = self._post("/api/sync/summary", {"ranges": [list(r) for r in ranges]})
+        return [{child: (count, int(fp, 16)) for child, count, fp in buckets} for buckets in body["buckets"]]
+
+    def ids(self, ranges: list) -> list:
+        body = self._post("/api/sync/ids", {"ranges": [list(r) for r in ranges]})
+        return [parse_ids(ids) for ids in body["ids"]]
+
+    def fetch(self, ids: list) -> list:
+        return self._post("/api/sync/fetch", {"ids": [f"{mid:016x}" for mid in ids]})["data"]
+
+    def push(self, entries: list) -> int:
+        return self._post("/api/sync/push", {"data": entries})["stored"]
+
+
+def reconcile(index: SyncIndex, peer, leaf: int = 32) -> tuple:
+    """
+    Walks the summary tree against `peer` (an HttpPeer or anything with
+    its summary and ids methods), descending only into buckets whose
+    fingerprints differ; buckets of at most `leaf` messages are settled
+    by comparing ids. One round trip per tree level.
+    Returns (ids only the peer has, ids only we have).
+    """
+    want, offer = [], []
+    pending = [ROOT]
+    while pending:
+        deeper, leaves = [], []
+        for (start, shift), theirs in zip(pending, peer.summary(pending)):
+            ours = index.buckets(start, shift)
+            for child in sorted(set(ours) | set(theirs)):
+                if ours.get(child) == theirs.get(child):
+                    continue
+                lo = start + (child << shift)
+                hi = lo + (1 << shift)
+                if child not in theirs:
+                    offer.extend(index.ids(lo, hi))
+                elif child not in ours or shift == 0 or theirs[child][0] <= leaf:
+                    leaves.append((lo, hi))
+                else:
+                    deeper.append((lo, shift - FANOUT_BITS))
+        for i in range(0, len(leaves), MAX_RANGES):
+            batch = leaves[i:i + MAX_RANGES]
+            for (lo, hi), theirs in zip(batch, peer.ids(batch)):
+                ours = index.ids(lo, hi)
+                theirs = set(theirs)
+                want.extend(mid for mid in theirs if mid not in index)
+                offer.extend(mid for mid in ours if mid not in theirs)
+        pending = deeper[:MAX_RANGES]
+        if len(deeper) > MAX_RANGES:
+            # Rare (many scattered differences): the rest waits for the next sync
+            log.info("Deferring %d differing buckets to the next sync", len(deeper) - MAX_RANGES)
+    return want, offer
+
+
+def exchange(index: SyncIndex, peer, read, store, leaf: int = 32) -> dict:
+    """
+    Two-way sync with `peer`: fetches what it has and we lack, stored with
+    store(entries) -> count stored, and pushes what it lacks, read with
+    read(ids) -> entries.
+    """
+    started = time.perf_counter()
+    want, offer = reconcile(index, peer, leaf)
+    received = sent = 0
+    for i in range(0, len(want), MAX_FETCH):
+        received += store(peer.fetch(want[i:i + MAX_FETCH]))
+    for i in range(0, len(offer), MAX_FETCH):
+        sent += peer.push(read(offer[i:i + MAX_FETCH]))
+    SYNCED["received"].inc(received)
+    SYNCED["sent"].inc(sent)
+    log.info("Synced with %s in %.2f s: %d received, %d sent", getattr(peer, "url", peer), time.perf_counter() - started,
+             received, sent)
+    return {"received": received, "sent": sent, "missing_here": len(want), "missing_there": len(offer)}
+
+
+# ------------------------------------------------------------------ radio
+
+def encode_summary(node: str, seq: int, start: int, shift: int, buckets: dict) -> bytes:
+    payload = [SYNC_KIND.pack(KIND_SUMMARY), SUMMARY_HEADER.pack(shift, start)]
+    for child, (count, fp) in sorted(buckets.items()):
+        payload.append(SUMMARY_BUCKET.pack(child, min(count, 0xFFFF), fp & RADIO_MASK))
+    frame = Frame(node, seq, 0, 0, int(time.time()), b"".join(payload), flags=FLAG_SYNC)
+    return FrameCodec.encode_binary(frame)
+
+
+def decode_summary(payload) -> tuple:
+    """
+    Returns (start, shift, {child: (count, fingerprint)}) of a SUMMARY
+    payload. Raises ValueError for one that is out of bounds.
+    """
+    shift, start = SUMMARY_HEADER.unpack_from(payload, SYNC_KIND.size)
+    if shift > ROOT[1] or shift % FANOUT_BITS:
+        raise ValueError(f"Bad summary shift {shift}")
+    buckets = {}
+    for offset in range(SYNC_KIND.size + SUMMARY_HEADER.size, len(payload) - SUMMARY_BUCKET.size + 1,
+                        SUMMARY_BUCKET.size):
+        child, count, fp = SUMMARY_BUCKET.unpack_from(payload, offset)
+        buckets[child] = (count, fp)
+    return start, shift, buckets
+
+
+def encode_have(node: str, seq: int, lo: int, hi: int, ids: list, flags: int = 0) -> bytes:
+    payload = [SYNC_KIND.pack(KIND_HAVE), HAVE_HEADER.pack(flags, lo, hi)]
+    payload.extend(HAVE_ID.pack(mid & RADIO_MASK) for mid in ids)
+    frame = Frame(node, seq, 0, 0, int(time.time()), b"".join(payload), flags=FLAG_SYNC)
+    return FrameCodec.encode_binary(frame)
+
+
+def decode_have(payload) -> tuple:
+    """
+    Returns (flags, lo, hi, set of 32-bit ids) of a HAVE payload.
+    """
+    flags, lo, hi = HAVE_HEADER.unpack_from(payload, SYNC_KIND.size)
+    start = SYNC_KIND.size + HAVE_HEADER.size
+    ids = {HAVE_ID.unpack_from(payload, offset)[0]
+           for offset in range(start, len(payload) - HAVE_ID.size + 1, HAVE_ID.size)}
+    return flags, lo, hi, ids
+
+
+class RadioSync:
+    def __init__(self, node: str, engine, index: SyncIndex, read, send, interval: float = 600.0,
+                 leaf: int = 32, holdoff: float = 30.0, max_replies: int = 4, max_push: int = 8,
+                 max_size: int = MAX_FRAME_SIZE):
+        """
+        History sync over LoRa, for gateways that only meet by radio.
+        Every `interval` seconds (jittered) the node broadcasts a SUMMARY of
+        its history: bucket counts and 32-bit fingerprints, skipping down
+        through levels where it has a single bucket. A node whose buckets
+        differ answers with finer SUMMARY frames for those buckets and,
+        once a bucket holds at most `leaf` messages, a HAVE frame listing
+        the 32-bit ids of its messages there. A node that learns a peer
+        lacks messages re-sends them, at most max_push per frame heard,
+        as ordinary message frames: send(entry) for each of read(ids).
+        At most max_replies frames answer one frame, and the same answer
+        or message goes out at most once per `holdoff` seconds however
+        many nodes ask for it. HAVE frames stay within max_size.
+        """
+        self.node = node
+        self.engine = engine
+        self.index = index
+        self.read = read
+        self.send = send
+        self.interval = interval
+        self.leaf = leaf
+        self.max_replies = max_replies
+        self.max_push = max_push
+        self.answered = DedupCache("sync", max_entries=1024, window=holdoff)
+        self.max_ids = (max_size - FrameCodec.header_size(node) - SYNC_KIND.size
+                        - HAVE_HEADER.size) // HAVE_ID.size
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"summaries_sent": 0, "haves_sent": 0, "messages_pushed": 0, "frames_heard": 0}
+
+    def _queue(self, frame: bytes):
+        self.engine.queue_message(frame, PRIORITY_BROADCAST, durable=False)
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFFFF
+        return self._seq
+
+    def send_summary(self, start: int, shift: int, descend: bool = False):
+        """
+        Broadcasts the buckets of the range (start, shift). With `descend`,
+        levels where we hold a single bucket are skipped: a peer with
+        messages outside it shows them in its own summary.
+        """
+        buckets = self.index.buckets(start, shift)
+        while descend and shift >= FANOUT_BITS and len(buckets) == 1:
+            (child, (count, _)), = buckets.items()
+            if count <= self.leaf:
+                break
+            start, shift = start + (child << shift), shift - FANOUT_BITS
+            buckets = self.index.buckets(start, shift)
+        self._queue(encode_summary(self.node, self._next_seq(), start, shift, buckets))
+        self.stats["summaries_sent"] += 1
+
+    def send_have(self, lo: int, hi: int, reply: bool = False):
+        ids = self.index.ids(lo, hi)
+        flags = HAVE_REPLY if reply else 0
+        if len(ids) > self.max_ids:
+            ids = ids[-self.max_ids:]
+            flags |= HAVE_PARTIAL
+        self._queue(encode_have(self.node, self._next_seq(), lo, hi, ids, flags))
+        self.stats["haves_sent"] += 1
+
+    def push(self, ids: list):
+        """
+        Re-sends messages a peer lacks, newest first, skipping any sent
+        within the holdoff.
+        """
+        ids = [mid for mid in reversed(ids) if not self.answered.seen(("push", mid))][:self.max_push]
+        for entry in self.read(ids):
+            self.send(entry)
+            self.stats["messages_pushed"] += 1
+            SYNCED["sent"].inc()
+
+    # ---------------------------------------------------------------- receive
+
+    def handle_control(self, raw) -> bool:
+        """
+        Consumes sync frames; returns False for anything else.
+        """
+        if not FrameCodec.peek_flags(raw) & FLAG_SYNC:
+            return False
+        try:
+            frame = FrameCodec.decode_binary(raw)
+            if frame.sender == self.node:
+                return True
+            (kind,) = SYNC_KIND.unpack_from(frame.payload)
+            self.stats["frames_heard"] += 1
+            if kind == KIND_SUMMARY:
+                self._on_summary(*decode_summary(frame.payload))
+            elif kind == KIND_HAVE:
+                self._on_have(*decode_have(frame.payload))
+        except (FrameError, struct.error, ValueError) as e:
+            log.debug("Dropped sync frame: %s", e)
+        return True
+
+    def _on_summary(self, start: int, shift: int, theirs: dict):
+        ours = {child: (min(count, 0xFFFF), fp & RADIO_MASK)
+                for child, (count, fp) in self.index.buckets(start, shift).items()}
+        replies = 0
+        for child in sorted(set(ours) | set(theirs)):
+            if ours.get(child) == theirs.get(child):
+                continue
+            if replies >= self.max_replies:
+                break
+            lo = start + (child << shift)
+            hi = lo + (1 << shift)
+            if child not in theirs:
+                # They have nothing here: no need to compare
+                self.push(self.index.ids(lo, hi))
+            elif child not in ours or shift == 0 or max(ours[child][0], theirs[child][0]) <= self.leaf:
+                if self.answered.seen(("have", lo, hi)):
+                    continue
+                self.send_have(lo, hi)
+            else:
+                if self.answered.seen(("summary", lo, shift)):
+                    continue
+                self.send_summary(lo, shift - FANOUT_BITS)
+            replies += 1
+
+    def _on_have(self, flags: int, lo: int, hi: int, theirs: set):
+        ours = {mid & RADIO_MASK: mid for mid in self.index.ids(lo, hi)}
+        if not flags & HAVE_PARTIAL:
+            self.push([mid for short, mid in ours.items() if short not in theirs])
+        if not flags & HAVE_REPLY and not theirs <= ours.keys() and not self.answered.seen(("reply", lo, hi)):
+            # They have messages we lack: our list tells them which to send
+            self.send_have(lo, hi, reply=True)
+
+    # ----------------------------------------------------------------- beacon
+
+    def _run(self):
+        while not self._stop.wait(self.interval * random.uniform(0.75, 1.25)):
+            try:
+                self.send_summary(*ROOT, descend=True)
+            except Exception as e:
+                log.error("Sync beacon failed: %s", e)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def status(self) -> dict:
+        return {"messages": len(self.index), "interval": self.interval, "stats": dict(self.stats)}
@@ -0,0 +1,46 @@
+# conftest.py
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from gateway import Gateway  # noqa: E402
+from sim_radio import mesh  # noqa: E402
+
+
+def wait_for(predicate, timeout: float = 5.0) -> bool:
+    """
+    Polls predicate() until it holds or `timeout` seconds pass.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def gateways(tmp_path, monkeypatch):
+    """
+    gateways(n, **kwargs) opens n gateways on one simulated channel,
+    each with its own messages directory, and shuts them down afterwards.
+    Returns (channel, radios, gateways).
+    """
+    monkeypatch.chdir(tmp_path)
+    opened = []
+
+    def open_gateways(count: int = 2, **kwargs):
+        kwargs = {"index": False, "duty_cycle": 1.0, "adr": "off", "linger": 0, **kwargs}
+        channel, radios = mesh(count, duty_cycle=1.0)
+        for i, radio in enumerate(radios):
+            opened.append(Gateway(tmp_path / f"gw{i}", radio=radio, node_name=f"gw{i}", **kwargs))
+        return channel, radios, opened[-count:]
+
+    yield open_gateways
+    for gateway in opened:
+        gateway.shutdown()
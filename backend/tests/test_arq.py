@@ -0,0 +1,47 @@
+# test_arq.py
+
+from arq import RetransmitCache, SelectiveRepeat, decode_bitmap, decode_nack, encode_bitmap, encode_nack
+from frame_codec import FrameCodec
+from reassembly import Reassembler
+
+
+def test_bitmap_round_trip():
+    missing = [1, 8, 9, 200, 255]
+    bitmap = encode_bitmap(missing, 255)
+    assert len(bitmap) == 32
+    assert decode_bitmap(bitmap, 255) == missing
+    assert decode_nack(FrameCodec.decode_binary(encode_nack("rx", "tx", 7, 12, [3, 12]))) == ("tx", 7, [3, 12])
+
+
+def test_nack_is_answered_with_only_the_missing_chunks():
+    sent = []
+    arq = SelectiveRepeat("tx", Reassembler(), sent.append, cache=RetransmitCache(holdoff=0.0))
+    frames = [f"frame{i}".encode() for i in range(1, 6)]
+    arq.remember("tx", 7, frames)
+    assert arq.handle_control(encode_nack("rx", "tx", 7, 5, [2, 5]))
+    assert sent == [frames[1], frames[4]]
+    assert not arq.handle_control(frames[0])
+
+
+def test_repeated_nacks_count_each_loss_once():
+    lost = []
+    arq = SelectiveRepeat("tx", Reassembler(), lambda frame: None, on_nack=lost.append)
+    arq.remember("tx", 7, [b"a", b"b", b"c", b"d"])
+    arq.handle_control(encode_nack("rx", "tx", 7, 4, [2, 3]))
+    arq.handle_control(encode_nack("rx2", "tx", 7, 4, [2, 3]))  # another receiver, same chunks
+    arq.handle_control(encode_nack("rx", "tx", 7, 4, [3, 4]))
+    arq.handle_control(encode_nack("rx", "tx", 99, 4, [1]))  # not one of ours
+    assert lost == [2, 1]
+
+
+def test_stalled_partial_gets_a_nack():
+    reassembler = Reassembler()
+    sent = []
+    arq = SelectiveRepeat("rx", reassembler, sent.append, nack_delay=3.0)
+    reassembler.add("tx", 7, 1, 3, b"one", 1700000000, now=100.0)
+    arq.tick(now=101.0)
+    assert sent == []
+    arq.tick(now=104.0)
+    assert [decode_nack(FrameCodec.decode_binary(raw)) for raw in sent] == [("tx", 7, [2, 3])]
+    arq.tick(now=105.0)  # backs off before asking again
+    assert len(sent) == 1
@@ -0,0 +1,46 @@
+# test_compression.py
+
+import pytest
+
+import compression
+
+
+def test_round_trip():
+    data = "hello over the air, hello again ".encode() * 4
+    assert compression.decompress(compression.compress(data, 0)) == data
+
+
+@pytest.mark.parametrize("packed", [b"", memoryview(b""), b"\x00\xff\xff"])
+def test_bad_payload_raises_value_error(packed):
+    with pytest.raises(ValueError):
+        compression.decompress(packed)
+
+
+def test_bomb_is_rejected():
+    data = b"\x00" * (compression.MAX_DECOMPRESSED + 1)
+    packed = compression.compress(data, 0)
+    assert len(packed) < 100
+    with pytest.raises(ValueError):
+        compression.decompress(packed)
+    limit = b"\x00" * compression.MAX_DECOMPRESSED
+    assert compression.decompress(compression.compress(limit, 0)) == limit
+
+
+def test_truncated_stream_raises_value_error():
+    packed = compression.compress("hello over the air ".encode() * 8, 0)
+    with pytest.raises(ValueError):
+        compression.decompress(packed[:-2])
+
+
+def test_senders_keep_the_default_dictionary(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, "_dictionaries", dict(compression._dictionaries))
+    monkeypatch.setattr(compression, "_send_dictionary", compression.DEFAULT_DICTIONARY_ID)
+    (tmp_path / "7.bin").write_bytes(b"a trained dictionary only this node has ")
+    compression.load_dictionaries(tmp_path)
+
+    data = "we are safe. are you safe? we are safe. ".encode()
+    assert compression.compress(data)[0] == compression.DEFAULT_DICTIONARY_ID
+    compression.use_dictionary(7)
+    assert compression.compress(data)[0] == 7
+    with pytest.raises(ValueError):
+        compression.use_dictionary(9)
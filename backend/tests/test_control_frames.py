@@ -0,0 +1,50 @@
+# test_control_frames.py
+
+import time
+
+from conftest import wait_for
+from adr import BROADCAST, encode_adr
+from sync import ROOT, encode_have, encode_summary
+
+
+def test_adr_command_is_not_stored_with_adr_off(gateways):
+    _, _, (gateway,) = gateways(1, relay=True)
+    assert gateway.adr is None
+    gateway.handle_received_frame(encode_adr("coordinator", 1, BROADCAST, 9, 125000, 14))
+    assert len(gateway.message_log) == 0
+
+
+def test_sync_beacons_are_not_stored_with_lan_sync(gateways):
+    _, _, (gateway,) = gateways(1, sync="lan")
+    assert gateway.radio_sync is None
+    now = int(time.time())
+    gateway.handle_received_frame(encode_summary("peer", 1, ROOT[0], ROOT[1], {3: (12, 0xBEEF)}))
+    gateway.handle_received_frame(encode_have("peer", 2, now - 60, now, [1, 2, 3]))
+    assert len(gateway.message_log) == 0
+
+
+def test_adr_is_off_by_default(gateways, monkeypatch):
+    monkeypatch.delenv("HDE_ADR", raising=False)
+    _, _, (gateway,) = gateways(1, adr=None)
+    assert gateway.adr_mode == "off"
+
+
+def test_followers_obey_only_their_coordinator(gateways):
+    _, _, (gateway,) = gateways(1, adr="follow", adr_coordinators=["hq"])
+    adr = gateway.adr
+    settings = dict(gateway.lora_engine.settings)
+    gateway.handle_received_frame(encode_adr("rogue", 1, BROADCAST, 12, 125000, 14))
+    assert adr.stats["commands_ignored"] == 1
+    assert adr.stats["commands_applied"] == 0
+
+    sf = 8 if settings["spreading_factor"] != 8 else 9
+    gateway.handle_received_frame(encode_adr("hq", 1, BROADCAST, sf, 125000, 14))
+    assert adr.stats["commands_applied"] == 1
+    assert wait_for(lambda: gateway.lora_engine.settings["spreading_factor"] == sf)
+    assert len(gateway.message_log) == 0
+
+
+def test_follow_without_a_coordinator_is_off(gateways, monkeypatch):
+    monkeypatch.delenv("HDE_ADR_COORDINATOR", raising=False)
+    _, _, (gateway,) = gateways(1, adr="follow")
+    assert gateway.adr is None
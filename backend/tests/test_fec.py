@@ -0,0 +1,59 @@
+# test_fec.py
+
+import itertools
+import random
+
+import pytest
+
+import fec
+from fec import FecPolicy
+from message_log import MessageLog
+from parser import Parser
+from stream import MessageStream
+
+
+def test_any_k_lost_blocks_are_recovered():
+    rng = random.Random(1)
+    blocks = [bytes(rng.randrange(256) for _ in range(32)) for _ in range(6)]
+    parity = dict(enumerate(fec.encode(blocks, 3)))
+    for lost in itertools.combinations(range(9), 3):
+        data = {i: block for i, block in enumerate(blocks) if i not in lost}
+        kept = {j: block for j, block in parity.items() if j + 6 not in lost}
+        assert fec.decode(data, kept, 6, 3, 32) == blocks
+
+
+def test_too_many_lost_blocks_raise():
+    blocks = [bytes([i]) * 8 for i in range(4)]
+    parity = dict(enumerate(fec.encode(blocks, 2)))
+    with pytest.raises(ValueError):
+        fec.decode({0: blocks[0]}, parity, 4, 2, 8)
+
+
+def test_message_is_rebuilt_without_its_lost_chunks(tmp_path):
+    rng = random.Random(2)
+    text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(1500))
+    frames = Parser.prepare_frames({"from": "gw0", "message": text, "chunk_id": 1, "chunk_batch": 7,
+                                    "timestamp": 1700000000}, binary=True, parity=lambda count: 3)
+    count = Parser.parse_message(frames[0]).chunk_count
+    assert len(frames) == count + 3
+
+    stream = MessageStream(log=MessageLog(tmp_path / "log"))
+    # Three data chunks lost on air, all parity chunks received
+    received = [frame for i, frame in enumerate(frames) if i not in (0, 2, count - 1)]
+    results = [stream.receive_frame(Parser.parse_message(frame)) for frame in received]
+    assert all(result is None for result in results[:-1])
+    _, entry = results[-1]
+    assert entry["chunk"][0]["message"] == text
+
+
+def test_parity_follows_the_observed_loss():
+    now = [0.0]
+    policy = FecPolicy(half_life=100.0, clock=lambda: now[0])
+    assert policy.parity(10) == 0
+    policy.observe(sent=100, lost=10)
+    parity = policy.parity(10)
+    assert parity > 0
+    assert FecPolicy.delivery(10, parity, 0.1) >= policy.target
+    now[0] = 10000.0
+    policy.observe(sent=100)
+    assert policy.parity(10) == 0
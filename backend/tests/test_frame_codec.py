@@ -0,0 +1,76 @@
+# test_frame_codec.py
+
+import pytest
+
+from frame_codec import (FLAG_COMPRESSED, MAX_SENDER_BYTES, ChecksumError, Frame, FrameCodec, FrameError, MeshHeader,
+                         sender_bytes)
+from gateway import Gateway
+
+
+def test_binary_round_trip():
+    frame = Frame("gw-1", 513, 3, 7, 1700000000, b"\x00payload\xff", flags=FLAG_COMPRESSED)
+    raw = FrameCodec.encode_binary(frame)
+    assert len(raw) == FrameCodec.header_size("gw-1") + len(frame.payload)
+    decoded = FrameCodec.decode(raw)
+    assert (decoded.sender, decoded.batch, decoded.chunk_id, decoded.chunk_count, decoded.timestamp,
+            bytes(decoded.payload), decoded.flags) == ("gw-1", 513, 3, 7, 1700000000, b"\x00payload\xff",
+                                                       FLAG_COMPRESSED)
+
+
+def test_text_round_trip():
+    frame = Frame("gw-1", 12, 2, 3, 1700000000, "a | pipe, ñ".encode("utf-8"), checksum="user:x")
+    decoded = FrameCodec.decode(FrameCodec.encode_text(frame))
+    assert (decoded.sender, decoded.batch, decoded.chunk_id, decoded.chunk_count, decoded.text(),
+            decoded.checksum) == ("gw-1", 12, 2, 3, "a | pipe, ñ", "user:x")
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_corrupted_frame_is_rejected(binary):
+    raw = bytearray(FrameCodec.encode(Frame("gw-1", 12, 1, 1, 1700000000, b"hello there"), binary))
+    raw[-5] ^= 0x01
+    with pytest.raises(ChecksumError):
+        FrameCodec.decode(bytes(raw))
+
+
+def test_truncated_and_unknown_frames_are_rejected():
+    raw = FrameCodec.encode_binary(Frame("gw-1", 12, 1, 1, 1700000000, b"hello"))
+    with pytest.raises(FrameError):
+        FrameCodec.decode_binary(raw[:4])
+    future = bytearray(raw[:-2])
+    future[0] = 0xC0 | 0x0F  # a frame version we do not speak
+    with pytest.raises(FrameError, match="version"):
+        FrameCodec.decode_binary(bytes(future) + FrameCodec.crc16(bytes(future)).to_bytes(2, "big"))
+
+
+def test_aggregate_and_mesh_envelopes_are_looked_through():
+    frames = [FrameCodec.encode_binary(Frame("gw-1", 12, i, 3, 1700000000, b"x" * i)) for i in range(1, 4)]
+    aggregate = FrameCodec.encode_aggregate(frames)
+    assert [bytes(f) for f in FrameCodec.split(aggregate)] == frames
+    wrapped = FrameCodec.encode_mesh(MeshHeader(3, 0, 1, 2, 1), frames[0])
+    assert FrameCodec.frame_key(wrapped) == FrameCodec.frame_key(frames[0])
+    assert FrameCodec.decode(wrapped).chunk_id == 1
+    damaged = bytearray(aggregate)
+    damaged[3] ^= 0xFF
+    with pytest.raises(ChecksumError):
+        FrameCodec.split(bytes(damaged))
+
+
+def test_long_sender_is_cut_on_a_code_point():
+    sender = "é" * 20  # 40 bytes; a 32-byte cut lands inside no character
+    assert FrameCodec.decode_binary(FrameCodec.encode_binary(Frame(sender, 1, 1, 1, 1700000000, b"x"))).sender \
+        == "é" * 16
+    sender = "a" + "日本" * 8  # 3-byte characters: a cut at 32 splits one
+    encoded = sender_bytes(sender)
+    assert len(encoded) <= MAX_SENDER_BYTES
+    decoded = FrameCodec.decode_binary(FrameCodec.encode_binary(Frame(sender, 1, 1, 1, 1700000000, b"x"))).sender
+    assert decoded == encoded.decode("utf-8") and sender.startswith(decoded)
+    assert FrameCodec.header_size(sender) == FrameCodec.header_size(decoded)
+
+
+def test_send_rejects_senders_too_long_for_a_frame(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False, binary_frames=True)
+    try:
+        with pytest.raises(ValueError):
+            gateway.send("ä" * 17, "hello", "0")
+    finally:
+        gateway.shutdown()
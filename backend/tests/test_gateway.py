@@ -0,0 +1,112 @@
+# test_gateway.py
+
+import sys
+
+from conftest import wait_for
+from gateway import DEFAULT_PAGE, MAX_PAGE, Gateway
+
+
+def test_start_without_radio(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("HDE_RADIO", "pylora")
+    monkeypatch.setitem(sys.modules, "pyLoRa", None)  # driver not installed
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False, adr="off", linger=0)
+    gateway.start()
+    try:
+        assert wait_for(gateway.ready.is_set)
+        status = gateway.status()
+        assert status["state"] == "error"
+        assert "pyLoRa" in status["error"]
+
+        entry = gateway.send("gw", "stored while the radio is down", "0")
+        body = gateway.read_messages("messages.json")
+        assert body["lora"] == "error"
+        assert [m["chunk_batch"] for m in body["data"]] == [entry["chunk_batch"]]
+        assert gateway.engine_state() == "error"
+        assert gateway.outbox.depth()
+    finally:
+        gateway.shutdown()
+
+
+def test_events_published_out_of_order_are_backfilled(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        entries = [{"from": "a", "timestamp": 1700000000 + i, "chunk_batch": i + 1,
+                    "chunk": [{"id": 1, "message": str(i)}]} for i in range(3)]
+        seqs = [gateway.message_log.append(entry) for entry in entries]
+        # seq 2 reaches the bus before seq 1
+        assert gateway.events_after(0, (seqs[2], entries[2])) == list(zip(seqs[1:], entries[1:]))
+        assert gateway.events_after(seqs[2], (seqs[1], entries[1])) == []
+        assert gateway.events_after(seqs[1], (seqs[2], entries[2])) == [(seqs[2], entries[2])]
+    finally:
+        gateway.shutdown()
+
+
+def test_message_log_is_served_in_pages(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        for i in range(MAX_PAGE + 10):
+            gateway.message_log.append({"from": "a", "timestamp": 1700000000 + i, "chunk_batch": i + 1,
+                                        "chunk": [{"id": 1, "message": "hi"}]}, sync=False)
+        body = gateway.read_messages("messages.json")
+        assert (len(body["data"]), body["next"], body["more"]) == (DEFAULT_PAGE, DEFAULT_PAGE, True)
+        body = gateway.read_messages("messages.json", since=5, limit=10 * MAX_PAGE)
+        assert (len(body["data"]), body["more"]) == (MAX_PAGE, True)
+        body = gateway.read_messages("messages.json", since=body["next"], limit=10 * MAX_PAGE)
+        assert (len(body["data"]), body["more"]) == (5, False)
+    finally:
+        gateway.shutdown()
+
+
+def test_ids_are_kept_per_gateway(gateways, tmp_path):
+    _, _, (first, second) = gateways(2)
+    first.send("gw0", "one", "0")
+    first.send("gw0", "two", "0")
+    entry = second.send("gw1", "three", "0")
+    assert entry["chunk_batch"] == 1
+    assert (first.messages_dir / "ids.json").exists()
+    assert (second.messages_dir / "ids.json").exists()
+    assert not (tmp_path / "messages").exists()
+
+
+def test_checksum_changes_with_the_log(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        before = gateway.checksum
+        gateway.message_log.append({"from": "a", "timestamp": 1700000000, "chunk_batch": 1,
+                                    "chunk": [{"id": 1, "message": "hi"}]})
+        assert gateway.checksum != before
+    finally:
+        gateway.shutdown()
+
+
+def test_corrupt_id_file_resumes_above_the_log(tmp_path, monkeypatch):
+    monkeypatch.setenv("HDE_RADIO", "sim")
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        batches = [gateway.send("gw", f"message {i}", "0")["chunk_batch"] for i in range(3)]
+    finally:
+        gateway.shutdown()
+    (tmp_path / "gw" / "ids.json").write_text('{"batch": ')  # torn write
+
+    reopened = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        assert reopened.send("gw", "after the crash", "0")["chunk_batch"] > max(batches)
+    finally:
+        reopened.shutdown()
+
+
+def test_etag_covers_the_page_and_engine_state(tmp_path, monkeypatch):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False)
+    try:
+        for i in range(3):
+            gateway.message_log.append({"from": "a", "timestamp": 1700000000 + i, "chunk_batch": i + 1,
+                                        "chunk": [{"id": 1, "message": str(i)}]})
+        etag = gateway.messages_etag("messages.json")
+        assert etag == gateway.messages_etag("messages.json", 0, DEFAULT_PAGE)
+        assert etag != gateway.messages_etag("messages.json", 1)
+        assert etag != gateway.messages_etag("messages.json", 0, 2)
+        monkeypatch.setattr(gateway, "engine_state", lambda: "transmit")
+        assert etag != gateway.messages_etag("messages.json")
+    finally:
+        gateway.shutdown()
@@ -0,0 +1,26 @@
+# test_id_allocator.py
+
+import pytest
+
+from id_allocator import IdAllocator
+
+
+def test_ids_resume_above_the_last_checkpoint(tmp_path):
+    path = tmp_path / "ids.json"
+    allocator = IdAllocator(path, block_size=4)
+    assert [allocator.reserve("batch") for _ in range(3)] == [1, 2, 3]
+    assert allocator.reserve("chunk", 5) == 1
+    reopened = IdAllocator(path, block_size=4)
+    assert reopened.reserve("batch") > 3
+    assert reopened.reserve("chunk") > 5
+
+
+def test_unreadable_file_needs_a_seed(tmp_path):
+    path = tmp_path / "ids.json"
+    path.write_text("not json")
+    with pytest.raises(ValueError):
+        IdAllocator(path)
+    assert IdAllocator(path, seed=lambda: {"batch": 41}).reserve("batch") == 42
+    # A missing file starts from the seed, or from 1
+    assert IdAllocator(tmp_path / "new.json", seed={"batch": 9}).reserve("batch") == 10
+    assert IdAllocator(tmp_path / "other.json").reserve("batch") == 1
@@ -0,0 +1,86 @@
+# test_lora_engine.py
+
+import time
+
+import metrics
+from conftest import wait_for
+from frame_ring import FIFO_SIZE
+from lora_engine import LoRaEngine
+from outbox import PRIORITY_BROADCAST
+from sim_radio import mesh
+
+
+def test_oversized_frame_does_not_stop_the_engine():
+    _, (sender, radio) = mesh(2, duty_cycle=1.0)
+    engine = LoRaEngine(radio=radio)
+    engine.set_state("receive")
+    try:
+        assert wait_for(lambda: radio.mode == "rx")
+        sender.send(bytes(FIFO_SIZE + 10))
+        sender.send(b"after")
+        assert wait_for(lambda: b"after" in engine.inbox)
+        assert engine.worker.is_alive()
+    finally:
+        engine.shutdown()
+
+
+def test_radio_error_does_not_stop_the_engine():
+    _, (radio, _) = mesh(2, duty_cycle=1.0)
+    sent = []
+    failures = [OSError("SPI timeout")]
+
+    def send(data):
+        if failures:
+            raise failures.pop()
+        sent.append(bytes(data))
+    radio.send = send
+    engine = LoRaEngine(radio=radio)
+    engine.set_state("receive")
+    try:
+        engine.queue_message(b"hello")
+        assert wait_for(lambda: sent == [b"hello"])
+    finally:
+        engine.shutdown()
+
+
+def test_radios_with_an_irq_line_are_not_polled():
+    _, (radio, other) = mesh(2, duty_cycle=1.0)
+    engine = LoRaEngine(radio=radio)
+    polled = []
+    receive = radio.receive
+    radio.receive = lambda: (polled.append(1), receive())[1]
+    engine.set_state("receive")
+    try:
+        assert engine.irq_driven
+        assert wait_for(lambda: radio.mode == "rx")
+        time.sleep(0.2)
+        assert len(polled) <= 2  # no 10 ms polling while the channel is quiet
+        other.send(b"hello")
+        assert wait_for(lambda: b"hello" in engine.inbox)
+    finally:
+        engine.shutdown()
+
+
+class HoldScheduler:
+    """
+    Duty-cycle scheduler whose budget never allows a frame out.
+    """
+    def delay(self, airtime: float) -> float:
+        return 60.0
+
+    def drain_time(self, airtime: float) -> float:
+        return 60.0 + airtime
+
+
+def test_queue_gauge_adds_up_every_engine():
+    _, radios = mesh(2, duty_cycle=1.0)
+    engines = [LoRaEngine(radio=radio, scheduler=HoldScheduler()) for radio in radios]
+    gauge = metrics.gauge("hde_tx_queue_depth", "Frames waiting to be transmitted")
+    try:
+        for engine in engines:
+            engine.outbox.put_many([b"a", b"b"], PRIORITY_BROADCAST, durable=False)
+        assert gauge.get() == 4
+    finally:
+        for engine in engines:
+            engine.shutdown()
+    assert gauge.get() == 0
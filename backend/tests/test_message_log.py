@@ -0,0 +1,109 @@
+# test_message_log.py
+
+import threading
+
+from message_log import MessageLog
+from test_parser import bitwise_crc32
+
+
+def entry(i: int) -> dict:
+    return {"from": f"node{i % 3}", "timestamp": 1700000000 + i, "chunk_batch": i + 1,
+            "chunk": [{"id": 1, "message": "x" * 50}]}
+
+
+def test_reads_across_segments(tmp_path):
+    log = MessageLog(tmp_path / "log", segment_max_bytes=1024)
+    entries = [entry(i) for i in range(100)]
+    for e in entries:
+        log.append(e, sync=False)
+    try:
+        assert log.read() == entries
+        assert log.read(40, 5) == entries[40:45]
+        assert log.read_seqs([7, 3, 99, 500]) == [entries[3], entries[7], entries[99]]
+        assert log.read_cursor(1700000090) == (entries[90:], 100)
+        assert log.find(sender="node1") == entries[1::3]
+    finally:
+        log.close()
+
+
+def test_append_does_not_wait_for_a_read(tmp_path):
+    log = MessageLog(tmp_path / "log")
+    for i in range(10):
+        log.append(entry(i), sync=False)
+    read_located = log._read_located
+    appended = []
+
+    def slow_read(located):
+        # An append from another thread completes while this read runs
+        writer = threading.Thread(target=lambda: appended.append(log.append(entry(10), sync=False)))
+        writer.start()
+        writer.join(timeout=2)
+        return read_located(located)
+    log._read_located = slow_read
+    try:
+        assert len(log.read()) == 10
+        assert appended == [10]
+    finally:
+        log.close()
+
+
+def test_checksum_follows_appends_and_restarts(tmp_path):
+    log = MessageLog(tmp_path / "log", segment_max_bytes=1024)
+    empty = log.checksum()
+    for i in range(50):
+        log.append(entry(i), sync=False)
+    after = log.checksum()
+    assert after != empty
+    log.close()
+
+    data = b"".join(p.read_bytes() for p in sorted((tmp_path / "log").glob("*.jsonl")))
+    assert after == bitwise_crc32(data)
+
+    # Resumed from the snapshot, and rebuilt without one
+    reopened = MessageLog(tmp_path / "log", segment_max_bytes=1024)
+    assert reopened.checksum() == after
+    reopened.append(entry(50), sync=False)
+    assert reopened.checksum() != after
+    changed = reopened.checksum()
+    reopened.close()
+    (tmp_path / "log" / "snapshot.bin").unlink()
+    rebuilt = MessageLog(tmp_path / "log", segment_max_bytes=1024)
+    assert rebuilt.checksum() == changed
+    rebuilt.close()
+
+
+def test_corrupt_line_is_skipped_not_truncated(tmp_path):
+    root = tmp_path / "log"
+    log = MessageLog(root, segment_max_bytes=1024)
+    entries = [entry(i) for i in range(40)]
+    for e in entries:
+        log.append(e, sync=False)
+    log.close()
+
+    segments = sorted(root.glob("*.jsonl"))
+    assert len(segments) > 2
+    first = segments[0]
+    data = bytearray(first.read_bytes())
+    second_line = data.index(b"\n") + 1
+    data[second_line] = 0xFF  # one bad byte in a sealed segment
+    first.write_bytes(bytes(data))
+    with segments[-1].open("ab") as f:
+        f.write(b'{"from": "torn"')  # interrupted append
+    for path in root.glob("*.idx"):
+        path.unlink()
+    (root / "snapshot.bin").unlink()
+
+    reopened = MessageLog(root, segment_max_bytes=1024)
+    try:
+        assert reopened.read() == entries[:1] + entries[2:]
+        assert first.stat().st_size == len(data)
+        assert not segments[-1].read_bytes().endswith(b'"torn"')
+    finally:
+        reopened.close()
+
+    # The rebuilt index is trusted on the next open, gap and all
+    again = MessageLog(root, segment_max_bytes=1024)
+    try:
+        assert again.read() == entries[:1] + entries[2:]
+    finally:
+        again.close()
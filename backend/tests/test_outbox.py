@@ -0,0 +1,58 @@
+# test_outbox.py
+
+from outbox import PRIORITY_BROADCAST, PRIORITY_DIRECT, PRIORITY_EMERGENCY, DutyCycleScheduler, Outbox
+
+
+def test_priority_classes_are_fifo_within_a_class():
+    outbox = Outbox()
+    outbox.put(b"b1", PRIORITY_BROADCAST)
+    outbox.put(b"d1", PRIORITY_DIRECT)
+    outbox.put(b"b2", PRIORITY_BROADCAST)
+    outbox.put(b"e1", PRIORITY_EMERGENCY)
+    assert outbox.frames() == [b"e1", b"d1", b"b1", b"b2"]
+    assert outbox.depth() == {"emergency": 1, "direct": 1, "broadcast": 2}
+
+
+def test_journal_replays_unacked_frames_after_a_crash(tmp_path):
+    path = tmp_path / "outbox.journal"
+    outbox = Outbox(path)
+    sent, inflight, _ = outbox.put_many([b"one", b"two", b"three"])
+    outbox.put(b"ephemeral", durable=False)
+    outbox.ack(outbox.take().id)
+    assert outbox.take().id == inflight
+    # Crash: the journal is never closed cleanly and a record is torn
+    outbox._journal.flush()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x09\x00")
+
+    recovered = Outbox(path)
+    assert recovered.frames() == [b"two", b"three"]
+    assert sent not in recovered
+    assert recovered.put(b"four") > inflight + 1
+    recovered.close()
+    assert Outbox(path).frames() == [b"two", b"three", b"four"]
+
+
+def test_compaction_keeps_only_pending_frames(tmp_path):
+    path = tmp_path / "outbox.journal"
+    outbox = Outbox(path, compact_bytes=256)
+    for i in range(20):
+        outbox.put(f"frame{i}".encode())
+        if i < 18:
+            outbox.ack(outbox.take().id)
+    assert path.stat().st_size < 256
+    outbox.close()
+    assert Outbox(path).frames() == [b"frame18", b"frame19"]
+
+
+def test_duty_cycle_scheduler_allows_bursts_then_waits():
+    now = [0.0]
+    scheduler = DutyCycleScheduler(duty_cycle=0.01, window=100.0, clock=lambda: now[0])
+    assert scheduler.delay(0.5) == 0.0
+    scheduler.consume(0.8)
+    assert abs(scheduler.delay(0.5) - 30.0) < 1e-9
+    assert abs(scheduler.drain_time(0.5) - 30.5) < 1e-9
+    now[0] = 30.0
+    assert abs(scheduler.delay(0.5)) < 1e-9
+    now[0] = 1000.0
+    assert scheduler.available() == 1.0
@@ -0,0 +1,64 @@
+# test_parser.py
+
+import os
+
+from parser import Parser, _CRC_CACHE
+
+
+def bitwise_crc32(data: bytes) -> str:
+    """
+    The original bit-by-bit file_crc32 engine, kept as the reference.
+    """
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 1:
+                crc = (crc >> 1) ^ 0xEDB88320
+            else:
+                crc >>= 1
+    return format(crc & 0xFFFFFFFF, '08X')
+
+
+LINE = b'{"from": "HDE Team", "timestamp": 1625251200, "chunk_batch": 1, "chunk": [{"id": 1, "message": "Hello"}]}\n'
+
+
+def test_file_crc32_matches_the_original(tmp_path):
+    path = tmp_path / "messages.json"
+    path.write_bytes(LINE * 40)
+    _CRC_CACHE.clear()
+    assert Parser.file_crc32(path) == bitwise_crc32(path.read_bytes())
+    assert Parser.file_crc32(tmp_path / "missing.json") == "FILE_NOT_FOUND"
+
+
+def test_file_crc32_reads_only_appended_bytes(tmp_path):
+    path = tmp_path / "messages.json"
+    path.write_bytes(LINE * 40)
+    _CRC_CACHE.clear()
+    Parser.file_crc32(path)
+    original = path.read_bytes()
+
+    # Flip a byte well before the cached tail, then append: the prefix is
+    # not reread, so the result is still the checksum of the original bytes
+    with path.open("r+b") as f:
+        f.write(b"[")
+        f.seek(0, os.SEEK_END)
+        f.write(LINE)
+    assert Parser.file_crc32(path) == bitwise_crc32(original + LINE)
+
+    _CRC_CACHE.clear()
+    assert Parser.file_crc32(path) == bitwise_crc32(path.read_bytes())
+
+
+def test_file_crc32_rehashes_a_rewritten_file(tmp_path):
+    path = tmp_path / "messages.json"
+    path.write_bytes(LINE * 40)
+    _CRC_CACHE.clear()
+    Parser.file_crc32(path)
+
+    # Same size, different bytes in the cached tail: falls back to a full hash
+    data = bytearray(LINE * 41)
+    data[-10] ^= 0xFF
+    path.write_bytes(bytes(data))
+    os.utime(path, ns=(1, 1))
+    assert Parser.file_crc32(path) == bitwise_crc32(bytes(data))
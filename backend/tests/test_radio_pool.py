@@ -0,0 +1,25 @@
+# test_radio_pool.py
+
+from conftest import wait_for
+from radio_pool import RadioPool
+from sim_radio import SimChannel
+
+
+def test_configure_keeps_each_radios_channel():
+    channel = SimChannel()
+    radios = [channel.add_node() for _ in range(3)]
+    for radio, (frequency, sf) in zip(radios, [(433.175, 7), (434.665, 9), (433.775, 7)]):
+        radio.set_frequency(frequency)
+        radio.set_spreading_factor(sf)
+    pool = RadioPool(radios, ["rx", "tx", "tx"], pinned=[(), ["spreading_factor"], ()])
+    pool.set_state("receive")
+    try:
+        pool.configure(spreading_factor=10, frequency=868.1)
+        assert wait_for(lambda: radios[0].spreading_factor == 10 and radios[2].spreading_factor == 10)
+        assert radios[1].spreading_factor == 9
+        assert [r.frequency for r in radios] == [433.175, 434.665, 433.775]
+
+        pool.configure(radio=1, spreading_factor=11)
+        assert wait_for(lambda: radios[1].spreading_factor == 11)
+    finally:
+        pool.shutdown()
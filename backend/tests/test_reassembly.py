@@ -0,0 +1,42 @@
+# test_reassembly.py
+
+from reassembly import Reassembler
+
+
+def test_last_chunks_of_a_burst_are_snapshotted(tmp_path):
+    path = tmp_path / "partials.json"
+    reassembler = Reassembler(persist_path=path, flush_interval=5.0)
+    reassembler.add("a", 1, 1, 3, b"one", 1700000000, now=100.0)
+    reassembler.add("a", 1, 2, 3, b"two", 1700000000, now=106.0)
+    reassembler.add("b", 2, 1, 2, b"uno", 1700000000, now=107.0)  # burst ends here
+    # No further chunk arrives: the timer tick writes the snapshot
+    reassembler.tick(now=112.0)
+    restored = Reassembler(persist_path=path)
+    assert sorted(restored.partials) == [("a", 1), ("b", 2)]
+
+
+def test_stop_writes_pending_partials(tmp_path):
+    path = tmp_path / "partials.json"
+    reassembler = Reassembler(persist_path=path)
+    reassembler.start()
+    reassembler.add("a", 1, 1, 2, b"one", 1700000000)
+    reassembler.stop()
+    assert list(Reassembler(persist_path=path).partials) == [("a", 1)]
+
+
+def test_snapshot_of_another_version_is_ignored(tmp_path):
+    path = tmp_path / "partials.json"
+    path.write_text('{"1|a": {"count": 2, "timestamp": 1700000000, "chunks": ["one", null]}}')
+    assert Reassembler(persist_path=path).partials == {}
+    path.write_text('{"version": 99, "partials": {}}')
+    assert Reassembler(persist_path=path).partials == {}
+
+
+def test_binary_chunks_survive_a_restart(tmp_path):
+    path = tmp_path / "partials.json"
+    reassembler = Reassembler(persist_path=path)
+    reassembler.start()
+    reassembler.add("a", 1, 1, 2, bytes(range(256)), 1700000000)
+    reassembler.stop()
+    restored = Reassembler(persist_path=path)
+    assert restored.add("a", 1, 2, 2, b"!", 1700000000).payload() == bytes(range(256)) + b"!"
@@ -0,0 +1,87 @@
+# test_sync.py
+
+import json
+
+import pytest
+
+from gateway import Gateway
+from sync import HttpPeer, peer_origin
+
+
+class LoopbackPeer(HttpPeer):
+    """
+    HttpPeer answered by another Gateway in-process (see bench_sync).
+    """
+    def __init__(self, gateway: Gateway):
+        super().__init__("http://loopback")
+        self.handlers = {"/api/sync/summary": gateway.sync_summary, "/api/sync/ids": gateway.sync_ids,
+                         "/api/sync/fetch": gateway.sync_fetch, "/api/sync/push": gateway.sync_push}
+
+    def _post(self, path: str, body: dict) -> dict:
+        return json.loads(json.dumps(self.handlers[path](json.loads(json.dumps(body)))))
+
+
+def entry(sender: str, i: int) -> dict:
+    return {"from": sender, "timestamp": 1700000000 + i, "chunk_batch": i + 1,
+            "chunk": [{"id": 1, "message": f"message {i} from {sender}"}]}
+
+
+def test_peer_urls_must_be_http():
+    assert peer_origin("HTTP://Node-2:5000/") == "http://node-2:5000"
+    assert peer_origin("https://node-2") == "https://node-2:443"
+    for url in ("file:///etc/passwd", "ftp://node-2/", "node-2:5000", "http://"):
+        with pytest.raises(ValueError):
+            peer_origin(url)
+    with pytest.raises(ValueError):
+        HttpPeer("file:///etc/passwd")
+
+
+def test_sync_only_with_configured_peers(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False, sync_peers=["http://node-2:5000"])
+    try:
+        assert gateway.sync_allowed("http://node-2:5000/")
+        assert not gateway.sync_allowed("http://169.254.169.254/")
+        assert not gateway.sync_allowed("file:///etc/passwd")
+        with pytest.raises(ValueError):
+            gateway.sync_with("http://127.0.0.1:22")
+    finally:
+        gateway.shutdown()
+
+
+def test_push_needs_the_token_or_a_peer_address(tmp_path):
+    gateway = Gateway(tmp_path / "gw", node_name="gw", index=False, sync_peers=["http://127.0.0.1:5000"])
+    tokened = Gateway(tmp_path / "gw2", node_name="gw2", index=False, sync_peers=[], sync_token="s3cret")
+    try:
+        assert gateway.sync_authorized("127.0.0.1")
+        assert not gateway.sync_authorized("10.0.0.9")
+        assert tokened.sync_authorized("10.0.0.9", "Bearer s3cret")
+        assert not tokened.sync_authorized("10.0.0.9", "Bearer guess")
+        assert not tokened.sync_authorized("127.0.0.1")
+    finally:
+        gateway.shutdown()
+        tokened.shutdown()
+
+
+def test_sync_converges_two_divergent_logs(tmp_path):
+    first = Gateway(tmp_path / "gw0", node_name="gw0", index=False, sync="lan")
+    second = Gateway(tmp_path / "gw1", node_name="gw1", index=False, sync="lan")
+    try:
+        shared = [entry("node1", i) for i in range(50)]
+        for e in shared + [entry("gw0", i) for i in range(5)]:
+            first.message_log.append(e, sync=False)
+        for e in shared + [entry("gw1", i) for i in range(3)]:
+            second.message_log.append(e, sync=False)
+
+        result = first.sync_with("http://loopback", peer=LoopbackPeer(second))
+        assert (result["received"], result["sent"]) == (3, 5)
+        logs = [sorted((e["from"], e["timestamp"], e["chunk"][0]["message"]) for e in g.message_log.read())
+                for g in (first, second)]
+        assert logs[0] == logs[1]
+        assert len(logs[0]) == 58
+        # Nothing left to move the second time round
+        result = second.sync_with("http://loopback", peer=LoopbackPeer(first))
+        assert len(second.message_log) == len(first.message_log) == 58
+        assert (result["received"], result["sent"]) == (0, 0)
+    finally:
+        first.shutdown()
+        second.shutdown()
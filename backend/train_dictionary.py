@@ -0,0 +1,94 @@
+# train_dictionary.py
+#
+# Builds a preset compression dictionary from the message log and saves it
+# as the next version in messages/dict/<id>.bin. Copy the file to every
+# node, then set HDE_COMPRESSION_DICT=<id> to have senders use it.
+# Usage: python train_dictionary.py [--size 2048] [--log messages/log]
+
+import argparse
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import compression
+from message_log import MessageLog
+
+
+def message_texts(log: MessageLog):
+    for entry in log.read():
+        if not isinstance(entry, dict):
+            continue
+        if entry.get("message"):
+            yield entry["message"]
+        for chunk in entry.get("chunk") or []:
+            if chunk.get("message"):
+                yield chunk["message"]
+        if entry.get("from"):
+            yield entry["from"]
+
+
+def build_dictionary(texts: list, size: int) -> bytes:
+    """
+    Scores word n-grams by frequency * length and keeps the best ones up to
+    `size` bytes, most valuable last where zlib reaches them cheapest.
+    """
+    scores = Counter()
+    for text in texts:
+        words = text.split()
+        for n in range(1, 6):
+            for i in range(len(words) - n + 1):
+                gram = " ".join(words[i:i + n]) + " "
+                scores[gram] += len(gram.encode("utf-8"))
+
+    chosen, used = [], 0
+    for gram, score in scores.most_common():
+        if score <= len(gram) * 2:
+            break  # seen only once
+        if any(gram in c for c in chosen):
+            continue
+        encoded = gram.encode("utf-8")
+        if used + len(encoded) > size:
+            continue
+        chosen.append(gram)
+        used += len(encoded)
+    return "".join(reversed(chosen)).encode("utf-8")
+
+
+def ratio(texts: list, zdict: bytes) -> float:
+    raw = packed = 0
+    for text in texts:
+        data = text.encode("utf-8")
+        c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, zdict) if zdict \
+            else zlib.compressobj(9, zlib.DEFLATED, -15, 9)
+        raw += len(data)
+        packed += min(len(data), 1 + len(c.compress(data) + c.flush()))
+    return packed / raw if raw else 1.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--log", type=Path, default=Path("messages") / "log")
+    ap.add_argument("--out", type=Path, default=compression.DICT_DIR)
+    ap.add_argument("--size", type=int, default=2048)
+    args = ap.parse_args()
+
+    log = MessageLog(args.log)
+    texts = list(message_texts(log))
+    log.close()
+    if not texts:
+        print("No messages to train on.")
+        return
+
+    compression.load_dictionaries(args.out)
+    zdict = build_dictionary(texts, args.size)
+    dict_id = compression.latest_dictionary() + 1
+    args.out.mkdir(parents=True, exist_ok=True)
+    (args.out / f"{dict_id}.bin").write_bytes(zdict)
+
+    print(f"trained on {len(texts)} messages, dictionary {dict_id}: {len(zdict)} bytes")
+    print(f"size ratio: none {ratio(texts, b''):.2f}  "
+          f"default {ratio(texts, compression.DEFAULT_DICTIONARY):.2f}  trained {ratio(texts, zdict):.2f}")
+
+
+if __name__ == "__main__":
+    main()
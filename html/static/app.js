@@ -32,6 +32,30 @@ async function getChecksum() {
   }
 }
 
+function setStatusField(name, text) {
+  const element = document.getElementById(`status-${name}`);
+  if (element) element.textContent = text;
+}
+
+function showStatus(status) {
+  setStatusField("rssi", status.rssi == null ? "" : `📶 ${status.rssi} dBm`);
+  setStatusField("snr", status.snr == null ? "" : `SNR ${status.snr} dB`);
+  setStatusField("server_state", `📡 ${status.state}`);
+  setStatusField("tx_queue_depth", status.tx_queue_depth ? `⏳ ${status.tx_queue_depth} queued` : "");
+}
+
+function fetchStatus() {
+  return fetch("/api/status")
+    .then(response => {
+      if (!response.ok) throw new Error("Status fetch failed");
+      return response.json();
+    })
+    .then(showStatus)
+    .catch(error => {
+      console.error("Status fetch error:", error);
+    });
+}
+
 function getCookie(name) {
   const match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
   return match ? decodeURIComponent(match[1]) : null;
@@ -77,7 +101,7 @@ async function send() {
       console.log("Message sent:", data);
       messageStatus("sent");
       document.getElementById("messageInput").value = ""; // clear input
-      fetchMessages(); // Refresh messages
+      if (!window.EventSource) fetchMessages(); // pushed otherwise
     })
     .catch(error => {
       console.error("Send error:", error);
@@ -85,40 +109,141 @@ async function send() {
     });
 }
 
-function fetchMessages() {
-  fetch(`/api/messages/${conversation}`)
+let messagesCursor = 0;
+let messagesEtag = null;
+let olderCursor = null; // keyset cursor for scrolling back, null when exhausted
+let loadingOlder = false;
+
+function renderEntries(entries, prepend = false) {
+  const messagesContainer = document.getElementById("messages");
+  if (!messagesContainer) {
+    console.error("Element with ID 'messages' not found.");
+    return;
+  }
+
+  const from_user = getCookie("username");
+  const fragment = document.createDocumentFragment();
+
+  entries.forEach(entry => {
+    const from = entry.from || "Unknown";
+    const chunk = entry.chunk || (entry.message ? [{ message: entry.message }] : []);
+
+    chunk.forEach(msg => {
+      const messageElement = document.createElement("div");
+      messageElement.innerHTML = `<strong>${from}</strong>: ${msg.message}`;
+      messageElement.className = from === from_user ? "sent" : "messageReceived";
+      fragment.appendChild(messageElement);
+    });
+  });
+
+  if (prepend) {
+    messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+  } else {
+    messagesContainer.appendChild(fragment);
+  }
+}
+
+// Latest page from the message index; falls back to the whole log when the
+// index is disabled.
+function loadLatestMessages() {
+  return fetch("/api/messages?limit=50")
     .then(response => {
-      if (!response.ok) throw new Error("Fetch failed");
+      if (!response.ok) throw new Error("Message index unavailable");
       return response.json();
     })
     .then(data => {
+      renderEntries(data.data.slice().reverse());
+      olderCursor = data.next;
+      messagesCursor = data.latest + 1;
       const messagesContainer = document.getElementById("messages");
-      if (!messagesContainer) {
-        console.error("Element with ID 'messages' not found.");
-        return;
-      }
-
-      messagesContainer.innerHTML = ""; // Clear previous
+      if (messagesContainer) messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    })
+    .catch(error => {
+      console.warn(error.message, "- loading full history");
+      return fetchMessages();
+    });
+}
 
-      const from_user = getCookie("username");
+function loadOlderMessages() {
+  if (!olderCursor || loadingOlder) return;
+  loadingOlder = true;
+  const messagesContainer = document.getElementById("messages");
+  fetch(`/api/messages?limit=50&before=${encodeURIComponent(olderCursor)}`)
+    .then(response => {
+      if (!response.ok) throw new Error("Fetch failed");
+      return response.json();
+    })
+    .then(data => {
+      // Keep the view anchored on what the user was reading
+      const previousHeight = messagesContainer.scrollHeight;
+      renderEntries(data.data.slice().reverse(), true);
+      messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+      olderCursor = data.next;
+    })
+    .catch(error => {
+      console.error("Error loading older messages:", error);
+    })
+    .finally(() => {
+      loadingOlder = false;
+    });
+}
 
-      data.data.forEach(entry => {
-        const from = entry.from || "Unknown";
-        const chunk = entry.chunk || [];
+function fetchMessages() {
+  const headers = {};
+  if (messagesEtag) headers["If-None-Match"] = messagesEtag;
 
-        chunk.forEach(msg => {
-          const messageElement = document.createElement("div");
-          messageElement.innerHTML = `<strong>${from}</strong>: ${msg.message}`;
-          messageElement.className = from === from_user ? "sent" : "messageReceived";
-          messagesContainer.appendChild(messageElement);
-        });
-      });
+  return fetch(`/api/messages/${conversation}?since=${messagesCursor}`, { headers })
+    .then(response => {
+      if (response.status === 304) return null; // nothing new
+      if (!response.ok) throw new Error("Fetch failed");
+      messagesEtag = response.headers.get("ETag");
+      return response.json();
+    })
+    .then(data => {
+      if (!data) return;
+      if (typeof data.next === "number") messagesCursor = data.next;
+      renderEntries(data.data);
+      if (data.more) {
+        // The ETag covers the whole log, not this page: fetch the next one unconditionally
+        messagesEtag = null;
+        return fetchMessages();
+      }
     })
     .catch(error => {
       console.error("Error loading messages:", error);
     });
 }
 
+// Status arrives on the event stream; it is polled only while the stream is down
+let statusTimer = null;
+
+function pollStatus(on) {
+  if (on && !statusTimer) {
+    fetchStatus();
+    statusTimer = setInterval(fetchStatus, 5000);
+  } else if (!on && statusTimer) {
+    clearInterval(statusTimer);
+    statusTimer = null;
+  }
+}
+
+function subscribeMessages() {
+  const source = new EventSource(`/api/events?since=${messagesCursor}`);
+  source.addEventListener("message", event => {
+    const seq = Number(event.lastEventId);
+    if (seq < messagesCursor) return; // already rendered
+    messagesCursor = seq + 1;
+    renderEntries([JSON.parse(event.data)]);
+  });
+  source.addEventListener("status", event => showStatus(JSON.parse(event.data)));
+  source.onopen = () => pollStatus(false);
+  source.onerror = () => {
+    console.warn("Message stream interrupted, reconnecting...");
+    pollStatus(true);
+  };
+  return source;
+}
+
 function notifyUser(message) {
   let bubble = document.getElementById("notificationBubble");
   if (!bubble) {
@@ -155,6 +280,18 @@ document.addEventListener("DOMContentLoaded", async () => {
     });
   }
 
-  fetchMessages();
-  setInterval(fetchMessages, 5000);
+  const messagesContainer = document.getElementById("messages");
+  if (messagesContainer) {
+    messagesContainer.addEventListener("scroll", () => {
+      if (messagesContainer.scrollTop < 100) loadOlderMessages();
+    });
+  }
+
+  await loadLatestMessages();
+  if (window.EventSource) {
+    subscribeMessages();
+  } else {
+    pollStatus(true);
+    setInterval(fetchMessages, 5000);
+  }
 });